@@ -5,14 +5,27 @@ imported from the flask package
 from flask import Flask, request, session
 from flask_session import Session
 from config import Config
+from charting.lazy import LazyObject
 from flask_login import LoginManager
-from .models.engine.db_engine import DBEngine
+from .models.engine import create_engine
 from .models.user import User
+from .utils.chart_cache import ChartCache
+from .utils.render import ChartRenderer
 
 app = Flask(__name__)
 app.config.from_object(Config)
 Session(app)
-db = DBEngine()
+# The engine opens the database on first use, so that importing the app,
+# or a module under it such as app.demo, creates no database files.
+db = LazyObject(lambda: create_engine(app.config))
+chart_cache = ChartCache(max_bytes=app.config['CHART_CACHE_BYTES'],
+                         directory=app.config['CHART_CACHE_DIR'],
+                         max_disk_bytes=app.config['CHART_CACHE_DISK_BYTES'])
+chart_renderer = ChartRenderer(
+    workers=app.config['CHART_WORKERS'],
+    timeout=app.config['CHART_TIMEOUT'],
+    max_tasks_per_child=app.config['CHART_WORKER_MAX_TASKS'],
+)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
@@ -27,10 +40,17 @@ def load_user(user_id):
 @app.before_request
 def pre_request():
     db.reload()
+    # Read the same version of the data throughout the request
+    db.pin()
     if start_date := request.args.get('startDate'):
         session['start_date'] = start_date
     if end_date := request.args.get('endDate'):
         session['end_date'] = end_date
 
 
-from app import routes, models
+@app.teardown_request
+def post_request(exception):
+    db.unpin()
+
+
+from app import routes, models, cli
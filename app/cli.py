@@ -0,0 +1,81 @@
+"""Command line tools registered with the `flask` command."""
+import json
+import click
+from app import app, db
+from .models.engine import SQLiteEngine, sqlite_path
+from .utils.bulk_import import FORMATS, detect_format, import_transactions
+from .utils.export import FORMATS as EXPORT_FORMATS, export_transactions
+
+
+@app.cli.command('import-json')
+@click.argument('source', default='db.json')
+@click.option('--target', default=None,
+              help='SQLite database file. Defaults to SQLALCHEMY_DATABASE_URI.')
+def import_json(source, target):
+    """Import a db.json file into an SQLite database."""
+    if target is None:
+        target = sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    with open(source, encoding='utf-8') as f:
+        data = json.load(f)
+    engine = SQLiteEngine(target)
+    n_users = engine.import_json(data)
+    engine.save()
+    click.echo(f'Imported {n_users} user(s) from {source} into {target}')
+
+
+@app.cli.command('import-transactions')
+@click.argument('username')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--profile', default=None,
+              help="The profile to import into. Defaults to the user's default profile.")
+@click.option('--account', default=None,
+              help='The account of rows that do not name one, and of OFX transactions.')
+@click.option('--format', 'format_', type=click.Choice(FORMATS), default=None,
+              help='The format of SOURCE. Guessed from its extension by default.')
+def import_transactions_command(username, source, profile, account, format_):
+    """Import the transactions of a CSV or OFX file."""
+    user = db.get_user_by_username(username)
+    if user is None:
+        raise click.ClickException(f"The user '{username}' does not exist")
+    profile = profile or user.default_profile
+    with open(source, encoding='utf-8-sig', newline='') as f:
+        try:
+            report = import_transactions(username, profile, f,
+                                         format_ or detect_format(source),
+                                         account)
+        except (ValueError, KeyError) as e:
+            raise click.ClickException(str(e))
+    for line, message in report.errors:
+        click.echo(f'{source}:{line}: {message}', err=True)
+    click.echo(f'Imported {report.imported} transaction(s) from {source}'
+               f' into {username}/{profile}, {len(report.errors)} row(s) rejected')
+
+
+@app.cli.command('export-transactions')
+@click.argument('username')
+@click.argument('output', type=click.File('w', encoding='utf-8', lazy=True),
+                default='-')
+@click.option('--profile', default=None,
+              help="The profile to export. Defaults to the user's default profile.")
+@click.option('--format', 'format_', type=click.Choice(list(EXPORT_FORMATS)),
+              default='csv')
+@click.option('--account', default=None)
+@click.option('--category', default=None,
+              type=click.Choice(['incomes', 'expenses', 'transfers']))
+@click.option('--subcategory', default=None)
+@click.option('--from', 'from_', default=None, help='YYYY-MM-DD')
+@click.option('--to', default=None, help='YYYY-MM-DD')
+def export_transactions_command(username, output, profile, format_, account,
+                                category, subcategory, from_, to):
+    """Export transactions as CSV or JSON lines to OUTPUT (stdout by default)."""
+    user = db.get_user_by_username(username)
+    if user is None:
+        raise click.ClickException(f"The user '{username}' does not exist")
+    profile = profile or user.default_profile
+    try:
+        chunks = export_transactions(username, profile, format_, account,
+                                     category, subcategory, from_, to)
+    except (ValueError, KeyError) as e:
+        raise click.ClickException(str(e))
+    for chunk in chunks:
+        output.write(chunk)
@@ -1,63 +1,92 @@
 """
-Create a demo user in the db with sample data.
+Create demo users in a database with sample data.
+
+Usage: python -m app.demo [--db demo.json] [--layout single] [--users 1]
+       [--profiles 1] [--accounts 3] [--transactions 1000] [--seed 0]
+
+Data is written to the database given by --db, not to the database of
+the app, so large data sets can be generated for testing and
+benchmarking without touching real data. The same seed always produces
+the same data. Users are named 'demo', 'demo2', 'demo3', ... and have
+the password 'demo'.
 """
+import argparse
+import math
 import random
 from datetime import datetime, timedelta
-from app import db
+from werkzeug.security import generate_password_hash
+from config import Config
+from app.models.engine import DBEngine, create_engine
+from app.models.user import User
 
 ACCOUNTS = ['cash', 'pay pal', 'bank']
+PROFILES = ['personal', 'work', 'business']
 INCOME_SOURCES = ['Turing', 'Upwork', 'Business', 'misc']
 EXPENSES = ['food', 'travel', 'entertainment', 'shopping', 'pet']
 D1 = datetime(2020, 1, 1)
 D2 = datetime(2024, 2, 15)
-N_TRANSACTIONS = 1000  # The number of transactions to generate
+N_TRANSACTIONS = 1000  # The default number of transactions per profile
 USERNAME = 'demo'
-PROFILE = 'personal'
+PASSWORD = 'demo'
+# Large enough that expenses never exhaust an account
+INITIAL_BALANCE = 10 ** 12
+# The share of expenses that are moved to the following weekend
+WEEKEND_SHIFT = 0.3
 
 
-def random_date(start_date: datetime, end_date: datetime) -> str:
+def random_date(start_date: datetime, end_date: datetime,
+                rng: random.Random = random) -> str:
     """
-    Generate a random timestamp between start_year and end_year.
+    Generate a random date between start_date and end_date.
 
-    Args:
-        start_date (int): Start year for the timestamp.
-        end_date (int): End year for the timestamp.
+    Dates are skewed towards @end_date, the way activity on an account
+    tends to grow over time: the density rises linearly from the start
+    to the end of the period.
 
     Returns:
-        datetime: Random timestamp str in the format %Y-%m-%d.
+        str: Random date in the format %Y-%m-%d.
     """
     time_difference = end_date - start_date
-    random_days = random.randint(0, time_difference.days)
+    random_days = int(time_difference.days * math.sqrt(rng.random()))
 
     random_timestamp = start_date + timedelta(days=random_days)
 
     return random_timestamp.strftime('%Y-%m-%d')
 
 
-def generate_expense(category):
+def generate_expense(category, rng: random.Random = random):
     if category == 'food':
-        return random.randint(100, 1000)
+        return rng.randint(100, 1000)
     elif category in ('travel', 'entertainment'):
-        return random.randint(1000, 5000)
+        return rng.randint(1000, 5000)
     elif category == 'shopping':
-        return random.randint(300, 3000)
+        return rng.randint(300, 3000)
     elif category == 'pet':
-        return random.randint(500, 1000)
+        return rng.randint(500, 1000)
 
 
-def generate_income():
-    return random.randint(1000, 5000)
+def generate_income(rng: random.Random = random):
+    return rng.randint(1000, 5000)
 
 
-def random_transaction(category, start_date, end_date):
-    account = random.choice(ACCOUNTS)
-    date = random_date(start_date, end_date)
+def random_transaction(category, start_date, end_date,
+                       rng: random.Random = random, accounts=ACCOUNTS):
+    account = rng.choice(accounts)
+    date = random_date(start_date, end_date, rng)
     if category == 'incomes':
-        subcategory = random.choices(INCOME_SOURCES, weights=[0.1, 0.4, 0.3, 0.2])[0]
-        amount = generate_income()
+        subcategory = rng.choices(INCOME_SOURCES, weights=[0.1, 0.4, 0.3, 0.2])[0]
+        amount = generate_income(rng)
+        if subcategory == 'Turing':
+            # Salaries are paid at the start of the month
+            date = date[:8] + '01'
     elif category == 'expenses':
-        subcategory = random.choices(EXPENSES, weights=[0.3, 0.2, 0.2, 0.2, 0.1])[0]
-        amount = generate_expense(subcategory)
+        subcategory = rng.choices(EXPENSES, weights=[0.3, 0.2, 0.2, 0.2, 0.1])[0]
+        amount = generate_expense(subcategory, rng)
+        if rng.random() < WEEKEND_SHIFT:
+            # Spending is heavier at weekends
+            day = datetime.fromisoformat(date)
+            day += timedelta(days=max(0, 5 - day.weekday()))
+            date = min(day, end_date).strftime('%Y-%m-%d')
     else:
         raise ValueError(f'Unknown category: "{category}"')
 
@@ -76,24 +105,97 @@ def random_transaction(category, start_date, end_date):
     return t
 
 
-def add_transactions():
+def add_transactions(db: DBEngine, username, profile, n=N_TRANSACTIONS,
+                     start_date=D1, end_date=D2, rng: random.Random = random,
+                     accounts=ACCOUNTS):
     """Insert random transactions into the specified profile."""
     categories = ['incomes', 'expenses']
-    for i in range(N_TRANSACTIONS):
-        category = random.choices(categories, weights=[0.6, 0.4])[0]
-        transaction = random_transaction(category, D1, D2)
-        db.add_transaction(USERNAME, PROFILE, category, **transaction)
+    with db.batch():
+        for i in range(n):
+            category = rng.choices(categories, weights=[0.6, 0.4])[0]
+            transaction = random_transaction(category, start_date, end_date,
+                                             rng, accounts)
+            db.add_transaction(username, profile, category, **transaction)
 
 
-if __name__ == '__main__':
-    # Add profile
-    if PROFILE not in db.get_profiles(USERNAME):
-        db.add_profile(USERNAME, PROFILE, default=True)
-    # Add accounts
-    for account in ACCOUNTS:
-        if account not in db.get_accounts(USERNAME, PROFILE):
-            db.add_account(USERNAME, PROFILE, account, balance=100000)
-    # Generate transactions and add them to the database
-    add_transactions()
+def names(base: list[str], n: int, prefix: str) -> list[str]:
+    """Return @n names, taken from @base first and then numbered."""
+    return base[:n] + [f'{prefix} {i}' for i in range(len(base) + 1, n + 1)]
+
+
+def generate(db: DBEngine, users=1, profiles=1, accounts=3,
+             transactions=N_TRANSACTIONS, start_date=D1, end_date=D2,
+             seed=0) -> int:
+    """
+    Add demo users with random transactions to a database.
+
+    :param db: the database to write to
+    :param users: the number of users to create
+    :param profiles: the number of profiles per user
+    :param accounts: the number of accounts per profile
+    :param transactions: the number of transactions per profile
+    :param seed: the seed of the random number generator
+    :return: the number of transactions added
+    """
+    rng = random.Random(seed)
+    # Hashing is deliberately slow, and every demo user has the same
+    # password, so hash it once
+    password = generate_password_hash(PASSWORD)
+    account_names = names(ACCOUNTS, accounts, 'account')
+    for i in range(1, users + 1):
+        username = USERNAME if i == 1 else f'{USERNAME}{i}'
+        db.add_user(User(username, f'{username}@example.com', password))
+        for profile in names(PROFILES, profiles, 'profile'):
+            if profile not in db.get_profiles(username):
+                db.add_profile(username, profile)
+            for account in account_names:
+                db.add_account(username, profile, account,
+                               balance=INITIAL_BALANCE)
+            add_transactions(db, username, profile, transactions,
+                             start_date, end_date, rng, account_names)
+    return users * profiles * transactions
+
+
+def open_engine(layout, path) -> DBEngine:
+    """
+    Open a database at @path, independently of the app's database.
+
+    :param layout: 'single', 'sharded' or 'sqlite'. See Config.DB_LAYOUT
+    :param path: the database file, or the shard directory for 'sharded'
+    """
+    config = {k: getattr(Config, k) for k in dir(Config) if k.isupper()}
+    config.update(DB_LAYOUT=layout, DB_FILE=path, DB_SHARD_DIR=path,
+                  SQLALCHEMY_DATABASE_URI='sqlite:///' + path,
+                  DB_JOURNAL=False)
+    return create_engine(config)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', default='demo.json',
+                        help='the database to write to')
+    parser.add_argument('--layout', default='single',
+                        choices=['single', 'sharded', 'sqlite'])
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--profiles', type=int, default=1,
+                        help='the number of profiles per user')
+    parser.add_argument('--accounts', type=int, default=len(ACCOUNTS),
+                        help='the number of accounts per profile')
+    parser.add_argument('--transactions', type=int, default=N_TRANSACTIONS,
+                        help='the number of transactions per profile')
+    parser.add_argument('--start', type=datetime.fromisoformat, default=D1,
+                        help='the earliest transaction date (YYYY-MM-DD)')
+    parser.add_argument('--end', type=datetime.fromisoformat, default=D2,
+                        help='the latest transaction date (YYYY-MM-DD)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db = open_engine(args.layout, args.db)
+    n = generate(db, args.users, args.profiles, args.accounts,
+                 args.transactions, args.start, args.end, args.seed)
     db.save()
-    print("Transactions successfully added to demo account")
+    print(f"{n} transactions successfully added to {args.db}")
+
+
+if __name__ == '__main__':
+    main()
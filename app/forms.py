@@ -2,6 +2,7 @@ import datetime
 import re
 from app import db
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, FloatField, SelectField, DateField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, InputRequired
 
@@ -77,3 +78,16 @@ class AddProfileForm(FlaskForm):
     description = StringField('Description')
     submit = SubmitField('Add Profile')
     set_as_default = BooleanField('Set as Default Profile?', default=False)
+
+class ImportTransactionsForm(FlaskForm):
+    file = FileField('CSV or OFX File', validators=[
+        FileRequired(),
+        FileAllowed(['csv', 'ofx', 'qfx'], 'Only CSV and OFX files can be imported')
+    ])
+    account = SelectField('Account of rows that do not name one', coerce=str)
+    submit = SubmitField('Import Transactions')
+
+    def __init__(self, *args, user_accounts=None, **kwargs):
+        super(ImportTransactionsForm, self).__init__(*args, **kwargs)
+        if user_accounts is not None:
+            self.account.choices = [(account, account) for account in user_accounts]
@@ -0,0 +1,26 @@
+from .db_engine import DBEngine
+from .sharded_engine import ShardedDBEngine
+from .sqlite_engine import SQLiteEngine
+
+
+def create_engine(config) -> DBEngine:
+    """Create the storage engine selected by the app configuration."""
+    if config['DB_LAYOUT'] == 'sqlite':
+        return SQLiteEngine(sqlite_path(config['SQLALCHEMY_DATABASE_URI']))
+    if config['DB_LAYOUT'] == 'sharded':
+        return ShardedDBEngine(config['DB_SHARD_DIR'],
+                               cache_bytes=config['DB_SHARD_CACHE_BYTES'])
+    if config['DB_LAYOUT'] == 'single':
+        return DBEngine(config['DB_FILE'], journal=config['DB_JOURNAL'],
+                        compact_threshold=config['DB_JOURNAL_COMPACT_BYTES'],
+                        group_commit_ms=config['DB_GROUP_COMMIT_MS'],
+                        group_commit_size=config['DB_GROUP_COMMIT_SIZE'])
+    raise ValueError(f"Unknown database layout '{config['DB_LAYOUT']}'")
+
+
+def sqlite_path(uri: str) -> str:
+    """Extract the database file path from an 'sqlite:///' URI."""
+    prefix = 'sqlite:///'
+    if not uri.startswith(prefix):
+        raise ValueError(f"'{uri}' is not an SQLite database URI")
+    return uri[len(prefix):]
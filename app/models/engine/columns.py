@@ -0,0 +1,283 @@
+from datetime import datetime
+import numpy as np
+from .persistent import shallow_copy
+
+# Amounts are stored as integers in hundredths of a unit
+AMOUNT_SCALE = 100
+SECONDS_PER_DAY = 24 * 60 * 60
+# The date with day ordinal 1
+_FIRST_DAY = np.datetime64('0001-01-01', 'D')
+
+
+class TransactionColumns:
+    """
+    Columnar copy of the transactions of a single profile.
+
+    Each transaction record is a row in a set of NumPy arrays:
+
+    - amount: int64, the amount in hundredths of a unit
+    - day: int32, the proleptic Gregorian ordinal of the date
+    - second: int32, the seconds elapsed since the start of the day
+    - category, account, subcategory: int32 codes. The names behind the
+      codes are held in the lists of the same name. Subcategory code 0
+      stands for transactions with no subcategory.
+
+    Rows are kept in time order, so a date range resolves to a slice by
+    binary search. Rows are appended to a buffer and merged into the
+    arrays the next time they are read.
+
+    Running totals of the whole-unit amounts of each category are kept
+    alongside the rows, so the total of a category over any date range
+    is the difference of two of them, found with two binary searches.
+
+    Once the columns are shared between threads, only copy() them to add
+    rows. Reading is then safe from any thread.
+    """
+    _FIELDS = ('amount', 'day', 'second', 'category', 'account', 'subcategory')
+
+    def __init__(self, accounts: dict = None):
+        """
+        Build the columns.
+
+        :param accounts: the 'accounts' dict of a profile
+        """
+        self.categories = []
+        self.accounts = []
+        self.subcategories = [None]
+        self._codes = {'category': {}, 'account': {}, 'subcategory': {None: 0}}
+        # (stamps, arrays, running totals, buffered rows). Kept in a single
+        # attribute, so that merging the buffered rows replaces them all at
+        # once. The running totals map category codes to arrays whose
+        # element i is the sum of the category's amounts in rows [0, i).
+        self._state = (np.empty(0, dtype=np.int64), {
+            'amount': np.empty(0, dtype=np.int64),
+            **{f: np.empty(0, dtype=np.int32) for f in self._FIELDS[1:]}
+        }, {}, [])
+        for account, data in (accounts or {}).items():
+            for category, transactions in data['transactions'].items():
+                for transaction in transactions:
+                    self.append(account, category, transaction)
+
+    def __len__(self):
+        stamps, _, _, pending = self._state
+        return len(stamps) + len(pending)
+
+    def copy(self) -> 'TransactionColumns':
+        """
+        Return a copy to which rows can be added without changing these.
+
+        The arrays are never changed in place, so they are shared, and so
+        are the rows not merged into them yet, until they are changed.
+        """
+        columns = TransactionColumns.__new__(TransactionColumns)
+        columns.categories = self.categories[:]
+        columns.accounts = self.accounts[:]
+        columns.subcategories = self.subcategories[:]
+        columns._codes = {f: dict(codes) for f, codes in self._codes.items()}
+        stamps, arrays, sums, pending = self._state
+        columns._state = (stamps, arrays, sums, shallow_copy(pending))
+        return columns
+
+    def code(self, field, name) -> int | None:
+        """
+        Return the code of a category, account or subcategory name.
+
+        :return: the code, or None if there is no row with that name
+        """
+        if field == 'subcategory' and not name:
+            return 0
+        return self._codes[field].get(name)
+
+    def _intern(self, field, name) -> int:
+        codes = self._codes[field]
+        if name not in codes:
+            codes[name] = len(codes)
+            getattr(self, _PLURALS[field]).append(name)
+        return codes[name]
+
+    def _row(self, account, category, transaction: dict) -> tuple:
+        """Return the row of a transaction, in the order of _FIELDS."""
+        time = datetime.fromisoformat(transaction['time'])
+        return (
+            round(transaction['amount'] * AMOUNT_SCALE),
+            time.toordinal(),
+            time.hour * 3600 + time.minute * 60 + time.second,
+            self._intern('category', category),
+            self._intern('account', account),
+            self._intern('subcategory', transaction.get('subcategory') or None),
+        )
+
+    def append(self, account, category, transaction: dict):
+        """Add a transaction recorded under @account and @category."""
+        self._state[3].append(self._row(account, category, transaction))
+
+    def remove(self, account, category, transaction: dict):
+        """
+        Remove a row added by append() with the same arguments.
+
+        Rows with the same values are interchangeable, so any of them is
+        removed.
+
+        :raises ValueError: if there is no such row
+        """
+        row = self._row(account, category, transaction)
+        # Find the row by binary search among the merged rows
+        stamps, arrays, sums = self._merged()
+        stamp = row[1] * SECONDS_PER_DAY + row[2]
+        lo = np.searchsorted(stamps, stamp, side='left')
+        hi = np.searchsorted(stamps, stamp, side='right')
+        for i in range(lo, hi):
+            if all(arrays[field][i] == value
+                   for field, value in zip(self._FIELDS, row)):
+                break
+        else:
+            raise ValueError('The row does not exist')
+        units = row[0] // AMOUNT_SCALE
+        # The arrays are shared with copies, so they are replaced rather
+        # than changed in place
+        sums = {
+            code: np.concatenate([
+                totals[:i + 1],
+                totals[i + 2:] - (units if code == row[3] else 0)
+            ])
+            for code, totals in sums.items()
+        }
+        self._state = (
+            np.delete(stamps, i),
+            {field: np.delete(array, i) for field, array in arrays.items()},
+            sums, []
+        )
+
+    def _merged(self) -> tuple[np.ndarray, dict[str, np.ndarray], dict]:
+        """
+        Merge buffered rows into the arrays, keeping them in time order.
+
+        Readers in other threads see either the old or the merged arrays.
+        If several merge at once, they compute the same arrays.
+
+        :return: the stamps, the arrays and the running totals
+        """
+        stamps, arrays, sums, pending = self._state
+        if not pending:
+            return stamps, arrays, sums
+        rows = np.array(list(pending), dtype=np.int64)
+        new_stamps = rows[:, 1] * SECONDS_PER_DAY + rows[:, 2]
+        in_order = (
+            np.all(new_stamps[1:] >= new_stamps[:-1])
+            and (not len(stamps) or new_stamps[0] >= stamps[-1])
+        )
+        stamps = np.concatenate([stamps, new_stamps])
+        arrays = {
+            field: np.concatenate([
+                arrays[field], rows[:, i].astype(arrays[field].dtype)
+            ])
+            for i, field in enumerate(self._FIELDS)
+        }
+        if in_order:
+            # Only the running totals of the new rows are computed
+            sums = _running_totals(rows[:, 3], rows[:, 0],
+                                   len(self.categories), sums,
+                                   len(stamps) - len(rows))
+        else:
+            order = np.argsort(stamps, kind='stable')
+            stamps = stamps[order]
+            arrays = {field: array[order] for field, array in arrays.items()}
+            sums = _running_totals(arrays['category'], arrays['amount'],
+                                   len(self.categories))
+        self._state = (stamps, arrays, sums, [])
+        return stamps, arrays, sums
+
+    def select(self, from_: datetime = None, to: datetime = None) -> dict[str, np.ndarray]:
+        """
+        Return the columns of the rows within [from_, to].
+
+        :return: a dict mapping field names to arrays. The arrays are views
+            and must not be modified
+        """
+        stamps, arrays, _ = self._merged()
+        lo, hi = _bounds(stamps, from_, to)
+        return {field: array[lo:hi] for field, array in arrays.items()}
+
+    def total(self, category, from_: datetime = None,
+              to: datetime = None) -> int:
+        """
+        Return the total amount of the rows of @category within [from_, to].
+
+        Amounts are truncated to whole units before they are added up. The
+        total is read from the running totals, so it costs the same for
+        any range.
+        """
+        stamps, _, sums = self._merged()
+        code = self.code('category', category)
+        if code is None:
+            return 0
+        lo, hi = _bounds(stamps, from_, to)
+        return int(sums[code][hi] - sums[code][lo])
+
+
+_PLURALS = {'category': 'categories', 'account': 'accounts',
+            'subcategory': 'subcategories'}
+
+
+def _bounds(stamps: np.ndarray, from_: datetime = None,
+            to: datetime = None) -> tuple[int, int]:
+    """Return the range [lo, hi) of the rows within [from_, to]."""
+    lo, hi = 0, len(stamps)
+    if from_ is not None:
+        lo = int(np.searchsorted(stamps, _stamp(from_, ceil=True), side='left'))
+    if to is not None:
+        hi = int(np.searchsorted(stamps, _stamp(to), side='right'))
+    return lo, hi
+
+
+def _running_totals(categories: np.ndarray, amounts: np.ndarray,
+                    n_categories: int, sums: dict = None,
+                    start: int = 0) -> dict[int, np.ndarray]:
+    """
+    Compute the running totals of the whole-unit amounts of each category.
+
+    :param categories: the category codes of the rows
+    :param amounts: the amounts of the rows, in hundredths of a unit
+    :param n_categories: the number of category codes
+    :param sums: the running totals of the @start rows before these, if
+        the rows are appended to them
+    :return: a dict mapping category codes to running totals
+    """
+    sums = sums or {}
+    units = amounts.astype(np.int64) // AMOUNT_SCALE
+    result = {}
+    for code in range(n_categories):
+        previous = sums.get(code)
+        if previous is None:
+            previous = np.zeros(start + 1, dtype=np.int64)
+        running = np.cumsum(np.where(categories == code, units, 0))
+        result[code] = np.concatenate([previous, running + previous[-1]])
+    return result
+
+
+def _stamp(dt: datetime, ceil=False) -> int:
+    """
+    Return the position of @dt in the row order, in seconds.
+
+    Rows only store whole seconds, so partial seconds are rounded down,
+    or up if @ceil is True.
+    """
+    seconds = dt.hour * 3600 + dt.minute * 60 + dt.second
+    if ceil and dt.microsecond:
+        seconds += 1
+    return dt.toordinal() * SECONDS_PER_DAY + seconds
+
+
+def month_codes(days: np.ndarray) -> np.ndarray:
+    """
+    Convert day ordinals to month numbers.
+
+    :return: an array of the months of @days, counted from 1970-01
+    """
+    dates = _FIRST_DAY + (days.astype(np.int64) - 1)
+    return dates.astype('datetime64[M]').astype(np.int64)
+
+
+def month_name(month: int) -> str:
+    """Format a month number returned by month_codes() as 'YYYY-MM'."""
+    return str(np.datetime64(int(month), 'M'))
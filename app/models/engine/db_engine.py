@@ -1,100 +1,502 @@
+import atexit
+import copy
+import functools
 import json
+import os
+import threading
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from itertools import islice
 from ..user import User
+from .columns import TransactionColumns
+from .indexes import ProfileIndex
+from .persistent import LayeredDict, shallow_copy, to_json
 from datetime import datetime
-from typing import Union
+from typing import Iterator, Union
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where writes are only serialized between
+    # the threads of a process
+    fcntl = None
+
+
+# Key under which engine metadata is stored in db.json. Usernames cannot
+# start with an underscore, so this never clashes with a user.
+_META_KEY = '__meta__'
+
+# The transaction categories, in the order they are stored under an account
+CATEGORIES = ('incomes', 'expenses', 'transfers')
+
+
+def _recorded(method):
+    """
+    Record the calls to a method that changes the data.
+
+    save() replays the calls recorded since the last commit on top of the
+    latest data if another process committed in the meantime. Calls made
+    by another recorded method, or during a replay, are not recorded.
+    Each call is recorded with the thread that made it, to which save()
+    reports the errors of its replay.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._data_lock, self._writing():
+            if self._op_depth:
+                return method(self, *args, **kwargs)
+            # Copy the arguments, since the method may modify them
+            call = (method.__name__, [copy.copy(a) for a in args], dict(kwargs),
+                    threading.get_ident())
+            self._op_depth += 1
+            try:
+                result = method(self, *args, **kwargs)
+            finally:
+                self._op_depth -= 1
+            self._operations.append(call)
+            if self._group_commit_ms and call[3] not in self._next_commits:
+                self._next_commits[call[3]] = Future()
+        self._mark_dirty()
+        return result
+    return wrapper
+
+
+class _State:
+    """
+    A version of the data, with the lookups derived from it.
+
+    A published state is never changed, except to add lookups built on
+    first use, so it can be read from any thread without locking.
+    """
+    __slots__ = ('db', 'indexes', 'user_index')
+
+    def __init__(self, db, indexes: LayeredDict = None, user_index: dict = None):
+        self.db = db
+        # username -> (user data, {profile -> ProfileIndex}), built on
+        # first use. The indexes are only used with the very user data they
+        # were built from. The dicts of profiles may be shared with other
+        # states, so they are replaced rather than changed.
+        self.indexes = LayeredDict() if indexes is None else indexes
+        # Lookups of users by email and by id, built on first use. See
+        # _get_user_index().
+        self.user_index = user_index
 
 
 class DBEngine:
-    __file = 'db.json'
+    def __init__(self, path='db.json', journal=False,
+                 compact_threshold=1024 * 1024, user_cache_size=1024,
+                 commit_retries=10, group_commit_ms=0, group_commit_size=100):
+        """
+        Initialize the database connection.
+
+        The engine can be shared by the threads of a process. Reads take
+        no lock: they see the data as it was when the last change was
+        published. Changes are made to a copy-on-write version of the data
+        that is published at once when the method making them returns, or
+        at the end of batch().
 
-    def __init__(self):
-        """Initialize the database connection."""
-        self.db = {}
+        Several processes may use the same database. Reads take no lock.
+        save() holds an advisory lock on a '.lock' file next to the
+        database while it commits, and checks that no other process
+        committed since the data was loaded. If one did, the changes made
+        since the last commit are replayed on top of the latest data and
+        the commit is retried.
+
+        With group commit, save() leaves the changes to a background
+        thread that saves the changes of all threads together, at most
+        every @group_commit_ms milliseconds, so a burst of changes costs a
+        single write.
+
+        :param path: the database file. The journal is kept next to it,
+            with a '.log' suffix
+        :param journal: if True, save() appends changes to a write-ahead
+            log instead of rewriting db.json
+        :param compact_threshold: the size in bytes at which the journal is
+            folded back into db.json
+        :param user_cache_size: the number of User objects to cache
+        :param commit_retries: the number of times save() replays the
+            changes and tries again after a conflicting commit
+        :param group_commit_ms: if not 0, enables group commit, with
+            changes saved this many milliseconds after the first of them
+        :param group_commit_size: with group commit, the number of changes
+            that are saved right away, without waiting for the interval
+        """
+        self.__file = path
+        self.__log_file = path + '.log'
+        self.__lock_file = path + '.lock'
+        # The data seen by readers, replaced whenever changes are published
+        self._state = _State({})
+        # The data being changed, and the thread changing it. See _writing()
+        self._working = None
+        self._writer = None
+        # id -> object, for the parts of the working data that were
+        # copied, and so can be changed in place
+        self._owned = {}
+        # The state pinned by each thread. See pin()
+        self._pins = threading.local()
+        self._journal = journal
+        self._compact_threshold = compact_threshold
+        # Serialized journal records not yet written to disk
+        self._pending = []
+        # Sequence number of the last change applied to self.db
+        self._seq = 0
+        # Number of bytes of the journal already applied to self.db
+        self._log_offset = 0
+        # The id to give to the next user. Ids are never reused, even
+        # after a user is deleted.
+        self._next_id = 1
+        # username -> (user data, User), in LRU order. An entry is only
+        # valid while the user data is the same object, since it is
+        # copied whenever the user changes.
+        self._users = OrderedDict()
+        self._user_cache_size = user_cache_size
+        # Identity of the file contents currently held in memory. Used by
+        # reload() to skip re-parsing a file that has not changed.
+        self._file_stat = None
+        # Counters for inspecting how often reload() actually hits the disk
+        self.reload_stats = {'performed': 0, 'skipped': 0, 'replayed': 0}
+        # The number of commits made to the database when the data in
+        # memory was loaded. Stored in db.json, and in the journal by each
+        # commit.
+        self._version = 0
+        # Calls to the methods that changed the data since the last commit,
+        # as (method name, args, kwargs, thread id). See _recorded().
+        self._operations = []
+        # thread id -> the error that made the replay of the calls of the
+        # thread fail, until save() reports it. See _rebase().
+        self._failed = {}
+        self._op_depth = 0
+        self._commit_retries = commit_retries
+        # Serializes the commits of the threads of this process. The lock
+        # file serializes those of different processes.
+        self._commit_lock = threading.Lock()
+        self._lock_fd = None
+        # The thread holding the lock. See _lock()
+        self._lock_owner = None
+        # Held while the data is changed or saved. Readers never take it.
+        self._data_lock = threading.RLock()
+        self._group_commit_ms = group_commit_ms
+        self._group_commit_size = group_commit_size
+        # The background flusher sleeps on this until there are changes
+        # to save. See _run_flusher().
+        self._flush_cond = threading.Condition()
+        self._flusher = None
+        # When the oldest change waiting for the flusher was made
+        self._dirty_since = None
+        # thread id -> the Future of the changes of the thread, completed
+        # by the next flush, and by the last flush that saved some
+        self._next_commits = {}
+        self._last_commits = {}
+        # Counters for inspecting contention between writers
+        self.lock_stats = {'acquired': 0, 'wait_seconds': 0.0,
+                           'max_wait_seconds': 0.0, 'conflicts': 0}
         try:
-            with open(self.__file, encoding='utf-8') as f:
-                self.db = json.load(f)
+            self._load()
 
         except FileNotFoundError:
             # Create the file if it does not exist
             with open(self.__file, 'w', encoding='utf-8') as f:
                 json.dump(self.db, f)
+            self._file_stat = self._stat()
+
+    def _view(self) -> _State:
+        """
+        Return the data seen by the current thread.
+
+        That is the data being changed if this thread is changing it, the
+        data it pinned, or else the last published data.
+        """
+        working = self._working
+        if working is not None and self._writer == threading.get_ident():
+            return working
+        return getattr(self._pins, 'state', None) or self._state
+
+    def pin(self):
+        """
+        Make the current thread read the data as it is now, until unpin().
+
+        All the reads of the thread then see the same version of the data,
+        except that its own changes are seen once they are published.
+        """
+        self._pins.state = self._state
+
+    def unpin(self):
+        """Make the current thread read the latest data again."""
+        self._pins.state = None
+
+    @property
+    def db(self):
+        """The data: a dict of usernames to user data."""
+        return self._view().db
+
+    @db.setter
+    def db(self, db):
+        # Replacing the data invalidates what was derived from it
+        if self._working is not None and self._writer == threading.get_ident():
+            self._working = _State(db)
+            self._owned = {id(db): db}
+        else:
+            self._state = _State(db)
+
+    @property
+    def _indexes(self) -> LayeredDict:
+        return self._view().indexes
+
+    @_indexes.setter
+    def _indexes(self, indexes: LayeredDict):
+        self._view().indexes = indexes
+
+    @property
+    def _user_index(self) -> Union[dict, None]:
+        return self._view().user_index
+
+    @_user_index.setter
+    def _user_index(self, user_index: Union[dict, None]):
+        self._view().user_index = user_index
+
+    @contextmanager
+    def _writing(self):
+        """
+        Make changes to a private version of the data, and publish them
+        all at once on exit, or discard them on an exception.
+
+        Nested uses are part of the outermost one. The data lock must be
+        held.
+        """
+        if self._working is not None:
+            yield
+            return
+        state = self._state
+        self._working = _State(state.db, LayeredDict(state.indexes),
+                               state.user_index)
+        self._writer = threading.get_ident()
+        self._owned = {}
+        n_pending, seq = len(self._pending), self._seq
+        try:
+            yield
+        except BaseException:
+            del self._pending[n_pending:]
+            self._seq = seq
+            raise
+        else:
+            self._state = self._working
+            if getattr(self._pins, 'state', None) is not None:
+                self._pins.state = self._state
+        finally:
+            self._working = None
+            self._writer = None
+            self._owned = {}
+
+    @contextmanager
+    def batch(self):
+        """
+        Make several changes that readers see all at once.
+
+        Within a batch, each change only copies the parts of the data that
+        the previous ones did not, so this is also faster for making many
+        changes. An exception raised out of the batch discards all
+        its changes.
+        """
+        with self._data_lock, self._writing():
+            yield
+
+    def _own(self, node: Union[dict, list]) -> Union[dict, list]:
+        """
+        Return @node, or a copy of it if it is shared with the published
+        data, so that it can be changed.
+
+        Large dicts and lists, such as the users or the transactions of an
+        account, are copied into structures that share their items with
+        the original, so a change costs about the same at any size. See
+        shallow_copy().
+        """
+        if id(node) in self._owned:
+            return node
+        node = shallow_copy(node)
+        self._owned[id(node)] = node
+        return node
+
+    def _own_child(self, node: dict, key) -> Union[dict, list]:
+        """Make node[key] a part of the data that can be changed."""
+        child = node[key]
+        owned = self._own(child)
+        if owned is not child:
+            node[key] = owned
+        return owned
 
     def get_transactions(self, username, profile, account=None, category=None,
                          subcategory=None, limit=None,
                          from_: Union[datetime, str, None] = None,
-                         to: Union[datetime, str, None] = None) -> list[dict]:
+                         to: Union[datetime, str, None] = None,
+                         after: tuple[str, str] = None) -> list[dict]:
         """
         Fetch transactions using the specified criteria.
 
         If @category is not specified, all transactions under the specified
         account are returned. If @account is not specified, all transactions
         from all accounts are returned.
+        Transactions are returned in chronological order, and ties are broken
+        by id.
+
+        @after is a (time, id) pair, usually those of the last transaction of
+        a previous call. Only the transactions that come after it are
+        returned, which together with @limit pages through the results at a
+        cost that depends on the page size, not on the number of
+        transactions before it.
         """
-        transactions = []
-        # todo: refactor to eliminate code duplication
-        # todo: filter by subcategory
-        if not account:
-            for account in self.db[username]['profiles'][profile]['accounts'].values():
-                if category:
-                    transactions.extend(account['transactions'][category])
-                else:
-                    transactions.extend(account['transactions']['incomes'])
-                    transactions.extend(account['transactions']['expenses'])
-                    transactions.extend(account['transactions']['transfers'])
-        else:
-            account = self.db[username]['profiles'][profile]['accounts'][account]
-            if category:
-                transactions.extend(account['transactions'][category])
-            else:
-                transactions.extend(account['transactions']['incomes'])
-                transactions.extend(account['transactions']['expenses'])
-                transactions.extend(account['transactions']['transfers'])
-
-        # Filter results by subcategory
-        if subcategory:
-            transactions = list(filter(
-                lambda t: t.get('subcategory') == subcategory,
-                transactions
-            ))
+        transactions = self._iter_transactions(username, profile, account,
+                                               category, subcategory,
+                                               from_, to, after=after)
+        if limit is not None and limit < 0:
+            return list(transactions)[:limit]
+        return list(islice(transactions, limit))
+
+    def iter_transactions(self, username, profile, account=None,
+                          category=None, subcategory=None,
+                          from_: Union[datetime, str, None] = None,
+                          to: Union[datetime, str, None] = None) -> Iterator[dict]:
+        """
+        Lazily yield the transactions matching the specified criteria.
+
+        Unlike get_transactions(), the results are never all held in
+        memory. They are read from the data as it was when this method was
+        called, so changes made while they are iterated are not seen,
+        unless made by this thread inside batch().
+        """
+        return self._iter_transactions(username, profile, account, category,
+                                       subcategory, from_, to)
+
+    def _iter_transactions(self, username, profile, account=None,
+                           category=None, subcategory=None,
+                           from_: Union[datetime, str, None] = None,
+                           to: Union[datetime, str, None] = None,
+                           after: tuple[str, str] = None) -> Iterator[dict]:
+        """
+        Lazily yield the transactions matching the specified criteria.
+
+        See get_transactions().
+        """
+        accounts = self.db[username]['profiles'][profile]['accounts']
+        if account and account not in accounts:
+            raise KeyError(account)
+        if category and category not in CATEGORIES:
+            raise KeyError(category)
         # Filter results by time
-        if not from_ and not to:
+        if from_ or to:
+            from_, to = parse_date_range(from_, to)
+        else:
             # Return all values if no datetime filters are specified
-            return transactions[:limit]
-        if to and not from_:
-            raise ValueError("'from' cannot be None if 'to' is specified")
-        if not to:
-            # Set upper datime bound to the current date
-            to = datetime.now()
-        # Convert to datetime if str values are passed
-        if type(from_) is str:
-            from_ = datetime.fromisoformat(from_)
-        if type(to) is str:
-            to = datetime.fromisoformat(to)
-        # Apply the filter
-        transactions_filtered = []
-        for t in transactions:
-            dt = datetime.fromisoformat(t['time'])
-            if ((dt - from_).days >= 0) and ((to - dt).days >= 0):
-                transactions_filtered.append(t)
-
-        return transactions_filtered[:limit]
+            from_ = to = None
+        if after is not None:
+            # Compare with the keys of the index
+            after = (datetime.fromisoformat(after[0]), after[1])
+        index = self._get_index(username, profile)
+        return index.query(account, category, subcategory, from_, to, after)
+
+    def get_subcategories(self, username, profile, category) -> dict[str, int]:
+        """
+        Count the transactions in each subcategory of @category.
+
+        Transactions with no subcategory are counted under 'Uncategorized'.
+        Sample output: {'Food': 12, 'Rent': 1, ...}, sorted by count in
+        descending order.
+        """
+        if category not in CATEGORIES:
+            raise KeyError(category)
+        counts = self._get_index(username, profile).count_subcategories(category)
+        return dict(sorted(counts.items(), key=lambda x: x[1], reverse=True))
+
+    def get_subcategory_totals(self, username, profile, category,
+                               from_: Union[datetime, str, None] = None,
+                               to: Union[datetime, str, None] = None) -> dict:
+        """
+        Compute the total amount of each subcategory of @category.
+
+        Amounts are truncated to whole units before being summed.
+        Transactions with no subcategory are grouped under 'Uncategorized'.
+        Subcategories are listed in the order in which they first occur.
+        Sample output: {'Food': 100, 'Electricity': 40, ...}
+        """
+        if category not in CATEGORIES:
+            raise KeyError(category)
+        if from_ or to:
+            from_, to = parse_date_range(from_, to)
+        else:
+            from_ = to = None
+        return self._get_index(username, profile).subcategory_totals(
+            category, from_, to
+        )
+
+    def get_total(self, username, profile, category,
+                  from_: Union[datetime, str, None] = None,
+                  to: Union[datetime, str, None] = None) -> int:
+        """
+        Compute the total amount of @category transactions.
+
+        Amounts are truncated to whole units before being summed. The total
+        is read from running totals kept as transactions are added, so the
+        cost does not depend on the number of transactions in the range.
+        """
+        if category not in CATEGORIES:
+            raise KeyError(category)
+        if from_ or to:
+            from_, to = parse_date_range(from_, to)
+        else:
+            from_ = to = None
+        return self._get_index(username, profile).columns.total(
+            category, from_, to
+        )
+
+    def get_monthly_totals(self, username, profile, category, subcategory=None,
+                           from_: Union[datetime, str, None] = None,
+                           to: Union[datetime, str, None] = None) -> dict:
+        """
+        Compute the total amount of @category transactions in each month.
 
+        Only months with at least one transaction are included. Totals are
+        maintained incrementally as transactions are added, so the cost
+        does not depend on the number of transactions in the range.
+        Sample output: {'2024-01': 1500, '2024-03': 200, ...}
+        """
+        if category not in CATEGORIES:
+            raise KeyError(category)
+        if from_ or to:
+            from_, to = parse_date_range(from_, to)
+        return self._get_index(username, profile).monthly_totals(
+            category, subcategory, from_, to
+        )
+
+    def get_columns(self, username, profile) -> TransactionColumns:
+        """
+        Get a columnar copy of the transactions of a profile.
+
+        The columns are kept up to date as transactions are added, and are
+        meant for computing aggregates with vectorized NumPy operations.
+        They must not be modified.
+        """
+        return self._get_index(username, profile).columns
+
+    @_recorded
     def add_user(self, user: User):
         """Add a new user to the database."""
         if user.username in self.db:
             raise ValueError(f"The username '{user.username}' already exists")
         if not user.id:
-            user.id = len(self.db.keys()) + 1
-        self.db[user.username] = {
+            # Make sure that the id allocator is up to date
+            self._get_user_index()
+            user.id = self._next_id
+        self._write('set', [user.username], {
             'email': user.email,
             'password': user.password,
             'id': user.id,
             'default_profile': '',
             'profiles': {},
-        }
+        })
         self.add_profile(user.username, 'personal')
 
+    @_recorded
     def add_profile(self, username, profile, description='', default=False):
         """
         Add a new profile under the specified user.
@@ -107,14 +509,15 @@ class DBEngine:
             default = True
         if profile in self.db[username]['profiles']:
             raise ValueError(f"The profile '{profile}' already exists")
-        self.db[username]['profiles'][profile] = {
+        self._write('set', [username, 'profiles', profile], {
             'description': description,
             'accounts': {}
-        }
+        })
         if default:
-            self.db[username]['default_profile'] = profile
+            self._write('set', [username, 'default_profile'], profile)
             return
 
+    @_recorded
     def add_account(self, username, profile, account,
                     balance=0, description=''):
         """Add an account under the profile of a specific username."""
@@ -123,7 +526,7 @@ class DBEngine:
                              f" under the profile '{profile}'")
         if balance < 0:
             raise IntegrityError('Balance cannot be negative')
-        self.db[username]['profiles'][profile]['accounts'][account] = {
+        self._write('set', [username, 'profiles', profile, 'accounts', account], {
             'balance': balance,
             'description': description,
             'transactions': {
@@ -131,29 +534,43 @@ class DBEngine:
                 'expenses': [],
                 'transfers': []
             }
-        }
+        })
+        self._bump_version(username, profile)
 
     def add_transaction(self, username, profile, category, **trans_details):
         # Options for @category: incomes, expenses, transfers
-        # Generate a unique ID for the transaction
-        trans_id = str(uuid.uuid4())
-        trans_details['id'] = trans_id
+        # Generate a unique ID for the transaction, and the date if none is
+        # given, before the call is recorded, so that save() replays it
+        # with the same ones
+        trans_details['id'] = str(uuid.uuid4())
+        if not trans_details.get('time'):
+            trans_details['time'] = datetime.now().strftime("%Y-%m-%d")
+        self._insert_transaction(username, profile, category, trans_details)
+
+    @_recorded
+    def _insert_transaction(self, username, profile, category,
+                            trans_details: dict):
+        """The recorded part of add_transaction()."""
+        self._add_transaction(username, profile, category, trans_details)
+
+    def _add_transaction(self, username, profile, category, trans_details: dict):
+        """Add a transaction whose id is already set. See add_transaction()."""
         trans_details['user_id'] = username
         trans_details['category'] = category
         # Set date to the current one if none is specified
         if not trans_details.get('time'):
             trans_details['time'] = datetime.now().strftime("%Y-%m-%d")
 
-        account_debited = trans_details.get('account_debited')
-        account_credited = trans_details.get('account_credited')
+        debited = trans_details.get('account_debited')
+        credited = trans_details.get('account_credited')
         amount = trans_details['amount']
         if amount <= 0:
             raise IntegrityError('Amount must be greater than 0')
         # TODO: wrap the conditionals using try/except and provide helpful error msg
-        if account_debited:
-            account_debited = self.db[username]['profiles'][profile]['accounts'][account_debited]
-        if account_credited:
-            account_credited = self.db[username]['profiles'][profile]['accounts'][account_credited]
+        accounts = self.db[username]['profiles'][profile]['accounts']
+        account_debited = accounts[debited] if debited else None
+        account_credited = accounts[credited] if credited else None
+        accounts_path = [username, 'profiles', profile, 'accounts']
 
         if category == 'incomes':
             """ if account_credited:
@@ -163,8 +580,10 @@ class DBEngine:
                 raise IntegrityError("The transaction field 'account_debited' must"
                                      " be specified for income transactions")
             # Debit the account and add the transaction record
-            account_debited['balance'] += amount
-            account_debited['transactions']['incomes'].append(trans_details)
+            self._write('set', [*accounts_path, debited, 'balance'],
+                        account_debited['balance'] + amount)
+            self._write('append', [*accounts_path, debited, 'transactions', 'incomes'],
+                        trans_details)
 
         elif category == 'expenses':
             """ if account_debited:
@@ -174,35 +593,419 @@ class DBEngine:
             # Abort the transaction if it would cause a negative balance
             if account_credited['balance'] - amount < 0:
                 raise IntegrityError('Transaction results in negative balance')
-            account_credited['balance'] -= amount
-            account_credited['transactions']['expenses'].append(trans_details)
+            self._write('set', [*accounts_path, credited, 'balance'],
+                        account_credited['balance'] - amount)
+            self._write('append', [*accounts_path, credited, 'transactions', 'expenses'],
+                        trans_details)
 
         elif category == 'transfers':
             if not all([account_credited, account_debited]):
                 raise IntegrityError(
                     "Both the transaction fields 'account_credited' and "
                     "'account_debited' must be specified for transfers")
-            if account_credited == account_debited:
+            if credited == debited:
                 raise IntegrityError('A transfer cannot be done to the same account')
             if account_credited['balance'] - amount < 0:
                 raise IntegrityError('Transaction results in negative balance')
-            account_credited['balance'] -= amount
-            account_debited['balance'] += amount
-            account_debited['transactions']['transfers'].append(trans_details)
-            account_credited['transactions']['transfers'].append(trans_details)
+            self._write('set', [*accounts_path, credited, 'balance'],
+                        account_credited['balance'] - amount)
+            self._write('set', [*accounts_path, debited, 'balance'],
+                        account_debited['balance'] + amount)
+            self._write('append', [*accounts_path, debited, 'transactions', 'transfers'],
+                        trans_details)
+            self._write('append', [*accounts_path, credited, 'transactions', 'transfers'],
+                        trans_details)
 
         else:
             raise ValueError(f"The category '{category}' does not exist")
+        self._bump_version(username, profile)
+
+    def _bump_version(self, username, profile):
+        """Record that the data of a profile has changed."""
+        self._write('set', [username, 'profiles', profile, 'version'],
+                    self.get_data_version(username, profile) + 1)
+
+    def get_data_version(self, username, profile) -> int:
+        """
+        Get the data version of a profile.
+
+        The version is incremented whenever the accounts or transactions
+        of the profile change, so it can be used to key cached data derived
+        from the profile.
+        """
+        return self.db[username]['profiles'][profile].get('version', 0)
+
+    @_recorded
+    def rollback_transaction(self, username, profile, trans_id):
+        """
+        Undo a transaction.
+
+        The transaction is removed from the accounts it is recorded under,
+        both of them for a transfer, and their balances are restored.
+
+        :raises KeyError: if the profile has no transaction with that id
+        :raises IntegrityError: if undoing the transaction would make a
+            balance negative
+        """
+        transaction, positions = self._locate(username, profile, trans_id)
+        category = transaction['category']
+        amount = transaction['amount']
+        accounts = self.db[username]['profiles'][profile]['accounts']
+        accounts_path = [username, 'profiles', profile, 'accounts']
+        # The balance changes made by add_transaction(), reversed
+        changes = {}
+        if category in ('expenses', 'transfers'):
+            changes[transaction['account_credited']] = amount
+        if category in ('incomes', 'transfers'):
+            changes[transaction['account_debited']] = -amount
+        for account, change in changes.items():
+            if accounts[account]['balance'] + change < 0:
+                raise IntegrityError('Undoing the transaction results in'
+                                     ' negative balance')
+        for account, change in changes.items():
+            self._write('set', [*accounts_path, account, 'balance'],
+                        accounts[account]['balance'] + change)
+        for account, position in positions.items():
+            self._write('delete', [*accounts_path, account, 'transactions',
+                                   category, position], transaction)
+        self._bump_version(username, profile)
+
+    @_recorded
+    def edit_transaction(self, username, profile, trans_id, **changes):
+        """
+        Change the details of a transaction.
+
+        The transaction is undone and added again with @changes applied,
+        under the same id, so the balances are checked as for a new
+        transaction. Any field given to add_transaction() can be changed,
+        as well as the category.
+
+        :raises KeyError: if the profile has no transaction with that id
+        :raises IntegrityError: if the changed transaction is invalid, or
+            would make a balance negative. Nothing is changed then.
+        """
+        transaction, _ = self._locate(username, profile, trans_id)
+        trans_details = {**transaction, **changes, 'id': trans_id}
+        category = trans_details.pop('category')
+        self.rollback_transaction(username, profile, trans_id)
+        self._add_transaction(username, profile, category, trans_details)
+
+    def _locate(self, username, profile, trans_id) -> tuple[dict, dict[str, int]]:
+        """
+        Find a transaction by id.
+
+        :return: a tuple of the transaction and a dict mapping the accounts
+            it is recorded under to its position in their lists
+        :raises KeyError: if the profile has no transaction with that id
+        """
+        category, positions = self._get_index(username, profile).locate(trans_id)
+        accounts = self.db[username]['profiles'][profile]['accounts']
+        for account, position in positions.items():
+            transactions = accounts[account]['transactions'][category]
+            # The position is where the transaction was added. It moves
+            # back as transactions before it are removed.
+            position = min(position, len(transactions) - 1)
+            while transactions[position].get('id') != trans_id:
+                position -= 1
+            positions[account] = position
+            transaction = transactions[position]
+        return transaction, positions
+
+    def save(self) -> Future:
+        """
+        Save changes to database.
+
+        In journal mode only the changes made since the last save are
+        appended to the log, and the log is folded back into db.json once
+        it grows past the compaction threshold. Otherwise the whole database
+        is written to a temporary file that is renamed over db.json, so
+        readers never see a partly written file.
+
+        If another process committed since the data was loaded, the
+        changes are replayed on top of its commit first. The errors they
+        now raise, such as an IntegrityError for a balance that would
+        become negative, are raised here, with the changes of the current
+        thread discarded. The changes of other threads are still saved.
+
+        With group commit, the changes are saved later by the background
+        flusher, together with those of other threads, and errors are set
+        on the returned future instead of being raised.
+
+        :return: a Future that is done once the changes of the current
+            thread are on disk. Its result() waits for them to be saved,
+            and raises the error that prevented it, if any
+        :raises ConflictError: if other processes kept committing first
+        """
+        owner = threading.get_ident()
+        if self._group_commit_ms:
+            with self._data_lock:
+                future = self._next_commits.get(owner)
+                if future is not None:
+                    return future
+                # Already saved by an earlier flush, or nothing to save
+                return self._last_commits.pop(owner, None) or _completed()
+        with self._data_lock:
+            self._save()
+            error = self._failed.pop(owner, None)
+        if error is not None:
+            raise error
+        return _completed()
+
+    def flush(self) -> Future:
+        """
+        Save the changes waiting for the background flusher now.
+
+        The Future of each thread is completed with the error that made
+        the replay of its changes fail, if any, or else with the error that
+        kept all changes from being saved.
+
+        :return: the Future of the changes of the current thread, which is
+            already done
+        """
+        with self._data_lock:
+            futures, self._next_commits = self._next_commits, {}
+            try:
+                if self._operations or self._pending:
+                    self._save()
+            except Exception as e:
+                for future in futures.values():
+                    future.set_exception(e)
+            else:
+                for owner, future in futures.items():
+                    error = self._failed.pop(owner, None)
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+            self._last_commits.update(futures)
+            return (self._last_commits.pop(threading.get_ident(), None)
+                    or _completed())
+
+    def _mark_dirty(self):
+        """Let the background flusher know that there are changes to save."""
+        if not self._group_commit_ms:
+            return
+        with self._flush_cond:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(
+                    target=self._run_flusher, name='db-flusher', daemon=True
+                )
+                self._flusher.start()
+                # The flusher dies with the process, so save what is left
+                atexit.register(self.flush)
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._flush_cond.notify()
+
+    def _run_flusher(self):
+        """Save changes in batches. Runs in the background flusher thread."""
+        interval = self._group_commit_ms / 1000
+        while True:
+            with self._flush_cond:
+                while self._dirty_since is None:
+                    self._flush_cond.wait()
+                deadline = self._dirty_since + interval
+                while len(self._operations) < self._group_commit_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._flush_cond.wait(timeout)
+                self._dirty_since = None
+            self.flush()
+
+    def _save(self):
+        """Commit the changes, retrying on conflicts. See save()."""
+        for _ in range(self._commit_retries + 1):
+            with self._lock():
+                if not self._conflicts():
+                    self._commit()
+                    return
+            self.lock_stats['conflicts'] += 1
+            if not self._rebase():
+                # There was nothing to commit
+                return
+        raise ConflictError('The changes could not be saved because the'
+                            ' database kept being changed by other processes')
+
+    def _commit(self):
+        """Write the changes to disk. The lock must be held."""
+        self._version += 1
+        try:
+            # Record the version first. If the process dies before the data
+            # is written, other processes at worst see a conflict that is
+            # not one, and never miss one.
+            self._write_version()
+            if self._journal:
+                self._seq += 1
+                self._pending.append(json.dumps(
+                    {'seq': self._seq, 'op': 'commit', 'version': self._version},
+                    separators=(',', ':')
+                ))
+                self._flush_journal()
+                if self._log_offset >= self._compact_threshold:
+                    self._compact()
+            else:
+                self._write_snapshot()
+        except BaseException:
+            self._version -= 1
+            raise
+        self._operations = []
+
+    def _conflicts(self) -> bool:
+        """
+        Tell whether the data in memory may be missing changes on disk.
+
+        That is the case if the version recorded in the lock file by the
+        last commit is not the version of the data in memory, or if the
+        files changed since they were last read or written. A compaction
+        by another process changes the files but not the version, and is
+        still treated as a conflict, since the data in memory is then only
+        known to be current by re-reading the new snapshot. The lock must
+        be held.
+        """
+        version = self._read_version()
+        if version is not None and version != self._version:
+            return True
+        return (self._stat() != self._file_stat
+                or self._log_size() != self._log_offset)
+
+    def _rebase(self) -> bool:
+        """
+        Re-read the database and replay the recorded changes on top of it.
+
+        If a call fails, the calls of the thread that made it are dropped,
+        since its later calls may depend on it, and the replay starts over
+        without them. The error is kept in _failed for save() to report to
+        that thread, and the changes of other threads are still replayed.
+
+        :return: True if there were changes to replay
+        """
+        operations = self._operations
+        while True:
+            owner = None
+            try:
+                # Readers see the replayed changes together with the new
+                # data
+                with self._writing():
+                    self._load()
+                    self._op_depth += 1
+                    try:
+                        for name, args, kwargs, owner in operations:
+                            getattr(self, name)(*[copy.copy(a) for a in args],
+                                                **kwargs)
+                        owner = None
+                    finally:
+                        self._op_depth -= 1
+            except Exception as e:
+                if owner is None:
+                    # Not the fault of a call. Discard the changes that
+                    # were replayed.
+                    self._load()
+                    raise
+                self._failed[owner] = e
+                operations = [call for call in operations if call[3] != owner]
+                continue
+            self._operations = operations
+            return bool(operations)
+
+    @contextmanager
+    def _lock(self, shared=False):
+        """
+        Hold the lock that serializes commits, and count the wait.
+
+        With @shared, other processes may hold the lock shared at the same
+        time, which is enough to keep them from committing while the files
+        are read. Does nothing if the current thread already holds it.
+        """
+        if self._lock_owner == threading.get_ident():
+            yield
+            return
+        start = time.perf_counter()
+        with self._commit_lock:
+            self._lock_owner = threading.get_ident()
+            try:
+                if fcntl is not None:
+                    if self._lock_fd is None:
+                        self._lock_fd = os.open(self.__lock_file,
+                                                os.O_RDWR | os.O_CREAT, 0o644)
+                    fcntl.flock(self._lock_fd,
+                                fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                if not shared:
+                    wait = time.perf_counter() - start
+                    self.lock_stats['acquired'] += 1
+                    self.lock_stats['wait_seconds'] += wait
+                    self.lock_stats['max_wait_seconds'] = max(
+                        self.lock_stats['max_wait_seconds'], wait
+                    )
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            finally:
+                self._lock_owner = None
+
+    def _read_version(self) -> Union[int, None]:
+        """
+        Return the version recorded in the lock file by the last commit.
+
+        Returns None if no commit recorded it. The lock must be held.
+        """
+        if self._lock_fd is None:
+            return None
+        data = os.pread(self._lock_fd, 32, 0)
+        return int(data) if data.strip().isdigit() else None
+
+    def _write_version(self):
+        """Record the version of the commit in the lock file."""
+        if self._lock_fd is None:
+            return
+        data = b'%d\n' % self._version
+        os.pwrite(self._lock_fd, data, 0)
+        os.ftruncate(self._lock_fd, len(data))
+
+    def compact(self):
+        """
+        Fold the journal into db.json and truncate the journal.
+
+        The snapshot is written to a temporary file which is fsync'ed and
+        atomically renamed over db.json, so a crash at any point leaves
+        either the old or the new snapshot in place. Journal records that
+        are already part of the snapshot are skipped on replay because
+        the snapshot stores the sequence number of the last record it
+        contains.
+
+        Changes that are not saved yet are saved first.
+        """
+        with self._data_lock:
+            if self._pending or self._operations:
+                self._save()
+            with self._lock():
+                if self._conflicts():
+                    # Fold in the commits of other processes as well
+                    self._load()
+                self._compact()
 
-    def rollback_transaction(self, trans_id):
-        """Undo a transaction"""
-        # TODO: implement
-        raise NotImplementedError
+    def _compact(self):
+        """Compact the journal. The lock must be held."""
+        self._flush_journal()
+        self._write_snapshot()
+        # Records in the log are now covered by the snapshot
+        with open(self.__log_file, 'wb') as f:
+            os.fsync(f.fileno())
+        self._log_offset = 0
 
-    def save(self):
-        """Save changes to database."""
-        with open(self.__file, 'w', encoding='utf-8') as f:
-            json.dump(self.db, f, indent=4)
+    def _write_snapshot(self):
+        """Atomically replace db.json with the data in memory."""
+        tmp = self.__file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._snapshot(), f, indent=4, default=to_json)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.__file)
+        _fsync_dir(self.__file)
+        # What is in memory is now what is on disk
+        self._file_stat = self._stat()
 
     def get_accounts(self, username, profile) -> list:
         """Get a list of account names under the given profile."""
@@ -246,17 +1049,36 @@ class DBEngine:
         """
         Get a user by the username.
 
+        Users are cached, so the same User instance may be returned by
+        several calls. It is replaced once the user's data changes.
+
         :return: A User instance or None if @username is not found
         """
-        if username not in self.db:
+        data = self.db.get(username)
+        if data is None:
             return None
-        return User(
+        cached = self._users.get(username)
+        if cached is not None and cached[0] is data:
+            try:
+                self._users.move_to_end(username)
+            except KeyError:
+                # Evicted by another thread
+                pass
+            return cached[1]
+        user = User(
             username=username,
-            user_id=self.db[username]['id'],
-            password=self.db[username]['password'],
-            email=self.db[username]['email'],
-            default_profile=self.db[username]['default_profile']
+            user_id=data['id'],
+            password=data['password'],
+            email=data['email'],
+            default_profile=data['default_profile']
         )
+        self._users[username] = (data, user)
+        if len(self._users) > self._user_cache_size:
+            try:
+                self._users.popitem(last=False)
+            except KeyError:
+                pass
+        return user
 
     def get_all_usernames(self):
         """Get a list of all usernames in the database."""
@@ -268,8 +1090,12 @@ class DBEngine:
 
         :return: A User instance or None if @id_ is not found
         """
-        raise NotImplementedError
+        username = self._get_user_index()['id'].get(str(id_))
+        if username is None:
+            return None
+        return self.get_user_by_username(username)
 
+    @_recorded
     def set_default_profile(self, username, profile):
         """
         Set the default profile for the given username.
@@ -278,25 +1104,397 @@ class DBEngine:
         """
         if profile not in self.get_profiles(username):
             raise IntegrityError("Profile does not exist")
-        self.db[username]['default_profile'] = profile
+        self._write('set', [username, 'default_profile'], profile)
+
+    def reload(self, force=False) -> bool:
+        """
+        Reload data from storage.
+
+        The file is only re-read if its inode, size or modification time
+        changed since it was last loaded or saved, so calling this on every
+        request costs a single stat() when nothing changed. Use @force to
+        re-read the file unconditionally.
+
+        If db.json is unchanged but the journal has grown, only the new
+        journal records are replayed.
+
+        Unless @force is used, nothing is re-read while there are unsaved
+        changes, which might otherwise be lost. save() replays them on top
+        of the latest data instead.
+
+        :return: True if the file was re-read, False if the reload was skipped
+        """
+        if not force and self._is_current():
+            # The common case, checked without taking the lock
+            self.reload_stats['skipped'] += 1
+            return False
+        with self._data_lock:
+            if not force and self._is_current():
+                self.reload_stats['skipped'] += 1
+                return False
+            # Keep other processes from compacting the journal while it is
+            # read
+            with self._lock(shared=True):
+                stat = self._stat()
+                if not force and stat is not None and stat == self._file_stat:
+                    if self._log_size() > self._log_offset:
+                        try:
+                            with self._writing():
+                                self._replay_journal()
+                        except _JournalGap:
+                            pass
+                        else:
+                            self.reload_stats['replayed'] += 1
+                            return False
+                    # Otherwise the journal was truncated by a compaction
+                    # elsewhere
+                self._load()
+            self.reload_stats['performed'] += 1
+            return True
+
+    def _is_current(self) -> bool:
+        """
+        Tell whether reload() has nothing to do: either nothing changed on
+        disk, or there are unsaved changes.
+        """
+        if self._operations:
+            return True
+        stat = self._stat()
+        return (stat is not None and stat == self._file_stat
+                and self._log_size() == self._log_offset)
+
+    def _load(self):
+        """
+        Read db.json and replay any journal records not yet in it.
+
+        Both files are read under a shared lock, so that no other process
+        compacts the journal in between. Without one, they are read again
+        if the journal does not continue the snapshot that was read.
+        Readers see the new data once it is fully loaded.
+
+        :raises IntegrityError: if the journal still does not continue the
+            snapshot after as many tries as save() makes
+        """
+        with self._data_lock:
+            for _ in range(self._commit_retries + 1):
+                with self._lock(shared=True):
+                    stat = self._stat()
+                    with open(self.__file, encoding='utf-8') as f:
+                        db = json.load(f)
+                    meta = db.pop(_META_KEY, {})
+                    try:
+                        with self._writing():
+                            self.db = db
+                            self._users.clear()
+                            # Databases written before ids were allocated
+                            # here have no 'next_id', so continue from the
+                            # largest id in use.
+                            self._next_id = meta.get('next_id') or _next_free_id(db)
+                            self._file_stat = stat
+                            self._seq = meta.get('seq', 0)
+                            self._version = meta.get('version', 0)
+                            self._pending = []
+                            self._operations = []
+                            self._log_offset = 0
+                            self._replay_journal()
+                    except _JournalGap:
+                        continue
+                    return
+        raise IntegrityError('The journal does not continue the database'
+                             ' snapshot')
+
+    def _snapshot(self) -> dict:
+        """Return the data to be written to db.json."""
+        return {_META_KEY: {'seq': self._seq, 'next_id': self._next_id,
+                            'version': self._version},
+                **self.db}
+
+    def _write(self, op: str, path: list, value=None):
+        """
+        Apply a change to the in-memory data and record it for the journal.
+
+        :param op: one of 'set', 'append' or 'delete'
+        :param path: the keys leading from the root of the data to the
+            value being changed
+        :param value: the new value for 'set', the item for 'append', or
+            the transaction being deleted when deleting one from a list
+        """
+        self._apply(op, path, value)
+        if self._journal:
+            self._seq += 1
+            # Serialize immediately since @value may change after this call
+            self._pending.append(json.dumps(
+                {'seq': self._seq, 'op': op, 'path': path, 'value': value},
+                separators=(',', ':')
+            ))
+
+    def _apply(self, op: str, path: list, value=None):
+        """
+        Apply a single change to the in-memory data.
+
+        The containers along @path are copied, unless they already were
+        since the data was last published. Must be called within
+        _writing().
+        """
+        *parents, key = path
+        working = self._working
+        node = working.db = self._own(working.db)
+        # The data of the user before the change, which the indexes of the
+        # user must have been built from to be kept
+        user = node.get(path[0])
+        for k in parents:
+            node = self._own_child(node, k)
+        if op == 'set':
+            node[key] = value
+        elif op == 'append':
+            self._own_child(node, key).append(value)
+        elif op == 'delete':
+            del node[key]
+        else:
+            raise ValueError(f"Unknown journal operation '{op}'")
+        self._update_indexes(op, path, value, user)
+
+    def _get_index(self, username, profile) -> ProfileIndex:
+        """Return the index of a profile, building it if necessary."""
+        state = self._view()
+        user = state.db[username]
+        entry = state.indexes.get(username)
+        # Indexes built from other data of the user are out of date
+        profiles = entry[1] if entry is not None and entry[0] is user else {}
+        index = profiles.get(profile)
+        if index is None:
+            index = ProfileIndex(user['profiles'][profile]['accounts'])
+            state.indexes[username] = (user, {**profiles, profile: index})
+            if state is self._working:
+                # Not seen by readers yet, so it can be changed in place
+                self._owned[id(index)] = index
+        return index
+
+    def _update_indexes(self, op: str, path: list, value=None, user=None):
+        """
+        Keep the indexes in sync with a change applied by _apply().
+
+        :param user: the data of the user before the change
+        """
+        if len(path) == 1 and op == 'set':
+            self._next_id = max(self._next_id, _next_free_id({path[0]: value}))
+        if len(path) == 1 or (len(path) == 2 and path[1] in ('email', 'id')):
+            self._update_user_index(path[0])
+        entry = self._indexes.get(path[0])
+        if entry is None:
+            return
+        if (entry[0] is not user or len(path) == 1
+                or len(path) == 2 and path[1] == 'profiles'):
+            # Built from other data, or a user or all their profiles were
+            # replaced or removed
+            self._drop_indexes(path[0])
+            return
+        profiles = entry[1]
+        # The user was copied by the change, so the indexes are now those
+        # of the copy
+        self._indexes[path[0]] = (self.db[path[0]], profiles)
+        if len(path) < 3:
+            return
+        index = profiles.get(path[2])
+        if index is None:
+            return
+        # [username, 'profiles', profile, 'accounts', account,
+        #  'transactions', category] for a list of transactions
+        is_added = op == 'append' and len(path) == 7
+        # The same, followed by the position, for a transaction
+        is_removed = op == 'delete' and len(path) == 8
+        if is_added or is_removed:
+            if id(index) not in self._owned:
+                index = index.copy()
+                self._owned[id(index)] = index
+                self._indexes[path[0]] = (self.db[path[0]],
+                                          {**profiles, path[2]: index})
+            if is_added:
+                index.add(path[4], path[6], value)
+            else:
+                index.remove(path[4], path[6], value)
+        elif path[-1] not in ('balance', 'version'):
+            # Profiles and accounts are rarely changed, so just rebuild
+            # the index when it is next needed.
+            self._indexes[path[0]] = (self.db[path[0]], {
+                p: i for p, i in profiles.items() if p != path[2]})
+
+    def _get_user_index(self) -> dict:
+        """Return the user lookups, building them if necessary."""
+        state = self._view()
+        if state.user_index is None:
+            index = {'email': {}, 'id': {}, 'user': {}}
+            for username in state.db:
+                _index_user(index, state.db, username)
+            state.user_index = index
+        return state.user_index
+
+    def _update_user_index(self, username):
+        """
+        Bring the entries of @username in the user lookups up to date.
+
+        Must be called within _writing().
+        """
+        index = self._user_index
+        if index is None:
+            return
+        if id(index) not in self._owned:
+            index = {name: LayeredDict(lookup) for name, lookup in index.items()}
+            self._owned[id(index)] = index
+            self._user_index = index
+        _index_user(index, self.db, username)
+
+    def _drop_indexes(self, username):
+        """Discard the indexes of all profiles of @username."""
+        self._users.pop(username, None)
+        self._indexes.discard(username)
+
+    def _flush_journal(self):
+        """Append pending changes to the journal and fsync it."""
+        if not self._pending:
+            return
+        data = ('\n'.join(self._pending) + '\n').encode('utf-8')
+        with open(self.__log_file, 'ab') as f:
+            start = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = []
+        if start != self._log_offset:
+            # Another process appended records that are not in memory.
+            # Force a full reload so that the log order is respected.
+            self._file_stat = None
+        self._log_offset = start + len(data)
+
+    def _replay_journal(self):
+        """
+        Apply journal records written after the current log offset.
+
+        :raises _JournalGap: if a record does not follow the last one applied
+        """
+        try:
+            with open(self.__log_file, 'rb') as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Ignore a trailing record that is still being written
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            if record['seq'] <= self._seq:
+                # Already part of the snapshot
+                continue
+            if record['seq'] != self._seq + 1:
+                # The records in between were folded into a snapshot
+                # that was not read
+                raise _JournalGap(record['seq'])
+            if record['op'] == 'commit':
+                self._version = record['version']
+            else:
+                self._apply(record['op'], record['path'], record.get('value'))
+            self._seq = record['seq']
+        self._log_offset += end
+
+    def _log_size(self) -> int:
+        """Return the size of the journal in bytes."""
+        try:
+            return os.stat(self.__log_file).st_size
+        except FileNotFoundError:
+            return 0
 
-    def reload(self):
-        """Reload data from storage."""
-        with open(self.__file, encoding='utf-8') as f:
-            self.db = json.load(f)
+    def _stat(self) -> Union[tuple, None]:
+        """
+        Return a tuple identifying the current version of the database file.
 
+        Returns None if the file does not exist.
+        """
+        try:
+            st = os.stat(self.__file)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    @_recorded
     def delete_user(self, username: str):
         """Delete a user from the database"""
-        del self.db[username]
+        self._write('delete', [username])
 
     def email_exists(self, email: str) -> bool:
         """Check if an email exists."""
-        for username in self.db.keys():
-            if self.db[username]['email'] == email:
-                return True
-        return False
+        return email in self._get_user_index()['email']
+
+
+def _completed() -> Future:
+    """Return a Future that is already done."""
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+def _index_user(index: dict, db, username):
+    """Bring the entries of @username in the user lookups @index up to date."""
+    # The lookups hold the (email, id) of each user so that stale entries
+    # can be removed when the user changes.
+    old = index['user'].pop(username, None)
+    if old is not None:
+        if index['email'].get(old[0]) == username:
+            del index['email'][old[0]]
+        if index['id'].get(old[1]) == username:
+            del index['id'][old[1]]
+    if username in db:
+        email, id_ = db[username]['email'], str(db[username]['id'])
+        index['user'][username] = (email, id_)
+        index['email'][email] = username
+        index['id'][id_] = username
+
+
+def _next_free_id(users: dict) -> int:
+    """Return an id greater than the id of every user in @users."""
+    ids = [user['id'] for user in users.values() if isinstance(user['id'], int)]
+    return max(ids, default=0) + 1
+
+
+def parse_date_range(from_: Union[datetime, str, None],
+                     to: Union[datetime, str, None]) -> tuple[datetime, datetime]:
+    """
+    Convert the bounds of a date filter to datetime objects.
+
+    @to defaults to the current date and time. @from_ is required if @to
+    is specified.
+    """
+    if to and not from_:
+        raise ValueError("'from' cannot be None if 'to' is specified")
+    if not to:
+        # Set upper datime bound to the current date
+        to = datetime.now()
+    # Convert to datetime if str values are passed
+    if type(from_) is str:
+        from_ = datetime.fromisoformat(from_)
+    if type(to) is str:
+        to = datetime.fromisoformat(to)
+    return from_, to
+
+
+def _fsync_dir(path):
+    """Flush the directory entry of @path so that a rename is durable."""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class IntegrityError(Exception):
     """Raised if an operation violates the integrity of the data."""
     pass
+
+
+class ConflictError(IntegrityError):
+    """Raised if changes cannot be saved because of concurrent commits."""
+    pass
+
+
+class _JournalGap(Exception):
+    """Raised if the journal does not continue the data in memory."""
+    pass
@@ -0,0 +1,368 @@
+import heapq
+from collections import defaultdict
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from operator import itemgetter
+from typing import Iterator
+import numpy as np
+from .columns import AMOUNT_SCALE, TransactionColumns, month_codes, month_name
+from .persistent import LayeredDict, iter_slice, shallow_copy
+
+_time = itemgetter(0)
+_key = itemgetter(0)
+_record = itemgetter(1)
+
+
+class ProfileIndex:
+    """
+    Time-ordered index of the transactions of a single profile.
+
+    Transactions are kept in one bucket per (account, category,
+    subcategory), sorted by (time, id). Filters on those fields select
+    whole buckets, a date range resolves to a slice of each bucket by
+    binary search, and the slices of several buckets are combined with a
+    k-way merge, so only the transactions that are actually returned are
+    visited.
+
+    Transactions are also looked up by id, which gives the accounts they
+    are recorded under and about where they are in the lists of those
+    accounts. See locate().
+
+    Once an index is shared between threads, it must not be changed, and
+    transactions are added to a copy() of it instead. The copy shares the
+    buckets and totals of the index, and only copies those it changes, so
+    readers of the index never see a change half made. Large buckets and
+    the id lookup are copied into structures that share their items with
+    the original, so a copy costs about the same however many
+    transactions the profile has.
+    """
+    def __init__(self, accounts: dict):
+        """
+        Build the index.
+
+        :param accounts: the 'accounts' dict of a profile
+        """
+        # (account, category, subcategory) ->
+        #     ([(time, id), ...], [transaction, ...])
+        self._buckets = {}
+        # Running monthly totals. The keys are (category, None) for all
+        # transactions in a category, and (category, subcategory) for a
+        # single subcategory. The values map 'YYYY-MM' to the total amount.
+        self._monthly = {}
+        # The number of transactions behind each monthly total, keyed the
+        # same way, so that months left with no transactions are dropped
+        self._counts = {}
+        # id -> (category, ((account, position), ...)). The position is
+        # that of the transaction in the list of the account when it was
+        # added. Transactions before it may have been removed since, so it
+        # may be too large.
+        self._ids = {}
+        # (account, category) -> the number of transactions in the list
+        self._lengths = defaultdict(int)
+        # The same transactions, stored column-wise for vectorized
+        # aggregation
+        self.columns = TransactionColumns()
+        # The keys of the buckets and totals that belong to this index,
+        # rather than being shared with the index it was copied from
+        self._own_buckets = set()
+        self._own_totals = set()
+        for account, data in accounts.items():
+            for category, transactions in data['transactions'].items():
+                keyed = sorted(((_sort_key(t), t) for t in transactions),
+                               key=_key)
+                for key, transaction in keyed:
+                    # Already in order, so append directly
+                    keys, records = self._bucket(account, category, transaction)
+                    keys.append(key)
+                    records.append(transaction)
+                    self._add_to_rollups(category, transaction)
+                    self.columns.append(account, category, transaction)
+                # The id lookup needs the positions in the unsorted list
+                for transaction in transactions:
+                    self._add_id(account, category, transaction)
+
+    def _bucket(self, account, category, transaction: dict) -> tuple[list, list]:
+        """
+        Return the bucket a transaction belongs to, for changing it.
+
+        The bucket is created, or copied if it is shared, as needed.
+        """
+        bucket = (account, category, transaction.get('subcategory'))
+        if bucket not in self._own_buckets:
+            keys, records = self._buckets.get(bucket, ([], []))
+            self._buckets[bucket] = (shallow_copy(keys), shallow_copy(records))
+            self._own_buckets.add(bucket)
+        return self._buckets[bucket]
+
+    def _totals(self, key) -> tuple[dict, dict]:
+        """Return the monthly totals and counts of @key, for changing them."""
+        if key not in self._own_totals:
+            self._monthly[key] = defaultdict(int, self._monthly.get(key, {}))
+            self._counts[key] = defaultdict(int, self._counts.get(key, {}))
+            self._own_totals.add(key)
+        return self._monthly[key], self._counts[key]
+
+    def copy(self) -> 'ProfileIndex':
+        """Return a copy of the index, to which transactions can be added."""
+        index = ProfileIndex.__new__(ProfileIndex)
+        index._buckets = dict(self._buckets)
+        index._monthly = dict(self._monthly)
+        index._counts = dict(self._counts)
+        index._ids = LayeredDict(self._ids)
+        index._lengths = self._lengths.copy()
+        index.columns = self.columns.copy()
+        index._own_buckets = set()
+        index._own_totals = set()
+        return index
+
+    def add(self, account, category, transaction: dict):
+        """Insert a transaction recorded under @account and @category."""
+        keys, records = self._bucket(account, category, transaction)
+        key = _sort_key(transaction)
+        # Transactions are usually added in time order, so this is
+        # normally an append.
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        records.insert(i, transaction)
+        self._add_to_rollups(category, transaction)
+        self.columns.append(account, category, transaction)
+        self._add_id(account, category, transaction)
+
+    def remove(self, account, category, transaction: dict):
+        """Remove a transaction recorded under @account and @category."""
+        keys, records = self._bucket(account, category, transaction)
+        i = bisect_left(keys, _sort_key(transaction))
+        # Transactions without an id may have the same key
+        while records[i] != transaction:
+            i += 1
+        del keys[i]
+        del records[i]
+        if not keys:
+            bucket = (account, category, transaction.get('subcategory'))
+            del self._buckets[bucket]
+            self._own_buckets.discard(bucket)
+        self._add_to_rollups(category, transaction, sign=-1)
+        self.columns.remove(account, category, transaction)
+        self._lengths[(account, category)] -= 1
+        trans_id = transaction.get('id')
+        if trans_id:
+            _, positions = self._ids.pop(trans_id)
+            positions = tuple(p for p in positions if p[0] != account)
+            if positions:
+                self._ids[trans_id] = (category, positions)
+
+    def locate(self, trans_id: str) -> tuple[str, dict[str, int]]:
+        """
+        Find the accounts a transaction is recorded under.
+
+        :return: a tuple of the category of the transaction and a dict
+            mapping each account to the largest position the transaction
+            can be at in its list
+        :raises KeyError: if there is no transaction with that id
+        """
+        category, positions = self._ids[trans_id]
+        return category, dict(positions)
+
+    def _add_id(self, account, category, transaction: dict):
+        """Add a transaction, just appended to a list, to the id lookup."""
+        length = self._lengths[(account, category)]
+        self._lengths[(account, category)] = length + 1
+        trans_id = transaction.get('id')
+        if not trans_id:
+            return
+        # A transfer is added once for each account involved
+        _, positions = self._ids.get(trans_id, (category, ()))
+        self._ids[trans_id] = (category, (*positions, (account, length)))
+
+    def _add_to_rollups(self, category, transaction: dict, sign=1):
+        """
+        Add the amount of a transaction to the monthly totals, or subtract
+        it if @sign is -1.
+        """
+        month = transaction['time'][:7]
+        amount = transaction['amount']
+        keys = [(category, None)]
+        subcategory = transaction.get('subcategory')
+        if subcategory:
+            keys.append((category, subcategory))
+        for key in keys:
+            totals, counts = self._totals(key)
+            totals[month] += sign * amount
+            counts[month] += sign
+            if not counts[month]:
+                del totals[month], counts[month]
+
+    def query(self, account=None, category=None, subcategory=None,
+              from_: datetime = None, to: datetime = None,
+              after: tuple[datetime, str] = None) -> Iterator[dict]:
+        """
+        Yield transactions in (time, id) order.
+
+        :param account: only include transactions recorded under this account
+        :param category: only include transactions of this category
+        :param subcategory: only include transactions of this subcategory
+        :param from_: only include transactions at or after this time
+        :param to: only include transactions at or before this time
+        :param after: only include transactions that come after this
+            (time, id) key
+        """
+        return _query(self._buckets, account, category, subcategory, from_,
+                      to, after)
+
+    def monthly_totals(self, category, subcategory=None,
+                       from_: datetime = None,
+                       to: datetime = None) -> dict[str, int | float]:
+        """
+        Return the total amount of @category transactions in each month.
+
+        Months that lie entirely within [from_, to] are read from the
+        running totals. The partially covered months at either end of the
+        range are totalled from the columns.
+
+        :return: a dict mapping 'YYYY-MM' to totals, sorted by month
+        """
+        rollup = self._monthly.get((category, subcategory or None), {})
+        if from_ is None or to is None:
+            return dict(sorted(rollup.items()))
+        # The range of months [first_full, end_full) covered in full
+        first_full = _month_start(from_)
+        if first_full != from_:
+            first_full = _next_month(first_full)
+        end_full = _month_start(to + timedelta(microseconds=1))
+        if first_full >= end_full:
+            # No month is covered in full
+            partial = [(from_, to)]
+            full_months = {}
+        else:
+            partial = [(from_, first_full - timedelta(microseconds=1)),
+                       (end_full, to)]
+            lo, hi = _month_key(first_full), _month_key(end_full)
+            full_months = {m: v for m, v in rollup.items() if lo <= m < hi}
+        totals = dict(full_months)
+        for start, end in partial:
+            totals.update(self._column_totals(category, subcategory, start, end))
+        return dict(sorted(totals.items()))
+
+    def _column_totals(self, category, subcategory, from_: datetime,
+                       to: datetime) -> dict[str, int | float]:
+        """
+        Total the amounts of @category transactions within [from_, to] by
+        month, with vectorized operations on the columns.
+        """
+        columns = self.columns
+        rows = columns.select(from_, to)
+        mask = rows['category'] == columns.code('category', category)
+        if subcategory:
+            mask &= rows['subcategory'] == columns.code('subcategory',
+                                                        subcategory)
+        months = month_codes(rows['day'][mask])
+        if not len(months):
+            return {}
+        first = months.min()
+        counts = np.bincount(months - first)
+        sums = np.bincount(months - first, weights=rows['amount'][mask])
+        return {
+            month_name(first + i): _from_minor_units(sums[i])
+            for i in np.flatnonzero(counts)
+        }
+
+    def subcategory_totals(self, category, from_: datetime = None,
+                           to: datetime = None) -> dict[str, int]:
+        """
+        Total the amounts of @category transactions within [from_, to] by
+        subcategory, with vectorized operations on the columns.
+
+        Amounts are truncated to whole units before they are added up.
+        Transactions with no subcategory are grouped under 'Uncategorized'.
+
+        :return: a dict mapping subcategories to totals, in the order in
+            which the subcategories first occur
+        """
+        columns = self.columns
+        code = columns.code('category', category)
+        if code is None:
+            return {}
+        rows = columns.select(from_, to)
+        mask = rows['category'] == code
+        subcategories = rows['subcategory'][mask]
+        sums = np.bincount(subcategories,
+                           weights=rows['amount'][mask] // AMOUNT_SCALE)
+        codes, first = np.unique(subcategories, return_index=True)
+        totals = {}
+        for sub in codes[np.argsort(first)]:
+            name = columns.subcategories[sub] or 'Uncategorized'
+            totals[name] = totals.get(name, 0) + int(sums[sub])
+        return totals
+
+    def count_subcategories(self, category) -> dict[str, int]:
+        """
+        Count the transactions of each subcategory of @category.
+
+        Transactions with no subcategory are counted under 'Uncategorized'.
+        """
+        counts = defaultdict(int)
+        for (_, cat, sub), (keys, _) in self._buckets.items():
+            if cat == category:
+                counts[sub or 'Uncategorized'] += len(keys)
+        if category == 'transfers':
+            # Each transfer is recorded under both accounts involved
+            counts = {sub: n // 2 for sub, n in counts.items()}
+        return dict(counts)
+
+
+def _query(buckets: dict, account=None, category=None, subcategory=None,
+           from_: datetime = None, to: datetime = None,
+           after: tuple[datetime, str] = None) -> Iterator[dict]:
+    """Yield the transactions of @buckets that match the filters."""
+    ranges = []
+    for (acc, cat, sub), (keys, records) in buckets.items():
+        if account and acc != account:
+            continue
+        if category and cat != category:
+            continue
+        if subcategory and sub != subcategory:
+            continue
+        lo = 0 if from_ is None else bisect_left(keys, from_, key=_time)
+        hi = len(keys) if to is None else bisect_right(keys, to, key=_time)
+        if after is not None:
+            lo = max(lo, bisect_right(keys, after))
+        if lo < hi:
+            ranges.append(_iter_range(keys, records, lo, hi))
+    if len(ranges) == 1:
+        return map(_record, ranges[0])
+    return map(_record, heapq.merge(*ranges, key=_key))
+
+
+def _iter_range(keys: list, records: list, lo: int, hi: int):
+    """Lazily yield (key, record) pairs in the index range [lo, hi)."""
+    return zip(iter_slice(keys, lo, hi), iter_slice(records, lo, hi))
+
+
+def _from_minor_units(amount) -> int | float:
+    """Convert a sum of amounts in minor units back to units."""
+    amount = int(amount)
+    if amount % AMOUNT_SCALE == 0:
+        return amount // AMOUNT_SCALE
+    return amount / AMOUNT_SCALE
+
+
+def _month_start(dt: datetime) -> datetime:
+    """Return the first instant of the month containing @dt."""
+    return datetime(dt.year, dt.month, 1)
+
+
+def _next_month(dt: datetime) -> datetime:
+    """Return the first instant of the month after the one containing @dt."""
+    if dt.month == 12:
+        return datetime(dt.year + 1, 1, 1)
+    return datetime(dt.year, dt.month + 1, 1)
+
+
+def _month_key(dt: datetime) -> str:
+    """Format the month containing @dt as 'YYYY-MM'."""
+    return dt.strftime('%Y-%m')
+
+
+def _sort_key(transaction: dict) -> tuple[datetime, str]:
+    """Return the key by which transactions are ordered."""
+    return datetime.fromisoformat(transaction['time']), transaction.get('id', '')
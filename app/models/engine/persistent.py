@@ -0,0 +1,304 @@
+import copy
+import math
+from bisect import bisect_right
+from collections.abc import MutableMapping, Sequence
+from itertools import chain, islice
+
+# Containers with more items than this are copied into the structures
+# below, which share their items with the original, rather than copied
+# item by item
+LARGE = 512
+# The number of items in a chunk of a ChunkedList
+CHUNK_SIZE = 512
+
+# Marks a key deleted from the base of a LayeredDict
+_DELETED = object()
+_MISSING = object()
+
+
+class LayeredDict(MutableMapping):
+    """
+    A dict made of a base dict shared with its copies, and a layer of the
+    keys changed since the base was shared.
+
+    The base is never changed, so a copy only copies the layer. When the
+    layer grows past about the square root of the size of the base, a
+    copy merges the two into a new base, so copies cost O(sqrt(n)) on
+    average instead of O(n).
+
+    Keys are iterated in the order of the base, followed by the keys that
+    were added since. Unlike with a dict, a key that is deleted and added
+    again keeps its place.
+    """
+    __slots__ = ('_base', '_top')
+
+    def __init__(self, mapping: dict = None):
+        """
+        :param mapping: the items of the new dict. A plain dict is used as
+            the base, and must not be changed afterwards. A LayeredDict is
+            copied.
+        """
+        if isinstance(mapping, LayeredDict):
+            base, top = mapping._base, dict(mapping._top)
+            if len(top) > max(LARGE // 8, math.isqrt(len(base))):
+                base, top = _merge(base, top), {}
+        else:
+            base, top = {} if mapping is None else mapping, {}
+        self._base = base
+        self._top = top
+
+    def __getitem__(self, key):
+        value = self._top.get(key, _MISSING)
+        if value is _MISSING:
+            return self._base[key]
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._top.get(key, _MISSING)
+        if value is _MISSING:
+            return self._base.get(key, default)
+        if value is _DELETED:
+            return default
+        return value
+
+    def __contains__(self, key):
+        value = self._top.get(key, _MISSING)
+        if value is _MISSING:
+            return key in self._base
+        return value is not _DELETED
+
+    def __setitem__(self, key, value):
+        self._top[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self._base:
+            self._top[key] = _DELETED
+        else:
+            del self._top[key]
+
+    def discard(self, key):
+        """
+        Delete @key if it is present. Unlike pop(), this is a single change
+        to the layer, so it is safe while other threads change the dict.
+        """
+        if key in self._base:
+            self._top[key] = _DELETED
+        else:
+            self._top.pop(key, None)
+
+    def __iter__(self):
+        # A snapshot, since readers may add lookups while this is iterated
+        top = self._top.copy()
+        if not top:
+            return iter(self._base)
+        return chain(
+            (key for key in self._base if top.get(key) is not _DELETED),
+            (key for key in top if key not in self._base)
+        )
+
+    def __len__(self):
+        n = len(self._base)
+        for key, value in self._top.copy().items():
+            if key not in self._base:
+                n += 1
+            elif value is _DELETED:
+                n -= 1
+        return n
+
+    def copy(self) -> 'LayeredDict':
+        return LayeredDict(self)
+
+    __copy__ = copy
+
+    def __repr__(self):
+        return f'LayeredDict({dict(self)!r})'
+
+
+class ChunkedList(Sequence):
+    """
+    A list stored as a list of chunks, which are shared with its copies.
+
+    A copy only copies the list of chunks, and a chunk is copied by the
+    first change made to it through one of the copies, so changing one
+    item of a copy costs O(n / CHUNK_SIZE + CHUNK_SIZE) instead of O(n).
+    Items are found by binary search over the start of each chunk.
+    """
+    __slots__ = ('_chunks', '_starts', '_owned', '_len')
+
+    def __init__(self, items=()):
+        """
+        :param items: the items of the new list. A plain list is used as
+            the first chunk, and must not be changed afterwards. A
+            ChunkedList is copied.
+        """
+        if isinstance(items, ChunkedList):
+            self._chunks = items._chunks[:]
+            self._starts = items._starts[:]
+            self._len = items._len
+        else:
+            if type(items) is not list:
+                items = list(items)
+            self._chunks = [items] if items else []
+            self._starts = [0] if items else []
+            self._len = len(items)
+        # Whether each chunk belongs to this list, and so can be changed
+        self._owned = [False] * len(self._chunks)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        index = self._check(index)
+        c = self._locate(index)
+        return self._chunks[c][index - self._starts[c]]
+
+    def __iter__(self):
+        return chain.from_iterable(self._chunks)
+
+    def iter_slice(self, lo: int, hi: int):
+        """Lazily yield the items in the index range [lo, hi)."""
+        if lo >= hi:
+            return iter(())
+        c = self._locate(lo)
+        first = islice(self._chunks[c], lo - self._starts[c], None)
+        items = chain(first, chain.from_iterable(self._chunks[c + 1:]))
+        return islice(items, hi - lo)
+
+    def append(self, item):
+        if self._chunks and len(self._chunks[-1]) < CHUNK_SIZE:
+            self._writable(self._len - 1)[1].append(item)
+        else:
+            self._chunks.append([item])
+            self._starts.append(self._len)
+            self._owned.append(True)
+        self._len += 1
+
+    def insert(self, index: int, item):
+        if index < 0:
+            index = max(index + self._len, 0)
+        if index >= self._len:
+            self.append(item)
+            return
+        c, chunk = self._writable(index)
+        chunk.insert(index - self._starts[c], item)
+        self._shift(c, 1)
+        if len(chunk) > 2 * CHUNK_SIZE:
+            self._split(c)
+
+    def __delitem__(self, index: int):
+        index = self._check(index)
+        c, chunk = self._writable(index)
+        del chunk[index - self._starts[c]]
+        self._shift(c, -1)
+        if not chunk:
+            del self._chunks[c], self._starts[c], self._owned[c]
+
+    def _check(self, index: int) -> int:
+        """Return @index as a positive index, checking that it is in range."""
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('list index out of range')
+        return index
+
+    def _locate(self, index: int) -> int:
+        """Return the number of the chunk holding item @index."""
+        return bisect_right(self._starts, index) - 1
+
+    def _shift(self, c: int, n: int):
+        """Record that @n items were added to chunk @c."""
+        for i in range(c + 1, len(self._starts)):
+            self._starts[i] += n
+        self._len += n
+
+    def _writable(self, index: int) -> tuple[int, list]:
+        """
+        Return the number of the chunk holding item @index, and the chunk,
+        which is copied first if it is shared. A large chunk is split
+        instead, so that it is only copied once.
+        """
+        c = self._locate(index)
+        if not self._owned[c]:
+            if len(self._chunks[c]) > 2 * CHUNK_SIZE:
+                self._split(c)
+                c = self._locate(index)
+            else:
+                self._chunks[c] = self._chunks[c][:]
+                self._owned[c] = True
+        return c, self._chunks[c]
+
+    def _split(self, c: int):
+        """Replace chunk @c with chunks of CHUNK_SIZE items."""
+        chunk, start = self._chunks[c], self._starts[c]
+        pieces = [chunk[i:i + CHUNK_SIZE]
+                  for i in range(0, len(chunk), CHUNK_SIZE)]
+        self._chunks[c:c + 1] = pieces
+        self._starts[c:c + 1] = [start + i * CHUNK_SIZE
+                                 for i in range(len(pieces))]
+        self._owned[c:c + 1] = [True] * len(pieces)
+
+    def copy(self) -> 'ChunkedList':
+        return ChunkedList(self)
+
+    __copy__ = copy
+
+    def __eq__(self, other):
+        if isinstance(other, (list, ChunkedList)):
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return f'ChunkedList({list(self)!r})'
+
+
+def shallow_copy(node):
+    """
+    Return a shallow copy of @node that can be changed without changing
+    @node. Large dicts and lists are copied into a LayeredDict or a
+    ChunkedList, which share their items with @node.
+    """
+    if isinstance(node, (LayeredDict, ChunkedList)):
+        return node.copy()
+    if type(node) is dict and len(node) > LARGE:
+        return LayeredDict(node)
+    if type(node) is list and len(node) > LARGE:
+        return ChunkedList(node)
+    return copy.copy(node)
+
+
+def iter_slice(items: Sequence, lo: int, hi: int):
+    """Lazily yield the items of a list or ChunkedList in [lo, hi)."""
+    if isinstance(items, ChunkedList):
+        return items.iter_slice(lo, hi)
+    return map(items.__getitem__, range(lo, hi))
+
+
+def to_json(obj):
+    """
+    Convert a LayeredDict or ChunkedList for json.dump(). To be passed as
+    its @default.
+    """
+    if isinstance(obj, LayeredDict):
+        return dict(obj)
+    if isinstance(obj, ChunkedList):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON'
+                    ' serializable')
+
+
+def _merge(base: dict, top: dict) -> dict:
+    """Apply the layer of a LayeredDict to a copy of its base."""
+    merged = dict(base)
+    for key, value in top.items():
+        if value is _DELETED:
+            del merged[key]
+        else:
+            merged[key] = value
+    return merged
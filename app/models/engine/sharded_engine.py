@@ -0,0 +1,632 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Union
+from ..user import User
+from .db_engine import DBEngine, _completed, _index_user, fcntl
+from .persistent import to_json
+
+
+class ShardStore(MutableMapping):
+    """
+    A dict-like mapping of usernames to user data, backed by one JSON file
+    per user.
+
+    Shards are loaded lazily on first access and kept in an LRU cache. When
+    the total size of the cached shards exceeds @max_bytes, the least
+    recently used shards without unsaved changes are evicted.
+
+    The store can be used from several threads. The data of a user put in
+    the store must not be changed afterwards; it is replaced instead.
+    """
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, on_drop=None):
+        """
+        :param directory: the directory holding the shard files
+        :param max_bytes: the maximum combined size of cached shard files
+        :param on_drop: a function called with the username of each shard
+            that is evicted or invalidated. It is called with the lock of
+            the store held, so it must not wait for other threads.
+        """
+        self._dir = directory
+        self._max_bytes = max_bytes
+        self._on_drop = on_drop
+        self._shards = OrderedDict()  # username -> user data, in LRU order
+        self._sizes = {}  # username -> size of the shard file in bytes
+        # username -> identity of the file that the cached data, and any
+        # unsaved changes to it, are based on
+        self._stats = {}
+        self._dirty = set()  # Shards with unsaved changes
+        self._deleted = set()  # Shards to be removed on the next flush
+        self.stats = {'loads': 0, 'evictions': 0}
+        # Guards all of the above. Files are read and written without it.
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, username) -> str:
+        return os.path.join(self._dir, username + '.json')
+
+    def _file_version(self, username) -> Union[tuple, None]:
+        """Return the identity of a shard file, or None if there is none."""
+        try:
+            return _file_id(os.stat(self._path(username)))
+        except FileNotFoundError:
+            return None
+
+    def read(self, username) -> tuple[Union[dict, None], Union[tuple, None]]:
+        """
+        Read a shard from its file, bypassing the cache.
+
+        :return: the user data and the identity of the file, or (None,
+            None) if there is no file
+        """
+        path = self._path(username)
+        try:
+            st = os.stat(path)
+            with open(path, encoding='utf-8') as f:
+                return json.load(f), _file_id(st)
+        except FileNotFoundError:
+            return None, None
+
+    def __getitem__(self, username):
+        while True:
+            with self._lock:
+                if username in self._shards:
+                    self._shards.move_to_end(username)
+                    return self._shards[username]
+                if username in self._deleted:
+                    raise KeyError(username)
+            # Read without the lock, so that other shards can be used
+            # meanwhile
+            data, file_id = self.read(username)
+            if data is None:
+                raise KeyError(username)
+            with self._lock:
+                if username in self._shards or username in self._deleted:
+                    # Loaded or changed by another thread meanwhile
+                    continue
+                if self._file_version(username) != file_id:
+                    # Rewritten meanwhile, and maybe already evicted, so
+                    # the data read may be out of date
+                    continue
+                self._shards[username] = data
+                self._sizes[username] = file_id[1]
+                self._stats[username] = file_id
+                self.stats['loads'] += 1
+                self._evict()
+                return data
+
+    def __setitem__(self, username, data):
+        with self._lock:
+            self._shards[username] = data
+            self._shards.move_to_end(username)
+            self._deleted.discard(username)
+            self._dirty.add(username)
+
+    def __delitem__(self, username):
+        with self._lock:
+            if username not in self:
+                raise KeyError(username)
+            known = self._stats.get(username)
+            self._drop(username)
+            # Kept to tell whether the file changes before it is removed
+            self._stats[username] = known
+            self._dirty.discard(username)
+            self._deleted.add(username)
+
+    def __contains__(self, username):
+        with self._lock:
+            if username in self._shards:
+                return True
+            if username in self._deleted:
+                return False
+        return os.path.exists(self._path(username))
+
+    def __iter__(self):
+        on_disk = {
+            name[:-len('.json')] for name in os.listdir(self._dir)
+            if name.endswith('.json')
+        }
+        with self._lock:
+            return iter(sorted((on_disk | self._dirty) - self._deleted))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def apply(self, changes: dict, bases: dict = None):
+        """
+        Put the shards changed by a write in the store, all at once.
+
+        :param changes: a dict mapping usernames to their new data, or to
+            None for the users that were deleted
+        :param bases: a dict mapping usernames to the identity of the file
+            that their changes are based on, for the shards that were read
+            again from their files rather than from the store
+        """
+        with self._lock:
+            for username, data in changes.items():
+                if data is not None:
+                    self[username] = data
+                elif username in self:
+                    del self[username]
+            self._stats.update(bases or {})
+
+    def changed(self) -> set:
+        """Return the usernames of the shards with unsaved changes."""
+        with self._lock:
+            return self._dirty | self._deleted
+
+    def conflicts(self) -> list:
+        """
+        Return the usernames of the shards with unsaved changes whose files
+        were changed by another process since they were read.
+        """
+        with self._lock:
+            known = {username: self._stats.get(username)
+                     for username in self._dirty | self._deleted}
+        return [username for username, file_id in known.items()
+                if self._file_version(username) != file_id]
+
+    def flush(self):
+        """
+        Write modified shards to disk and remove deleted ones.
+
+        Only the shards modified or deleted when this is called are
+        flushed. Those changed while it runs are left for the next flush.
+        """
+        with self._lock:
+            dirty = {username: self._shards[username]
+                     for username in self._dirty}
+            deleted = set(self._deleted)
+        written = {}
+        for username, data in dirty.items():
+            path = self._path(username)
+            _write_json(path, data, indent=4)
+            written[username] = os.stat(path)
+        for username in deleted:
+            try:
+                os.remove(self._path(username))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            for username in deleted:
+                if username in self._deleted:
+                    self._stats.pop(username, None)
+            for username, st in written.items():
+                if self._shards.get(username) is dirty[username]:
+                    self._sizes[username] = st.st_size
+                    self._stats[username] = _file_id(st)
+                    self._dirty.discard(username)
+            self._deleted -= deleted
+            self._evict()
+
+    def invalidate_stale(self) -> int:
+        """
+        Drop cached shards whose files were changed by another process.
+
+        Shards with unsaved changes are kept.
+
+        :return: the number of shards dropped
+        """
+        with self._lock:
+            cached = [(username, self._stats.get(username))
+                      for username in self._shards
+                      if username not in self._dirty]
+        dropped = 0
+        for username, known in cached:
+            if self._file_version(username) == known:
+                continue
+            with self._lock:
+                # Unless it was reloaded or changed meanwhile
+                if (username in self._shards and username not in self._dirty
+                        and self._stats.get(username) == known):
+                    self._drop(username)
+                    dropped += 1
+        return dropped
+
+    def _drop(self, username):
+        self._shards.pop(username, None)
+        self._sizes.pop(username, None)
+        self._stats.pop(username, None)
+        if self._on_drop:
+            self._on_drop(username)
+
+    def _evict(self):
+        """
+        Evict least recently used clean shards to stay within budget.
+
+        Must be called with the lock held.
+        """
+        total = sum(self._sizes.values())
+        for username in list(self._shards):
+            if total <= self._max_bytes:
+                break
+            if username in self._dirty:
+                continue
+            total -= self._sizes.get(username, 0)
+            self._drop(username)
+            self.stats['evictions'] += 1
+
+
+class ShardChanges(MutableMapping):
+    """
+    The shards changed by a write, in front of the shard store they are
+    read from.
+
+    The changes are only put in the store once the write is complete, so
+    that readers in other threads never see one half made.
+    """
+    def __init__(self, store: ShardStore):
+        self.store = store
+        # username -> the new user data, or None if the user was deleted
+        self.changes = {}
+        # username -> the identity of the file the changes are based on,
+        # for shards read from their files instead of the store. See
+        # ShardStore.apply().
+        self.bases = {}
+
+    def __getitem__(self, username):
+        if username not in self.changes:
+            return self.store[username]
+        data = self.changes[username]
+        if data is None:
+            raise KeyError(username)
+        return data
+
+    def __setitem__(self, username, data):
+        self.changes[username] = data
+
+    def __delitem__(self, username):
+        if username not in self:
+            raise KeyError(username)
+        self.changes[username] = None
+
+    def __contains__(self, username):
+        if username in self.changes:
+            return self.changes[username] is not None
+        return username in self.store
+
+    def __iter__(self):
+        added = {u for u, data in self.changes.items() if data is not None}
+        deleted = self.changes.keys() - added
+        return iter(sorted((set(self.store) | added) - deleted))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class ShardedDBEngine(DBEngine):
+    """
+    A DBEngine that stores each user in a separate file.
+
+    Only the shards of users that are actually accessed are read, so the
+    cost of a request is proportional to the size of the active user's
+    data rather than the size of the whole database. Journaling is not
+    supported with this layout.
+
+    The lookups of users by email and id, and the next user id, are kept
+    in a separate index file so that they do not require reading every
+    shard.
+
+    As with the other layouts, the changes to a user are seen by readers
+    all at once, when the write making them is done. The shards are not
+    versioned, however, so pin() has no effect: reads always see the last
+    published data.
+
+    Several processes may use the same directory. As with DBEngine, save()
+    commits under a lock file, and replays the changes made since the last
+    commit if another process changed one of the shards they were made
+    to. The version of a shard is the identity of its file, which every
+    save replaces.
+    """
+    _USER_INDEX_FILE = '_users.idx'
+
+    def __init__(self, directory='db_shards', cache_bytes=64 * 1024 * 1024):
+        """
+        Initialize the database connection.
+
+        :param directory: the directory holding the shard files
+        :param cache_bytes: the maximum combined size of the shard files
+            to keep in memory
+        """
+        self._store = ShardStore(directory, max_bytes=cache_bytes,
+                                 on_drop=self._forget)
+        # The commit lock is '_shards.lock' in the directory
+        super().__init__(os.path.join(directory, '_shards'))
+        # Identity of the user index file when it was last read or written
+        self._user_index_stat = None
+        self._user_index_dirty = False
+        # Users whose entries in the user lookups were changed since the
+        # index file was last written
+        self._user_index_changes = set()
+        # Serializes the changes to the index file of the threads of this
+        # process. The lock file serializes those of different processes.
+        self._user_index_lock = threading.Lock()
+        self._user_index_fd = None
+
+    def _user_index_path(self) -> str:
+        return os.path.join(self._store._dir, self._USER_INDEX_FILE)
+
+    def _load(self):
+        """
+        Discard the changes not saved yet, by reading the shards they were
+        made to again from their files. Readers see those shards all at
+        once. Other shards are loaded on demand.
+        """
+        with self._data_lock, self._writing():
+            changes = self._working.db = ShardChanges(self._store)
+            self._owned[id(changes)] = changes
+            for username in self._store.changed():
+                data, file_id = self._store.read(username)
+                changes.changes[username] = data
+                changes.bases[username] = file_id
+            # Read again from the index file when next used
+            self._user_index = None
+            self._user_index_dirty = False
+            self._user_index_changes = set()
+            self._operations = []
+
+    def reload(self, force=False) -> bool:
+        """
+        Drop cached shards that were changed by another process.
+
+        Dropped shards are re-read the next time they are accessed.
+
+        :return: True if any shard was dropped, False otherwise
+        """
+        if force:
+            with self._data_lock:
+                self._store = ShardStore(self._store._dir,
+                                         max_bytes=self._store._max_bytes,
+                                         on_drop=self._forget)
+                self.db = self._store
+                self._operations = []
+                self._user_index_dirty = False
+                self._user_index_changes = set()
+                self._users.clear()
+                self.reload_stats['performed'] += 1
+            return True
+        if self._store.invalidate_stale():
+            self.reload_stats['performed'] += 1
+            return True
+        self.reload_stats['skipped'] += 1
+        return False
+
+    def save(self) -> Future:
+        """
+        Save the shards of users with unsaved changes.
+
+        If another process saved one of those shards since it was read, the
+        changes are replayed on top of it first, and the errors they now
+        raise are raised here. See DBEngine.save().
+
+        Group commit is not supported with this layout, so the changes are
+        saved before this returns. Threads making changes wait until the
+        save is done.
+
+        :return: a Future that is already done
+        :raises ConflictError: if other processes kept committing first
+        """
+        with self._data_lock:
+            self._save()
+            error = self._failed.pop(threading.get_ident(), None)
+            if self._user_index_dirty:
+                # Another process may have written the index file since it
+                # was read, so it is read again under the lock and only the
+                # entries of the users changed here are replaced.
+                with self._lock_user_index():
+                    index = self._read_user_index()
+                    for username in self._user_index_changes:
+                        _index_user(index, self.db, username)
+                    self._write_user_index(index)
+                self._user_index_changes = set()
+        if error is not None:
+            raise error
+        return _completed()
+
+    def _conflicts(self) -> bool:
+        """
+        Tell whether another process changed the file of a shard with
+        unsaved changes since it was read. The lock must be held.
+        """
+        return bool(self._store.conflicts())
+
+    def _commit(self):
+        """Write the changed shards to disk. The lock must be held."""
+        self._store.flush()
+        self._operations = []
+
+    def add_user(self, user: User):
+        """
+        Add a new user to the database.
+
+        The id of the user is taken from the index file under its lock, so
+        that other processes never give the same id to another user.
+        """
+        if not user.id and user.username not in self.db:
+            user.id = self._reserve_user_id()
+        super().add_user(user)
+
+    def _reserve_user_id(self) -> int:
+        """
+        Take the next user id, and record in the index file that it is
+        taken.
+        """
+        with self._data_lock, self._lock_user_index():
+            index = self._read_user_index()
+            id_ = self._next_id
+            self._next_id += 1
+            if self._user_index_dirty:
+                # Only the next id is written; the changes made here are
+                # merged into the file by save()
+                path = self._user_index_path()
+                _write_json(path, {'next_id': self._next_id, **index})
+            else:
+                self._write_user_index(index)
+        return id_
+
+    @contextmanager
+    def _lock_user_index(self):
+        """Hold the lock that serializes the changes to the index file."""
+        with self._user_index_lock:
+            if fcntl is not None:
+                if self._user_index_fd is None:
+                    self._user_index_fd = os.open(
+                        self._user_index_path() + '.lock',
+                        os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._user_index_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._user_index_fd, fcntl.LOCK_UN)
+
+    def _read_user_index(self) -> dict:
+        """
+        Read the user lookups from the index file, or build them from the
+        shards if there is no index file. The next user id is brought up
+        to date with the one in the file.
+
+        Must be called with the index file locked if the lookups are to be
+        written back.
+        """
+        try:
+            with open(self._user_index_path(), encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {'email': {}, 'id': {}, 'user': {}}
+            for username in self.db:
+                _index_user(index, self.db, username)
+            ids = [int(i) for i in index['id'] if i.isdigit()]
+            index['next_id'] = max(ids, default=0) + 1
+        self._next_id = max(self._next_id, index.pop('next_id'))
+        return index
+
+    def _write_user_index(self, index: dict):
+        """
+        Write @index to the index file and use it as the user lookups.
+
+        Must be called with the index file locked.
+        """
+        path = self._user_index_path()
+        _write_json(path, {'next_id': self._next_id, **index})
+        self._user_index = index
+        self._user_index_stat = _file_id(os.stat(path))
+        self._user_index_dirty = False
+
+    def _get_user_index(self) -> dict:
+        """
+        Return the user lookups, reading them from the index file if it was
+        changed by another process.
+
+        The lookups are rebuilt from the shards if there is no index file.
+        """
+        index = self._user_index
+        if index is not None and (self._user_index_dirty or
+                                  self._user_index_id() == self._user_index_stat):
+            return index
+        with self._data_lock:
+            state = self._view()
+            file_id = self._user_index_id()
+            if state.user_index is not None and (
+                    self._user_index_dirty or file_id == self._user_index_stat):
+                # Read by another thread meanwhile
+                return state.user_index
+            state.user_index = self._read_user_index()
+            if file_id is None:
+                # Written by the next save()
+                self._user_index_dirty = True
+            else:
+                self._user_index_stat = file_id
+            return state.user_index
+
+    def _user_index_id(self) -> Union[tuple, None]:
+        """Return the identity of the index file, or None if there is none."""
+        try:
+            return _file_id(os.stat(self._user_index_path()))
+        except FileNotFoundError:
+            return None
+
+    def pin(self):
+        """The shards are not versioned, so there is nothing to pin."""
+        pass
+
+    def _forget(self, username):
+        """
+        Drop what is cached about a user whose shard left the shard store.
+
+        Indexes are only used with the data they were built from, so this
+        only frees their memory, and can be done from any thread.
+        """
+        self._users.pop(username, None)
+        self._state.indexes.discard(username)
+
+    def _update_user_index(self, username):
+        # Load the index first, so that changes made before it is first
+        # used are not lost
+        self._get_user_index()
+        super()._update_user_index(username)
+        self._user_index_dirty = True
+        self._user_index_changes.add(username)
+
+    def compact(self):
+        """Shards are always rewritten in full, so this is the same as save()."""
+        self.save()
+
+    @contextmanager
+    def _writing(self):
+        """
+        See DBEngine._writing(). The shards changed are put in the shard
+        store just before the new state is published, so that readers see
+        them along with the indexes built from them.
+        """
+        if self._working is not None:
+            yield
+            return
+        with super()._writing():
+            yield
+            working = self._working
+            if isinstance(working.db, ShardChanges):
+                self._store.apply(working.db.changes, working.db.bases)
+                working.db = self._store
+
+    def _apply(self, op: str, path: list, value=None):
+        working = self._working
+        if not isinstance(working.db, ShardChanges):
+            # Changed shards are kept aside until the write is done
+            working.db = ShardChanges(working.db)
+            self._owned[id(working.db)] = working.db
+        super()._apply(op, path, value)
+
+
+def _write_json(path, data, indent=None):
+    """
+    Replace the JSON file at @path with @data.
+
+    The data is first written to a temporary file with a unique name in
+    the same directory, so that writers in other threads and processes
+    never write to the same file, and readers never see a partly written
+    one.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                               prefix=os.path.basename(path) + '.',
+                               suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=indent, default=to_json)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _file_id(st: os.stat_result) -> tuple:
+    """Return a tuple identifying the version of a file."""
+    return st.st_ino, st.st_size, st.st_mtime_ns
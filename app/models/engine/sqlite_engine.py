@@ -0,0 +1,717 @@
+import json
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, time
+from typing import Iterator, Union
+from ..user import User
+from .columns import AMOUNT_SCALE, TransactionColumns
+from .db_engine import IntegrityError, _completed, parse_date_range
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    -- AUTOINCREMENT prevents the ids of deleted users from being reused
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL,
+    password TEXT NOT NULL,
+    default_profile TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
+
+CREATE TABLE IF NOT EXISTS profiles (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    description TEXT DEFAULT '',
+    version INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    id INTEGER PRIMARY KEY,
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    balance NUMERIC NOT NULL DEFAULT 0,
+    description TEXT DEFAULT '',
+    UNIQUE (profile_id, name)
+);
+
+-- A transfer is stored as two rows, one for each account involved.
+-- @data holds the full transaction record as JSON.
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT NOT NULL,
+    profile_id INTEGER NOT NULL REFERENCES profiles (id) ON DELETE CASCADE,
+    account_id INTEGER NOT NULL REFERENCES accounts (id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    subcategory TEXT,
+    time TEXT NOT NULL,
+    amount NUMERIC NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (id, account_id)
+);
+-- Serves unfiltered listings in (time, id) order
+CREATE INDEX IF NOT EXISTS idx_transactions_time
+    ON transactions (profile_id, time, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_account
+    ON transactions (profile_id, account_id, category, time);
+CREATE INDEX IF NOT EXISTS idx_transactions_category
+    ON transactions (profile_id, category, time);
+CREATE INDEX IF NOT EXISTS idx_transactions_subcategory
+    ON transactions (profile_id, category, subcategory, time);
+"""
+
+# The amount of a transaction truncated to whole units, as the running
+# totals of TransactionColumns have it
+_UNITS = f'CAST(ROUND(amount * {AMOUNT_SCALE}) AS INTEGER) / {AMOUNT_SCALE}'
+
+
+class SQLiteEngine:
+    """
+    A storage engine backed by SQLite.
+
+    Exposes the same interface as DBEngine. Each thread uses its own
+    connection. Changes are committed by save() and discarded by reload(),
+    mirroring how DBEngine keeps unsaved changes in memory.
+    """
+    def __init__(self, path='app.db'):
+        """Initialize the database connection and create missing tables."""
+        self.path = path
+        self._local = threading.local()
+        self.reload_stats = {'performed': 0, 'skipped': 0, 'replayed': 0}
+        # SQLite does its own locking, so these stay at zero. Kept for
+        # compatibility with DBEngine.
+        self.lock_stats = {'acquired': 0, 'wait_seconds': 0.0,
+                           'max_wait_seconds': 0.0, 'conflicts': 0}
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Return the connection of the current thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.execute('PRAGMA journal_mode = WAL')
+            self._local.conn = conn
+        return conn
+
+    def _profile_id(self, username, profile) -> int:
+        """Return the row id of a profile. Raise KeyError if not found."""
+        row = self._conn.execute(
+            'SELECT p.id FROM profiles p JOIN users u ON p.user_id = u.id'
+            ' WHERE u.username = ? AND p.name = ?',
+            (username, profile)
+        ).fetchone()
+        if row is None:
+            raise KeyError(profile)
+        return row['id']
+
+    def _account(self, profile_id, account) -> sqlite3.Row:
+        """Return the row of an account. Raise KeyError if not found."""
+        row = self._conn.execute(
+            'SELECT id, balance FROM accounts WHERE profile_id = ? AND name = ?',
+            (profile_id, account)
+        ).fetchone()
+        if row is None:
+            raise KeyError(account)
+        return row
+
+    def _filters(self, username, profile, account=None, category=None,
+                 subcategory=None, from_=None, to=None,
+                 after=None) -> tuple[str, list]:
+        """Build the WHERE clause shared by transaction queries."""
+        profile_id = self._profile_id(username, profile)
+        clauses = ['profile_id = ?']
+        params = [profile_id]
+        if account:
+            clauses.append('account_id = ?')
+            params.append(self._account(profile_id, account)['id'])
+        if category:
+            clauses.append('category = ?')
+            params.append(category)
+        if subcategory:
+            clauses.append('subcategory = ?')
+            params.append(subcategory)
+        if from_ or to:
+            from_, to = parse_date_range(from_, to)
+            clauses.append('time BETWEEN ? AND ?')
+            params.extend([_iso(from_), _iso(to)])
+        if after is not None:
+            time_, id_ = after
+            # Raise ValueError if the time is malformed, as DBEngine does
+            datetime.fromisoformat(time_)
+            # Written so that the bound on time can use the indexes
+            clauses.append('time >= ? AND (time > ? OR id > ?)')
+            params.extend([time_, time_, id_])
+        return ' AND '.join(clauses), params
+
+    def get_transactions(self, username, profile, account=None, category=None,
+                         subcategory=None, limit=None,
+                         from_: Union[datetime, str, None] = None,
+                         to: Union[datetime, str, None] = None,
+                         after: tuple[str, str] = None) -> list[dict]:
+        """
+        Fetch transactions using the specified criteria.
+
+        See DBEngine.get_transactions().
+        """
+        where, params = self._filters(username, profile, account, category,
+                                      subcategory, from_, to, after)
+        sql = f'SELECT data FROM transactions WHERE {where} ORDER BY time, id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return [json.loads(row['data'])
+                for row in self._conn.execute(sql, params)]
+
+    def iter_transactions(self, username, profile, account=None,
+                          category=None, subcategory=None,
+                          from_: Union[datetime, str, None] = None,
+                          to: Union[datetime, str, None] = None) -> Iterator[dict]:
+        """
+        Lazily yield the transactions matching the specified criteria.
+
+        See DBEngine.iter_transactions(). The results are read in a
+        transaction of their own, on a separate connection, so they are a
+        snapshot of the data committed when this method is called.
+        """
+        where, params = self._filters(username, profile, account, category,
+                                      subcategory, from_, to)
+        # The connection is only used by the returned generator, which may
+        # be iterated from another thread
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            conn.execute('BEGIN')
+            cursor = conn.execute(
+                f'SELECT data FROM transactions WHERE {where} ORDER BY time, id',
+                params
+            )
+        except sqlite3.Error:
+            conn.close()
+            raise
+        return _iter_rows(conn, cursor)
+
+    def get_subcategory_totals(self, username, profile, category,
+                               from_: Union[datetime, str, None] = None,
+                               to: Union[datetime, str, None] = None) -> dict:
+        """
+        Compute the total amount of each subcategory of @category.
+
+        See DBEngine.get_subcategory_totals().
+        """
+        where, params = self._filters(username, profile, category=category,
+                                      from_=from_, to=to)
+        rows = self._conn.execute(
+            "SELECT COALESCE(NULLIF(subcategory, ''), 'Uncategorized') AS name,"
+            f' SUM({_UNITS}) AS total FROM transactions WHERE {where}'
+            ' GROUP BY name ORDER BY MIN(time), name',
+            params
+        )
+        return {row['name']: row['total'] for row in rows}
+
+    def get_total(self, username, profile, category,
+                  from_: Union[datetime, str, None] = None,
+                  to: Union[datetime, str, None] = None) -> int:
+        """
+        Compute the total amount of @category transactions.
+
+        See DBEngine.get_total().
+        """
+        where, params = self._filters(username, profile, category=category,
+                                      from_=from_, to=to)
+        row = self._conn.execute(
+            f'SELECT COALESCE(SUM({_UNITS}), 0) AS total FROM transactions'
+            f' WHERE {where}',
+            params
+        ).fetchone()
+        return row['total']
+
+    def get_subcategories(self, username, profile, category) -> dict[str, int]:
+        """
+        Count the transactions in each subcategory of @category.
+
+        See DBEngine.get_subcategories().
+        """
+        where, params = self._filters(username, profile, category=category)
+        rows = self._conn.execute(
+            "SELECT COALESCE(NULLIF(subcategory, ''), 'Uncategorized') AS name,"
+            f' COUNT(DISTINCT id) AS n FROM transactions WHERE {where}'
+            ' GROUP BY name ORDER BY n DESC',
+            params
+        )
+        return {row['name']: row['n'] for row in rows}
+
+    def get_monthly_totals(self, username, profile, category, subcategory=None,
+                           from_: Union[datetime, str, None] = None,
+                           to: Union[datetime, str, None] = None) -> dict:
+        """
+        Compute the total amount of @category transactions in each month.
+
+        See DBEngine.get_monthly_totals().
+        """
+        where, params = self._filters(username, profile, category=category,
+                                      subcategory=subcategory,
+                                      from_=from_, to=to)
+        rows = self._conn.execute(
+            'SELECT substr(time, 1, 7) AS month, SUM(amount) AS total'
+            f' FROM transactions WHERE {where} GROUP BY month ORDER BY month',
+            params
+        )
+        return {row['month']: row['total'] for row in rows}
+
+    def get_columns(self, username, profile) -> TransactionColumns:
+        """
+        Get a columnar copy of the transactions of a profile.
+
+        See DBEngine.get_columns(). The columns are read from the database
+        on every call, so totals are better computed with the methods
+        above, which leave the work to SQLite.
+        """
+        columns = TransactionColumns()
+        rows = self._conn.execute(
+            'SELECT a.name AS account, t.category, t.subcategory, t.time,'
+            ' t.amount FROM transactions t JOIN accounts a ON t.account_id = a.id'
+            ' WHERE t.profile_id = ? ORDER BY t.time, t.id',
+            (self._profile_id(username, profile),)
+        )
+        for row in rows:
+            columns.append(row['account'], row['category'], dict(row))
+        return columns
+
+    def add_user(self, user: User):
+        """Add a new user to the database."""
+        if self.get_user_by_username(user.username):
+            raise ValueError(f"The username '{user.username}' already exists")
+        cursor = self._conn.execute(
+            'INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)',
+            (user.id or None, user.username, user.email, user.password)
+        )
+        if not user.id:
+            user.id = cursor.lastrowid
+        self.add_profile(user.username, 'personal')
+
+    def add_profile(self, username, profile, description='', default=False):
+        """
+        Add a new profile under the specified user.
+
+        See DBEngine.add_profile().
+        """
+        if len(self.get_profiles(username)) == 0:
+            default = True
+        if profile in self.get_profiles(username):
+            raise ValueError(f"The profile '{profile}' already exists")
+        self._conn.execute(
+            'INSERT INTO profiles (user_id, name, description)'
+            ' SELECT id, ?, ? FROM users WHERE username = ?',
+            (profile, description, username)
+        )
+        if default:
+            self.set_default_profile(username, profile)
+
+    def add_account(self, username, profile, account,
+                    balance=0, description=''):
+        """Add an account under the profile of a specific username."""
+        profile_id = self._profile_id(username, profile)
+        if account in self.get_accounts(username, profile):
+            raise ValueError(f"The account '{account}' already exists"
+                             f" under the profile '{profile}'")
+        if balance < 0:
+            raise IntegrityError('Balance cannot be negative')
+        self._conn.execute(
+            'INSERT INTO accounts (profile_id, name, balance, description)'
+            ' VALUES (?, ?, ?, ?)',
+            (profile_id, account, balance, description)
+        )
+        self._bump_version(profile_id)
+
+    def add_transaction(self, username, profile, category, **trans_details):
+        """
+        Add a transaction and update the balances of the accounts involved.
+
+        See DBEngine.add_transaction().
+        """
+        trans_details['id'] = str(uuid.uuid4())
+        self._add_transaction(username, profile, category, trans_details)
+
+    def _add_transaction(self, username, profile, category, trans_details: dict):
+        """Add a transaction whose id is already set. See add_transaction()."""
+        trans_details['user_id'] = username
+        trans_details['category'] = category
+        # Set date to the current one if none is specified
+        if not trans_details.get('time'):
+            trans_details['time'] = datetime.now().strftime("%Y-%m-%d")
+
+        debited = trans_details.get('account_debited')
+        credited = trans_details.get('account_credited')
+        amount = trans_details['amount']
+        if amount <= 0:
+            raise IntegrityError('Amount must be greater than 0')
+        profile_id = self._profile_id(username, profile)
+        account_debited = self._account(profile_id, debited) if debited else None
+        account_credited = self._account(profile_id, credited) if credited else None
+
+        if category == 'incomes':
+            if not account_debited:
+                raise IntegrityError("The transaction field 'account_debited' must"
+                                     " be specified for income transactions")
+            changes = [(account_debited, amount)]
+        elif category == 'expenses':
+            # Abort the transaction if it would cause a negative balance
+            if account_credited['balance'] - amount < 0:
+                raise IntegrityError('Transaction results in negative balance')
+            changes = [(account_credited, -amount)]
+        elif category == 'transfers':
+            if not all([account_credited, account_debited]):
+                raise IntegrityError(
+                    "Both the transaction fields 'account_credited' and "
+                    "'account_debited' must be specified for transfers")
+            if credited == debited:
+                raise IntegrityError('A transfer cannot be done to the same account')
+            if account_credited['balance'] - amount < 0:
+                raise IntegrityError('Transaction results in negative balance')
+            changes = [(account_credited, -amount), (account_debited, amount)]
+        else:
+            raise ValueError(f"The category '{category}' does not exist")
+
+        data = json.dumps(trans_details)
+        for account, change in changes:
+            self._conn.execute(
+                'UPDATE accounts SET balance = balance + ? WHERE id = ?',
+                (change, account['id'])
+            )
+            self._conn.execute(
+                'INSERT INTO transactions (id, profile_id, account_id, category,'
+                ' subcategory, time, amount, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (trans_details['id'], profile_id, account['id'], category,
+                 trans_details.get('subcategory'), trans_details['time'],
+                 amount, data)
+            )
+        self._bump_version(profile_id)
+
+    def _bump_version(self, profile_id):
+        """Record that the data of a profile has changed."""
+        self._conn.execute(
+            'UPDATE profiles SET version = version + 1 WHERE id = ?',
+            (profile_id,)
+        )
+
+    def get_data_version(self, username, profile) -> int:
+        """
+        Get the data version of a profile.
+
+        See DBEngine.get_data_version().
+        """
+        row = self._conn.execute(
+            'SELECT version FROM profiles WHERE id = ?',
+            (self._profile_id(username, profile),)
+        ).fetchone()
+        return row['version']
+
+    def rollback_transaction(self, username, profile, trans_id):
+        """
+        Undo a transaction and restore the balances of the accounts involved.
+
+        See DBEngine.rollback_transaction().
+        """
+        profile_id = self._profile_id(username, profile)
+        # Served by the primary key, one row for each account involved
+        rows = self._conn.execute(
+            'SELECT t.account_id, t.amount, t.data, a.name, a.balance'
+            ' FROM transactions t JOIN accounts a ON a.id = t.account_id'
+            ' WHERE t.id = ? AND t.profile_id = ?',
+            (trans_id, profile_id)
+        ).fetchall()
+        if not rows:
+            raise KeyError(trans_id)
+        # The balance changes made by add_transaction(), reversed. Incomes
+        # and transfers add to the account debited.
+        debited = json.loads(rows[0]['data']).get('account_debited')
+        changes = [
+            (row['account_id'],
+             -row['amount'] if row['name'] == debited else row['amount'])
+            for row in rows
+        ]
+        for row, (_, change) in zip(rows, changes):
+            if row['balance'] + change < 0:
+                raise IntegrityError('Undoing the transaction results in'
+                                     ' negative balance')
+        for account_id, change in changes:
+            self._conn.execute(
+                'UPDATE accounts SET balance = balance + ? WHERE id = ?',
+                (change, account_id)
+            )
+        self._conn.execute(
+            'DELETE FROM transactions WHERE id = ? AND profile_id = ?',
+            (trans_id, profile_id)
+        )
+        self._bump_version(profile_id)
+
+    def edit_transaction(self, username, profile, trans_id, **changes):
+        """
+        Change the details of a transaction.
+
+        See DBEngine.edit_transaction().
+        """
+        row = self._conn.execute(
+            'SELECT data FROM transactions WHERE id = ? AND profile_id = ?',
+            (trans_id, self._profile_id(username, profile))
+        ).fetchone()
+        if row is None:
+            raise KeyError(trans_id)
+        trans_details = {**json.loads(row['data']), **changes, 'id': trans_id}
+        category = trans_details.pop('category')
+        # Undo the rollback if the changed transaction is rejected. The
+        # savepoint must be inside a transaction, or releasing it would
+        # commit the changes before save().
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN')
+        self._conn.execute('SAVEPOINT edit_transaction')
+        try:
+            self.rollback_transaction(username, profile, trans_id)
+            self._add_transaction(username, profile, category, trans_details)
+        except BaseException:
+            self._conn.execute('ROLLBACK TO edit_transaction')
+            raise
+        finally:
+            self._conn.execute('RELEASE edit_transaction')
+
+    def pin(self):
+        """
+        Make the current thread read the data as it is now.
+
+        This does nothing, since SQLite reads the latest committed data in
+        each statement.
+        """
+        pass
+
+    def unpin(self):
+        """Make the current thread read the latest data again."""
+        pass
+
+    @contextmanager
+    def batch(self):
+        """
+        Make several changes together.
+
+        Other connections only see changes once save() commits them, so
+        there is nothing to do.
+        """
+        yield
+
+    def save(self) -> Future:
+        """
+        Commit changes to the database.
+
+        :return: a Future that is already done
+        """
+        self._conn.commit()
+        return _completed()
+
+    def compact(self):
+        """Reclaim unused space in the database file."""
+        self._conn.commit()
+        self._conn.execute('VACUUM')
+
+    def get_accounts(self, username, profile) -> list:
+        """Get a list of account names under the given profile."""
+        rows = self._conn.execute(
+            'SELECT name FROM accounts WHERE profile_id = ?',
+            (self._profile_id(username, profile),)
+        )
+        return sorted([row['name'] for row in rows], key=str.lower)
+
+    def get_all_account_balances(self, username, profile) -> dict:
+        """
+        Get the balances of all accounts.
+
+        Returns a dict in which the keys are account names and the values are
+        the corresponding account balances.
+        """
+        rows = self._conn.execute(
+            'SELECT name, balance FROM accounts WHERE profile_id = ? ORDER BY id',
+            (self._profile_id(username, profile),)
+        )
+        return {row['name']: row['balance'] for row in rows}
+
+    def get_account_balance(self, username, profile, account) -> int:
+        """Get the balance of the specified account."""
+        profile_id = self._profile_id(username, profile)
+        return self._account(profile_id, account)['balance']
+
+    def get_profiles(self, username) -> list[str]:
+        """Get a list of profiles registered under the given user."""
+        if not self.get_user_by_username(username):
+            raise KeyError(username)
+        rows = self._conn.execute(
+            'SELECT p.name FROM profiles p JOIN users u ON p.user_id = u.id'
+            ' WHERE u.username = ? ORDER BY p.name',
+            (username,)
+        )
+        return [row['name'] for row in rows]
+
+    def get_total_balance(self, username, profile):
+        """Return sum of balances from all accounts in the given profile."""
+        row = self._conn.execute(
+            'SELECT COALESCE(SUM(balance), 0) AS total FROM accounts'
+            ' WHERE profile_id = ?',
+            (self._profile_id(username, profile),)
+        ).fetchone()
+        return row['total']
+
+    def get_user_by_username(self, username):
+        """
+        Get a user by the username.
+
+        :return: A User instance or None if @username is not found
+        """
+        row = self._conn.execute(
+            'SELECT * FROM users WHERE username = ?', (username,)
+        ).fetchone()
+        return _user_from_row(row)
+
+    def get_all_usernames(self):
+        """Get a list of all usernames in the database."""
+        rows = self._conn.execute('SELECT username FROM users ORDER BY id')
+        return [row['username'] for row in rows]
+
+    def get_user_by_id(self, id_: str):
+        """
+        Get a user by their ID.
+
+        :return: A User instance or None if @id_ is not found
+        """
+        row = self._conn.execute(
+            'SELECT * FROM users WHERE id = ?', (id_,)
+        ).fetchone()
+        return _user_from_row(row)
+
+    def set_default_profile(self, username, profile):
+        """
+        Set the default profile for the given username.
+
+        The profile must already exist, otherwise an IntegrityError is raised.
+        """
+        if profile not in self.get_profiles(username):
+            raise IntegrityError("Profile does not exist")
+        self._conn.execute(
+            'UPDATE users SET default_profile = ? WHERE username = ?',
+            (profile, username)
+        )
+
+    def reload(self, force=False) -> bool:
+        """
+        Discard uncommitted changes.
+
+        SQLite always reads the latest committed data, so there is nothing
+        to re-read.
+
+        :return: False, since no data needs to be re-read
+        """
+        self._conn.rollback()
+        self.reload_stats['skipped'] += 1
+        return False
+
+    def delete_user(self, username: str):
+        """Delete a user from the database"""
+        cursor = self._conn.execute(
+            'DELETE FROM users WHERE username = ?', (username,)
+        )
+        if cursor.rowcount == 0:
+            raise KeyError(username)
+
+    def email_exists(self, email: str) -> bool:
+        """Check if an email exists."""
+        row = self._conn.execute(
+            'SELECT 1 FROM users WHERE email = ?', (email,)
+        ).fetchone()
+        return row is not None
+
+    def import_json(self, db: dict):
+        """
+        Import the contents of a DBEngine database.
+
+        @db is the parsed content of a db.json file. Users that already
+        exist are skipped. Changes are not committed until save() is called.
+
+        :return: the number of users imported
+        """
+        n_users = 0
+        for username, user in db.items():
+            if username.startswith('_') or self.get_user_by_username(username):
+                # Skip engine metadata and existing users
+                continue
+            cursor = self._conn.execute(
+                'INSERT INTO users (id, username, email, password, default_profile)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (user['id'] if not self.get_user_by_id(user['id']) else None,
+                 username, user['email'], user['password'],
+                 user['default_profile'])
+            )
+            user_id = cursor.lastrowid
+            for profile, profile_data in user['profiles'].items():
+                profile_id = self._conn.execute(
+                    'INSERT INTO profiles (user_id, name, description, version)'
+                    ' VALUES (?, ?, ?, ?)',
+                    (user_id, profile, profile_data['description'],
+                     profile_data.get('version', 0))
+                ).lastrowid
+                for account, account_data in profile_data['accounts'].items():
+                    account_id = self._conn.execute(
+                        'INSERT INTO accounts (profile_id, name, balance, description)'
+                        ' VALUES (?, ?, ?, ?)',
+                        (profile_id, account, account_data['balance'],
+                         account_data['description'])
+                    ).lastrowid
+                    self._conn.executemany(
+                        'INSERT INTO transactions (id, profile_id, account_id,'
+                        ' category, subcategory, time, amount, data)'
+                        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        [(t['id'], profile_id, account_id, category,
+                          t.get('subcategory'), t['time'], t['amount'],
+                          json.dumps(t))
+                         for category, transactions in account_data['transactions'].items()
+                         for t in transactions]
+                    )
+            n_users += 1
+        return n_users
+
+
+def _iso(dt: datetime) -> str:
+    """
+    Format a datetime for comparison with the stored 'time' strings.
+
+    Dates are stored as 'YYYY-MM-DD', which sorts before any time on the
+    same day, so midnight is formatted as a bare date.
+    """
+    if dt.time() == time(0):
+        return dt.strftime('%Y-%m-%d')
+    return dt.isoformat()
+
+
+def _user_from_row(row: Union[sqlite3.Row, None]) -> Union[User, None]:
+    """Create a User from a row of the users table."""
+    if row is None:
+        return None
+    return User(
+        username=row['username'],
+        user_id=row['id'],
+        password=row['password'],
+        email=row['email'],
+        default_profile=row['default_profile']
+    )
+
+
+def _iter_rows(conn: sqlite3.Connection, cursor: sqlite3.Cursor,
+               batch_size=1000) -> Iterator[dict]:
+    """Yield the transactions selected by @cursor, then close @conn."""
+    try:
+        while rows := cursor.fetchmany(batch_size):
+            for (data,) in rows:
+                yield json.loads(data)
+    finally:
+        conn.close()
@@ -29,5 +29,5 @@ class User(UserMixin):
         """Set the default profile for this user."""
         from app import db
         db.set_default_profile(self.username, profile)
-        db.save()
+        db.save().result()
         self.default_profile = profile
@@ -1,11 +1,17 @@
 """Handles the urls that the module supports"""
-from app import app, db
-from flask import render_template, flash, redirect, url_for, request, session
+import io
+from app import app, db, chart_cache
+from flask import render_template, flash, redirect, url_for, request, session, jsonify, Response
 from app.forms import LoginForm, RegistrationForm, TransactionForm, AddAccountForm, AddProfileForm
+from app.forms import ImportTransactionsForm
 from flask_login import login_user, logout_user, login_required, current_user
 from .models.user import User
 from werkzeug.security import generate_password_hash, check_password_hash
 from .utils.stats import get_summary_stats, get_summary_graphs, count_charts, get_income_plots, get_expense_plots
+from .utils.stats import get_summary_chart_data, get_income_chart_data, get_expense_chart_data
+from .utils.bulk_import import import_transactions as import_file, detect_format
+from .utils.export import export_transactions as export_chunks, FORMATS as EXPORT_FORMATS
+from .utils.pagination import get_page, DEFAULT_PAGE_SIZE
 from .utils.flask_utils import get_current_profile, get_request_args
 from .models.engine.db_engine import IntegrityError
 
@@ -26,6 +32,13 @@ def home():
     stats = get_summary_stats(current_user.username, data['profile'],
                               from_=data['start_date'], to=data['end_date'])
     data.update(stats)
+    if app.config['CHART_MODE'] == 'client':
+        # The charts are drawn by the browser from the chart data API
+        data['chart_api'] = url_for('chart_data', page='summary')
+        return render_template('home.html', title='Home',
+                               user=current_user,
+                               profiles=all_profiles,  # Needed by JS.
+                               data=data)
     # Generate visualizations.
     # Format: charts = { 'chart_name': ('title', 'base64-encoded chart'), ... }
     charts = get_summary_graphs(
@@ -67,7 +80,7 @@ def register():
         user = User(username=form.username.data, email=form.email.data,
                     password=hashed_password)
         db.add_user(user)
-        db.save()
+        db.save().result()
         flash(f'Account has been created for {form.username.data}. '
               f'You can now login!', 'success')
         return redirect(url_for('login'))
@@ -96,6 +109,13 @@ def income():
     stats = get_summary_stats(current_user.username, data['profile'],
                               from_=data['start_date'], to=data['end_date'])
     data.update(stats)
+    if app.config['CHART_MODE'] == 'client':
+        # The charts are drawn by the browser from the chart data API
+        data['chart_api'] = url_for('chart_data', page='incomes')
+        return render_template('income.html', title='Incomes',
+                               user=current_user,
+                               profiles=all_profiles,  # Needed by JS.
+                               data=data)
     charts = get_income_plots(current_user.username, data['profile'],
                               data['start_date'], data['end_date'])
     data['charts'] = charts
@@ -115,6 +135,13 @@ def expense():
     stats = get_summary_stats(current_user.username, data['profile'],
                               from_=data['start_date'], to=data['end_date'])
     data.update(stats)
+    if app.config['CHART_MODE'] == 'client':
+        # The charts are drawn by the browser from the chart data API
+        data['chart_api'] = url_for('chart_data', page='expenses')
+        return render_template('expense.html', title='Expenses',
+                               user=current_user,
+                               profiles=all_profiles,  # Needed by JS.
+                               data=data)
     charts = get_expense_plots(current_user.username, data['profile'],
                                data['start_date'], data['end_date'])
     data['charts'] = charts
@@ -125,6 +152,131 @@ def expense():
                            data=data)
 
 
+@app.route('/api/charts/<page>')
+@login_required
+def chart_data(page):
+    """Serves the data behind the charts of the summary, incomes and expenses pages"""
+    data = get_request_args(request)
+    username = current_user.username
+    args = (username, data['profile'])
+    kwargs = {'from_': data['start_date'], 'to': data['end_date']}
+    if page == 'summary':
+        stats = get_summary_stats(*args, **kwargs)
+        charts = get_summary_chart_data(*args, stats['top_incomes'],
+                                        stats['top_expenses'], **kwargs)
+    elif page == 'incomes':
+        charts = get_income_chart_data(*args, **kwargs)
+    elif page == 'expenses':
+        charts = get_expense_chart_data(*args, **kwargs)
+    else:
+        return jsonify({'error': f'Unknown page: {page}'}), 404
+    data['charts'] = charts
+    return jsonify(data)
+
+
+def _page_args(r: request) -> dict:
+    """Load the filters and the cursor of a transaction page from a request URL."""
+    return {
+        'cursor': r.args.get('cursor') or None,
+        'account': r.args.get('account') or None,
+        'category': r.args.get('category') or None,
+        'subcategory': r.args.get('subcategory') or None,
+        'from_': r.args.get('from') or None,
+        'to': r.args.get('to') or None,
+    }
+
+
+@app.route('/transactions')
+@login_required
+def transactions():
+    """Lists the transactions of the current profile, a page at a time"""
+    data = get_request_args(request)
+    profiles = db.get_profiles(current_user.username)  # Needed by JS
+    args = _page_args(request)
+    try:
+        page, next_cursor = get_page(current_user.username, data['profile'],
+                                     DEFAULT_PAGE_SIZE, **args)
+    except (ValueError, KeyError) as e:
+        flash(f'Invalid filter: {e}', 'error')
+        page, next_cursor = [], None
+    # The filters, as URL parameters, without the cursor
+    filters = {k.rstrip('_'): v for k, v in args.items() if v and k != 'cursor'}
+    data.update({
+        'transactions': page,
+        'next_cursor': next_cursor,
+        'filters': filters,
+        'accounts': db.get_accounts(current_user.username, data['profile']),
+    })
+    return render_template('transactions.html', title='Transactions',
+                           data=data, profiles=profiles)
+
+
+@app.route('/api/transactions')
+@login_required
+def transactions_api():
+    """
+    Serves the transactions of the current profile, a page at a time.
+
+    Query parameters: limit, cursor (the 'next_cursor' of the previous
+    page), account, category, subcategory, from and to (YYYY-MM-DD).
+    """
+    profile = get_current_profile()
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        page, next_cursor = get_page(current_user.username, profile, limit,
+                                     **_page_args(request))
+    except KeyError as e:
+        return jsonify({'error': f'{e} does not exist'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'profile': profile,
+        'transactions': page,
+        'next_cursor': next_cursor,
+    })
+
+@app.route('/export_transactions')
+@login_required
+def export_transactions():
+    """
+    Streams the transactions of the current profile as CSV or JSON lines.
+
+    Query parameters: format ('csv' or 'jsonl'), account, category,
+    subcategory, from and to (YYYY-MM-DD).
+    """
+    username = current_user.username
+    profile = get_current_profile()
+    format = request.args.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unknown format: {format}'}), 400
+    try:
+        chunks = export_chunks(
+            username, profile, format,
+            account=request.args.get('account'),
+            category=request.args.get('category'),
+            subcategory=request.args.get('subcategory'),
+            from_=request.args.get('from'),
+            to=request.args.get('to'),
+        )
+    except KeyError as e:
+        return jsonify({'error': f'{e} does not exist'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    filename = f'{username}-{profile}-transactions.{format}'
+    return Response(chunks, mimetype=EXPORT_FORMATS[format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+@app.route('/metrics')
+@login_required
+def metrics():
+    """Serves counters for monitoring the storage engine and caches"""
+    return jsonify({
+        'db_reloads': db.reload_stats,
+        'db_locks': db.lock_stats,
+        'chart_cache': chart_cache.stats,
+    })
+
 
 @app.route('/logout')
 def logout():
@@ -175,7 +327,7 @@ def add_transaction():
 
         try:
             db.add_transaction(username, profile, category, **transaction_details)
-            db.save()
+            db.save().result()
             flash('Transaction added successfully', 'success')
             return redirect(url_for('home'))  # Redirect to the dashboard or another page
         except ValueError as e:
@@ -190,6 +342,37 @@ def add_transaction():
     return render_template('add_transaction.html', form=form, title="Add Transaction", acc=user_accounts)
 
 
+# Route for importing transactions in bulk
+@app.route('/import_transactions', methods=['GET', 'POST'])
+@login_required
+def import_transactions():
+    username = current_user.username
+    user_profile = get_current_profile()
+    user_accounts = db.get_accounts(username, user_profile)
+
+    if not user_accounts:
+        flash(f'You need to create at least one account in the {user_profile} profile', 'alert')
+        return redirect(url_for('add_account'))
+
+    form = ImportTransactionsForm(user_accounts=user_accounts)
+    report = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        # The file is read as a stream, without loading it all in memory
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            report = import_file(username, user_profile, stream,
+                                 detect_format(upload.filename),
+                                 form.account.data)
+            flash(f'{report.imported} transaction(s) imported successfully', 'success')
+            if report.errors:
+                flash(f'{len(report.errors)} row(s) could not be imported', 'error')
+        except ValueError as e:
+            flash(str(e), 'error')
+    return render_template('import_transactions.html', form=form, report=report,
+                           title="Import Transactions")
+
+
 # Route for adding a an account
 @app.route('/add_account', methods=['GET', 'POST'])
 @login_required
@@ -206,7 +389,7 @@ def add_account():
 
         try:
             db.add_account(username, profile, account, balance, description)
-            db.save()
+            db.save().result()
             flash('Account added successfully', 'success')
             return redirect(url_for('home'))
         except (ValueError, IntegrityError) as e:
@@ -227,7 +410,7 @@ def add_profile():
         set_as_default = form.set_as_default.data
         try:
             db.add_profile(username, profile, description, set_as_default)
-            db.save()
+            db.save().result()
             flash('Profile added successfully', 'success')
             return redirect(url_for('home'))
         except ValueError as e:
@@ -0,0 +1,66 @@
+// Draws the charts of a page from the data served by /api/charts/<page>.
+// See get_summary_chart_data() in app/utils/stats.py for the data format.
+(function () {
+    var group = document.getElementById('chartsGroup');
+    if (!group) {
+        return;
+    }
+
+    function chartConfig(chart) {
+        if (chart.type === 'donut') {
+            return {
+                type: 'doughnut',
+                data: {
+                    labels: chart.labels,
+                    datasets: [{data: chart.values}]
+                },
+                options: {
+                    cutout: '70%',
+                    plugins: {legend: {position: 'bottom'}}
+                }
+            };
+        }
+        return {
+            type: 'line',
+            data: {
+                labels: chart.labels,
+                datasets: chart.series.map(function (series) {
+                    return {label: series.label, data: series.values};
+                })
+            },
+            options: {
+                scales: {x: {ticks: {maxRotation: 60, minRotation: 60}}}
+            }
+        };
+    }
+
+    function addChart(chart) {
+        // Same markup as the server-rendered charts in charts.html
+        var container = document.createElement('div');
+        container.className = 'chart-container';
+        var title = document.createElement('span');
+        title.className = 'chart-title';
+        title.textContent = chart.title;
+        var area = document.createElement('div');
+        area.className = 'chart-area';
+        var canvas = document.createElement('canvas');
+        area.appendChild(canvas);
+        container.appendChild(title);
+        container.appendChild(area);
+        group.appendChild(container);
+        new Chart(canvas, chartConfig(chart));
+    }
+
+    fetch(group.dataset.url, {credentials: 'same-origin'})
+        .then(function (response) {
+            return response.json();
+        })
+        .then(function (data) {
+            var charts = data.charts;
+            if (charts.length === 0) {
+                document.getElementById('chartDisclaimer').style.display = 'block';
+                return;
+            }
+            charts.forEach(addChart);
+        });
+})();
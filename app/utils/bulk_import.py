@@ -0,0 +1,232 @@
+"""
+Bulk import of transactions from CSV and OFX files.
+
+Files are read as a stream of rows. The rows are checked in batches
+against the accounts of the profile, then applied in date order with
+DBEngine.add_transaction(), so the same rules hold as for transactions
+added one at a time. Rows that break a rule are skipped and reported
+with their line number. The database is saved once, after the last row.
+
+CSV files must have a header row. The recognised columns are, in any
+order and case:
+
+- date (or time): YYYY-MM-DD
+- amount: positive, or signed if there is no category column, in which
+  case negative amounts are expenses and positive amounts incomes
+- category (or type): income(s), expense(s) or transfer(s)
+- subcategory, description (or memo)
+- account, or account_debited and account_credited. The account of the
+  import is used for rows with neither.
+
+In OFX files, each <STMTTRN> is a transaction of the account of the
+import, with TRNAMT as its signed amount, NAME as its subcategory and
+MEMO as its description.
+"""
+import csv
+import re
+from datetime import date
+from itertools import chain, islice
+from typing import IO, Iterator
+from app import db
+from app.models.engine.db_engine import IntegrityError
+
+FORMATS = ('csv', 'ofx')
+# The number of rows read and checked at a time
+BATCH_SIZE = 1000
+CATEGORIES = {
+    'income': 'incomes', 'incomes': 'incomes',
+    'expense': 'expenses', 'expenses': 'expenses',
+    'transfer': 'transfers', 'transfers': 'transfers',
+}
+COLUMN_ALIASES = {'time': 'date', 'type': 'category', 'memo': 'description'}
+DATE = re.compile(r'\d{4}-\d{2}-\d{2}$')
+OFX_FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+# Found near the start of OFX 1.x (SGML) and 2.x (XML) files
+OFX_HEADER = re.compile(r'OFXHEADER|<OFX>', re.IGNORECASE)
+
+
+class ImportReport:
+    """The outcome of an import."""
+    def __init__(self):
+        self.imported = 0
+        # (line number, error message) of each rejected row
+        self.errors: list[tuple[int, str]] = []
+
+    def reject(self, line: int, message: str):
+        self.errors.append((line, message))
+
+
+def detect_format(filename: str) -> str:
+    """Guess the format of a file from its extension."""
+    return 'ofx' if filename.lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+
+def read_csv(f: IO[str]) -> Iterator[tuple[int, dict]]:
+    """
+    Yield the rows of a CSV file.
+
+    :return: an iterator of (line number, row) tuples. Rows map the
+        lower-cased column names of the header to their values
+    :raises ValueError: if the file is not valid CSV
+    """
+    reader = csv.reader(f)
+    try:
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [h.strip().lower() for h in header]
+        columns = [COLUMN_ALIASES.get(c, c) for c in columns]
+        for values in reader:
+            if not any(v.strip() for v in values):
+                continue
+            yield reader.line_num, dict(zip(columns, (v.strip() for v in values)))
+    except csv.Error as e:
+        raise ValueError(f'Malformed CSV file at line {reader.line_num}: {e}')
+
+
+def read_ofx(f: IO[str], chunk_size=64 * 1024) -> Iterator[tuple[int, dict]]:
+    """
+    Yield the transactions of an OFX file, as rows of a CSV file would be.
+
+    Both the SGML (OFX 1.x) and the XML (OFX 2.x) forms are read.
+
+    :return: an iterator of (number of the transaction, row) tuples
+    :raises ValueError: if the file is not OFX, or ends in the middle of
+        a transaction
+    """
+    chunks = iter(lambda: f.read(chunk_size), '')
+    first = next(chunks, '')
+    if first and not OFX_HEADER.search(first):
+        # Rather than buffer a whole file with no transactions in it
+        raise ValueError('The file is not an OFX file')
+    buffer = ''
+    n = 0
+    for chunk in chain([first], chunks):
+        buffer += chunk
+        upper = buffer.upper()
+        start = 0
+        while (end := upper.find('</STMTTRN>', start)) >= 0:
+            begin = upper.rfind('<STMTTRN>', start, end)
+            block = buffer[max(begin, start):end]
+            start = end + len('</STMTTRN>')
+            fields = {k.upper(): v.strip()
+                      for k, v in OFX_FIELD.findall(block)}
+            n += 1
+            posted = fields.get('DTPOSTED', '')
+            yield n, {
+                'date': f'{posted[:4]}-{posted[4:6]}-{posted[6:8]}' if posted else '',
+                'amount': fields.get('TRNAMT', ''),
+                'subcategory': fields.get('NAME', ''),
+                'description': fields.get('MEMO', ''),
+            }
+        buffer = buffer[start:]
+    if '<STMTTRN>' in buffer.upper():
+        raise ValueError(f'Malformed OFX file: transaction {n + 1} has no'
+                         ' closing </STMTTRN> tag')
+
+
+def parse_row(row: dict, accounts: set, default_account=None) -> tuple[str, dict]:
+    """
+    Convert a row of a file to the arguments of DBEngine.add_transaction().
+
+    :param accounts: the names of the accounts of the profile
+    :param default_account: the account of rows that name no account
+    :return: a tuple of the category and the details of the transaction
+    :raises ValueError: if the row is not a valid transaction
+    """
+    day = row.get('date', '')
+    try:
+        if not DATE.match(day):
+            raise ValueError
+        date.fromisoformat(day)
+    except ValueError:
+        raise ValueError(f"Invalid date '{day}', expected YYYY-MM-DD")
+    try:
+        amount = float(row.get('amount', '').replace(',', ''))
+    except ValueError:
+        raise ValueError(f"Invalid amount '{row.get('amount', '')}'")
+    if amount.is_integer():
+        amount = int(amount)
+
+    if row.get('category'):
+        category = CATEGORIES.get(row['category'].lower())
+        if category is None:
+            raise ValueError(f"The category '{row['category']}' does not exist")
+    else:
+        # The sign of the amount tells incomes from expenses
+        category = 'expenses' if amount < 0 else 'incomes'
+        amount = abs(amount)
+    if amount <= 0:
+        raise ValueError('Amount must be greater than 0')
+
+    account = row.get('account') or default_account
+    debited = row.get('account_debited')
+    credited = row.get('account_credited')
+    if category == 'incomes':
+        debited = debited or account
+        if not debited:
+            raise ValueError('No account to debit the income to')
+    elif category == 'expenses':
+        credited = credited or account
+        if not credited:
+            raise ValueError('No account to credit the expense from')
+    elif not (debited and credited):
+        raise ValueError('Transfers need both an account_debited and an'
+                         ' account_credited')
+    for name in (debited, credited):
+        if name and name not in accounts:
+            raise ValueError(f"The account '{name}' does not exist")
+
+    details = {
+        'amount': amount,
+        'account_debited': debited,
+        'account_credited': credited,
+        'subcategory': row.get('subcategory', ''),
+        'time': day,
+        'description': row.get('description', ''),
+    }
+    return category, details
+
+
+def import_transactions(username, profile, f: IO[str], format='csv',
+                        default_account=None) -> ImportReport:
+    """
+    Add the transactions of a CSV or OFX file to a profile and save them.
+
+    :param f: the file, opened in text mode
+    :param format: 'csv' or 'ofx'
+    :param default_account: the account of rows that name no account, and
+        of every OFX transaction
+    :return: the number of imported transactions and the rejected rows
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown import format '{format}'")
+    accounts = set(db.get_accounts(username, profile))
+    if default_account and default_account not in accounts:
+        raise ValueError(f"The account '{default_account}' does not exist")
+    rows = read_csv(f) if format == 'csv' else read_ofx(f)
+
+    report = ImportReport()
+    valid = []
+    while batch := list(islice(rows, BATCH_SIZE)):
+        for line, row in batch:
+            try:
+                valid.append((line, *parse_row(row, accounts, default_account)))
+            except ValueError as e:
+                report.reject(line, str(e))
+
+    # Apply the rows in date order, so that balances are checked as they
+    # stood at the date of each transaction. The sort is stable, so rows of
+    # the same date keep the order of the file.
+    valid.sort(key=lambda t: t[2]['time'])
+    with db.batch():
+        for line, category, details in valid:
+            try:
+                db.add_transaction(username, profile, category, **details)
+                report.imported += 1
+            except (ValueError, KeyError, IntegrityError) as e:
+                report.reject(line, str(e))
+    if report.imported:
+        db.save().result()
+    report.errors.sort()
+    return report
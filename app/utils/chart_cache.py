@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ChartCache:
+    """
+    An LRU cache for rendered charts.
+
+    Entries are held in memory up to @max_bytes. If @directory is given,
+    entries are also written there so that they can be shared between
+    worker processes; the directory is pruned to @max_disk_bytes, oldest
+    files first. The size of the directory is tracked in memory and the
+    directory is only rescanned once that estimate goes over the budget.
+
+    Keys are tuples that include the data version of the profile the
+    charts were drawn from, so entries become unreachable as soon as the
+    profile changes. Storing a newer version also drops the older entries
+    of the same profile from memory.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, directory=None,
+                 max_disk_bytes=256 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._dir = directory
+        self._max_disk_bytes = max_disk_bytes
+        self._disk_size = None  # estimated bytes on disk, None until scanned
+        self._entries = OrderedDict()  # key -> (value, size in bytes)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: tuple):
+        """Return the value stored under @key, or None if there is none."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._entries[key][0]
+        value = self._read(key)
+        if value is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['disk_hits'] += 1
+        self._remember(key, value, _size(value))
+        return value
+
+    def set(self, key: tuple, value: dict | list):
+        """Store @value, a JSON-serializable dict or list, under @key."""
+        data = json.dumps(value)
+        self._remember(key, value, len(data))
+        self._write(key, data)
+
+    def clear(self):
+        """Remove all entries held in memory."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remember(self, key: tuple, value: dict, size: int):
+        """Add an entry to the in-memory LRU."""
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            # Drop entries drawn from older versions of the same profile.
+            # The version is the last element of the key.
+            stale = [k for k in self._entries
+                     if k[:2] == key[:2] and k[-1] != key[-1]]
+            for k in stale:
+                self._size -= self._entries.pop(k)[1]
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self._max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.stats['evictions'] += 1
+
+    def _path(self, key: tuple) -> str:
+        digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self._dir, digest + '.json')
+
+    def _read(self, key: tuple):
+        """Read an entry from the cache directory."""
+        if not self._dir:
+            return None
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, key: tuple, data: str):
+        """Write an entry to the cache directory and prune old entries."""
+        if not self._dir:
+            return
+        path = self._path(key)
+        # mkstemp gives every writer, thread or process, its own file.
+        fd, tmp = tempfile.mkstemp(dir=self._dir,
+                                   prefix=os.path.basename(path) + '.',
+                                   suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = self._scan()[1]
+            else:
+                self._disk_size += len(data)
+            if self._disk_size > self._max_disk_bytes:
+                self._prune()
+
+    def _scan(self) -> tuple[list, int]:
+        """
+        List the entries in the cache directory.
+        :return: the (mtime, size, path) of every entry, oldest first, and
+        their total size
+        """
+        files = []
+        total = 0
+        for entry in os.scandir(self._dir):
+            if entry.name.endswith('.json'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue  # pruned by another worker
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        files.sort()
+        return files, total
+
+    def _prune(self):
+        """
+        Delete the oldest files until the directory fits its budget.
+        The running estimate only counts this process's writes, so the
+        directory is rescanned first to pick up the other workers' files.
+        """
+        files, total = self._scan()
+        for _, size, path in files:
+            if total <= self._max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_size = total
+
+
+def _size(value: dict) -> int:
+    """Approximate the memory used by a cached value."""
+    return len(json.dumps(value))
@@ -0,0 +1,82 @@
+"""
+Streaming export of transactions to CSV and JSON lines.
+
+The transactions are read lazily from a snapshot of the profile with
+iter_transactions() and encoded a batch at a time, so the memory used by
+an export does not grow with the number of transactions. The CSV columns
+are those read by bulk_import, so an export can be imported again.
+"""
+import csv
+import io
+import json
+from itertools import islice
+from typing import Iterator
+from app import db
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+CSV_COLUMNS = ('date', 'amount', 'category', 'subcategory', 'description',
+               'account_debited', 'account_credited', 'id')
+# The number of transactions encoded into each chunk of output
+BATCH_SIZE = 500
+
+
+def unique_transactions(transactions: Iterator[dict]) -> Iterator[dict]:
+    """
+    Skip the second record of each transfer.
+
+    A transfer is recorded under both accounts involved. Both records have
+    the same (time, id), so they are adjacent in the results.
+    """
+    last_id = None
+    for t in transactions:
+        if t.get('id') is None or t['id'] != last_id:
+            yield t
+        last_id = t.get('id')
+
+
+def _csv_chunks(transactions: Iterator[dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    while batch := list(islice(transactions, BATCH_SIZE)):
+        writer.writerows(
+            (t['time'], t['amount'], t['category'], t.get('subcategory') or '',
+             t.get('description') or '', t.get('account_debited') or '',
+             t.get('account_credited') or '', t.get('id', ''))
+            for t in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Send the header of an empty export
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _jsonl_chunks(transactions: Iterator[dict]) -> Iterator[str]:
+    while batch := list(islice(transactions, BATCH_SIZE)):
+        yield ''.join(json.dumps(t) + '\n' for t in batch)
+
+
+def export_transactions(username, profile, format='csv', account=None,
+                        category=None, subcategory=None, from_=None,
+                        to=None) -> Iterator[str]:
+    """
+    Export the transactions of a profile.
+
+    The snapshot is taken, and the filters are checked, when this function
+    is called, before the first chunk is requested.
+
+    :param format: 'csv' or 'jsonl'
+    :return: an iterator of chunks of the output, in time order
+    :raises KeyError: if @account or @category does not exist
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown export format '{format}'")
+    transactions = unique_transactions(db.iter_transactions(
+        username, profile, account=account, category=category,
+        subcategory=subcategory, from_=from_, to=to
+    ))
+    if format == 'csv':
+        return _csv_chunks(transactions)
+    return _jsonl_chunks(transactions)
@@ -0,0 +1,73 @@
+"""
+Keyset pagination of transactions.
+
+Transactions are listed in (time, id) order. A page ends with a cursor
+that encodes the (time, id) of its last transaction, and the next page
+starts right after it, so fetching a page costs the same however deep it
+is, and pages stay stable while transactions are added.
+"""
+import base64
+import json
+from itertools import islice
+from app import db
+from .export import unique_transactions
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(transaction: dict) -> str:
+    """Return the cursor that points just after @transaction."""
+    raw = json.dumps([transaction['time'], transaction.get('id', '')])
+    raw = raw.encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """
+    Return the (time, id) pair encoded in a cursor.
+
+    :raises ValueError: if @cursor was not made by encode_cursor()
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        time, id_ = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(time, str) or not isinstance(id_, str):
+        raise ValueError('Invalid cursor')
+    return time, id_
+
+
+def get_page(username, profile, limit=DEFAULT_PAGE_SIZE, cursor=None,
+             account=None, category=None, subcategory=None, from_=None,
+             to=None) -> tuple[list[dict], str | None]:
+    """
+    Return a page of the transactions of a profile.
+
+    Transfers are listed once, although they are recorded under both of
+    the accounts involved.
+
+    :param limit: the maximum number of transactions in the page
+    :param cursor: the cursor returned with the previous page, or None for
+        the first page
+    :return: a tuple of the transactions in the page and the cursor of the
+        next page, which is None if this is the last page
+    :raises ValueError: if @limit is out of range or @cursor is invalid
+    :raises KeyError: if @account or @category does not exist
+    """
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'The page size must be between 1 and {MAX_PAGE_SIZE}')
+    after = decode_cursor(cursor) if cursor else None
+    # One more transaction than needed tells whether there is a next page.
+    # Each transfer is recorded twice, so up to twice as many records are
+    # needed to make up the page.
+    records = db.get_transactions(
+        username, profile, account=account, category=category,
+        subcategory=subcategory, from_=from_, to=to, after=after,
+        limit=2 * (limit + 1)
+    )
+    page = list(islice(unique_transactions(iter(records)), limit + 1))
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
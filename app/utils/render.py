@@ -0,0 +1,90 @@
+"""Renders charts in a pool of worker processes."""
+import multiprocessing
+import threading
+from multiprocessing.pool import Pool
+from time import monotonic
+from typing import Callable
+
+
+class ChartRenderer:
+    """
+    Render the charts of a page concurrently.
+
+    With @workers > 0, charts are rendered in a pool of worker processes
+    that is created on first use. Each worker is replaced after rendering
+    @max_tasks_per_child charts so that its memory use stays flat. A chart
+    that is not ready @timeout seconds after the page's charts were
+    submitted is replaced by an empty chart, and the pool is restarted so
+    that the stuck worker does not hold up later pages.
+
+    With @workers == 0, charts are rendered one after another in the
+    calling thread and no timeout is applied.
+    """
+    def __init__(self, workers=0, timeout=10.0, max_tasks_per_child=200):
+        self._workers = workers
+        self._timeout = timeout
+        self._max_tasks_per_child = max_tasks_per_child
+        self._pool = None
+        self._lock = threading.Lock()
+        self.stats = {'rendered': 0, 'timeouts': 0, 'restarts': 0}
+
+    def _get_pool(self) -> Pool:
+        with self._lock:
+            if self._pool is None:
+                # Workers are started with 'spawn' rather than forked from a
+                # process that may be running other threads.
+                self._pool = multiprocessing.get_context('spawn').Pool(
+                    self._workers, maxtasksperchild=self._max_tasks_per_child
+                )
+            return self._pool
+
+    def _restart(self, pool: Pool):
+        """Terminate @pool and let the next page start a new one."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.stats['restarts'] += 1
+        pool.terminate()
+
+    def render(self, jobs: dict[str, tuple[Callable, tuple, dict]]) -> dict[str, str]:
+        """
+        Render a set of charts.
+
+        :param jobs: a dict mapping chart names to (function, args, kwargs)
+            tuples. The function must be defined at module level, in a
+            module that does not import the app package, such as
+            charting.charts, and return a base64-encoded chart
+        :return: a dict mapping the chart names to the rendered charts.
+            Charts that timed out are empty strings
+        """
+        if not self._workers:
+            results = {name: func(*args, **kwargs)
+                       for name, (func, args, kwargs) in jobs.items()}
+            self.stats['rendered'] += len(results)
+            return results
+
+        pool = self._get_pool()
+        pending = {name: pool.apply_async(func, args, kwargs)
+                   for name, (func, args, kwargs) in jobs.items()}
+        deadline = monotonic() + self._timeout
+        results = {}
+        timed_out = False
+        for name, result in pending.items():
+            try:
+                results[name] = result.get(max(0, deadline - monotonic()))
+                self.stats['rendered'] += 1
+            except multiprocessing.TimeoutError:
+                results[name] = ''
+                self.stats['timeouts'] += 1
+                timed_out = True
+        if timed_out:
+            self._restart(pool)
+        return results
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,139 @@
+from flask import g, has_app_context
+import numpy as np
+from app import db
+from app.models.engine.columns import (AMOUNT_SCALE, TransactionColumns,
+                                       month_codes, month_name)
+from app.models.engine.db_engine import parse_date_range
+
+
+class Report:
+    """
+    Aggregates of the incomes and expenses of a profile over a date range.
+
+    Totals are left to the storage engine: the in-memory layouts read them
+    from the running totals and rollups they keep, and the SQLite layout
+    answers them with SQL. Only the monthly matrix is computed here, with
+    vectorized NumPy reductions over the rows of a category, so the
+    columnar copy of the transactions is fetched the first time it is
+    needed rather than for every report.
+    """
+    def __init__(self, username, profile, from_=None, to=None):
+        self.username = username
+        self.profile = profile
+        self.from_ = from_
+        self.to = to
+        self._columns = None
+        if from_ or to:
+            self._range = parse_date_range(from_, to)
+        else:
+            self._range = (None, None)
+        # category -> the columns of its rows
+        self._selected = {}
+
+    def _get_columns(self) -> TransactionColumns:
+        """Return the columnar copy of the transactions of the profile."""
+        if self._columns is None:
+            self._columns = db.get_columns(self.username, self.profile)
+        return self._columns
+
+    def _rows(self, category) -> dict:
+        """Return the columns of the rows of @category in the range."""
+        if category not in self._selected:
+            columns = self._get_columns()
+            rows = columns.select(*self._range)
+            mask = rows['category'] == _code(columns, 'category', category)
+            self._selected[category] = {
+                'amount': rows['amount'][mask],
+                'month': month_codes(rows['day'][mask]),
+                'subcategory': rows['subcategory'][mask],
+            }
+        return self._selected[category]
+
+    def subcategory_totals(self, category) -> dict[str, int]:
+        """
+        Return the total amount of each subcategory of @category.
+
+        Amounts are truncated to whole units before they are added up.
+        Transactions with no subcategory are grouped under 'Uncategorized'.
+        """
+        return db.get_subcategory_totals(self.username, self.profile, category,
+                                         from_=self.from_, to=self.to)
+
+    def total(self, category) -> int:
+        """
+        Return the total amount of all transactions of @category.
+
+        Amounts are truncated to whole units before they are added up.
+        """
+        return db.get_total(self.username, self.profile, category,
+                            from_=self.from_, to=self.to)
+
+    def monthly_totals(self, category, subcategory=None) -> dict[str, int | float]:
+        """
+        Return the total amount of @category transactions in each month.
+
+        Only months with transactions are included. The totals are read
+        from the monthly rollups kept by the storage engine, so only the
+        transactions of the partly covered months at either end of the
+        range are visited.
+
+        :param subcategory: only include transactions of this subcategory
+        :return: a dict mapping 'YYYY-MM' to totals, sorted by month
+        """
+        return db.get_monthly_totals(self.username, self.profile, category,
+                                     subcategory, from_=self.from_, to=self.to)
+
+    def monthly_matrix(self, category,
+                       subcategories: list[str]) -> tuple[list[str], np.ndarray]:
+        """
+        Return the total amount of each of several subcategories in each month.
+
+        The totals of all the subcategories are computed in a single
+        grouped pass over the transactions of @category.
+
+        :return: a tuple of the months, as 'YYYY-MM' strings, and a
+            (month x subcategory) array of totals. The months run from the
+            first to the last month with transactions in any of
+            @subcategories. Months with no transactions are set to 0
+        """
+        rows = self._rows(category)
+        names = self._get_columns()
+        # Map subcategory codes to columns of the matrix
+        columns = np.full(len(names.subcategories), -1)
+        for i, subcategory in enumerate(subcategories):
+            code = _code(names, 'subcategory', subcategory)
+            if subcategory and code >= 0:
+                columns[code] = i
+        column = columns[rows['subcategory']]
+        mask = column >= 0
+        months, column = rows['month'][mask], column[mask]
+        if not len(months):
+            return [], np.zeros((0, len(subcategories)))
+        first = months.min()
+        n_months = months.max() - first + 1
+        cells = (months - first) * len(subcategories) + column
+        sums = np.bincount(cells, weights=rows['amount'][mask],
+                           minlength=n_months * len(subcategories))
+        matrix = sums.reshape(n_months, len(subcategories)) / AMOUNT_SCALE
+        return [month_name(first + i) for i in range(n_months)], matrix
+
+
+def _code(columns, field, name) -> int:
+    """Return the code of a name in @columns, or -1 if it has no rows."""
+    code = columns.code(field, name)
+    return -1 if code is None else code
+
+
+def get_report(username, profile, from_=None, to=None) -> Report:
+    """
+    Return the report of a profile over a date range.
+
+    Within a request, the report is built once and shared by every caller.
+    """
+    if not has_app_context():
+        return Report(username, profile, from_, to)
+    reports = g.setdefault('reports', {})
+    key = (username, profile, str(from_), str(to))
+    if key not in reports:
+        reports[key] = Report(username, profile, from_, to)
+    return reports[key]
@@ -1,66 +1,45 @@
-from io import BytesIO
-from collections import defaultdict
+from __future__ import annotations
 from datetime import datetime
-from app import db
-import base64
-import matplotlib.pyplot as plt
-import matplotlib
-import pandas as pd
-import seaborn as sns
+from functools import wraps
+from inspect import signature
+from app import app, db, chart_cache, chart_renderer
+from charting.charts import (fig_to_base64, pie_chart, monthly_cash_flows,
+                             line_plot, bar_plot, donut_chart, multiline_plot)
+from charting.lazy import LazyModule
+from .report import get_report
 
+# pandas is only imported when the first stat or chart needs it
+pd = LazyModule('pandas')
 
-# Use matplotlib in non-interactive mode. Consider changing the backend
-# if a different image format besides SVG is needed.
-matplotlib.use('svg')
-# Increase the bottom axis padding to prevent rotated tick marks from
-# being truncated.
-plt.rcParams['figure.subplot.bottom'] = 0.25
-plt.rcParams['axes.titlesize'] = 14
-plt.rcParams['lines.marker'] = 'o'
-plt.rcParams['axes.labelsize'] = 14
 
-
-def get_transactions_total(transactions: list[dict]):
-    """Compute the sum of the value of all the given transactions."""
-    return sum(int(t['amount']) for t in transactions)
-
-
-def get_totals_by_subcategories(transactions: list[dict],
-                                n: int = None) -> list[tuple[str, int]]:
+def get_top_subcategories(totals: dict[str, int],
+                          n: int = None) -> list[tuple[str, int]]:
     """
-    Compute totals by subcategory and return the top n subcategories.
+    Return the n subcategories with the largest totals.
 
-    Transactions with no subcategory will be grouped under 'Uncategorized'.
+    :param totals: a dict mapping subcategories to their totals
+    :param n: the number of subcategories to return. All are returned if
+        not specified
     Sample output: [('Food', 100), ('Electricity', 40), ...]
     """
-    if not transactions:
-        return []
-    totals = defaultdict(int)
-    for t in transactions:
-        # Transactions with no subcategory will be put under 'uncategorized'
-        if not t.get('subcategory'):
-            totals['Uncategorized'] += int(t['amount'])
-        else:
-            totals[t['subcategory']] += int(t['amount'])
-
-    # Sort results by amount in descending order
-    totals = list(totals.items())
+    top = sorted(totals.items(), key=lambda x: x[1], reverse=True)
     if n and n > 0:
-        totals = totals[:n]
-    return sorted(totals, key=lambda x: x[1], reverse=True)
+        top = top[:n]
+    return top
 
 
 def get_summary_stats(username, profile, from_=None, to=None):
     """Get transaction summaries for the given user profile."""
-    incomes = db.get_transactions(username, profile, category='incomes',
-                                  from_=from_, to=to)
-    expenses = db.get_transactions(username, profile, category='expenses',
-                                   from_=from_, to=to)
-
-    top_incomes = get_totals_by_subcategories(incomes, n=5)
-    top_expenses = get_totals_by_subcategories(expenses, n=5)
-    total_income = get_transactions_total(incomes)
-    total_expense = get_transactions_total(expenses)
+    # The totals are answered by the storage engine, without reading the
+    # transactions one by one
+    report = get_report(username, profile, from_, to)
+    income_totals = report.subcategory_totals('incomes')
+    expense_totals = report.subcategory_totals('expenses')
+
+    top_incomes = get_top_subcategories(income_totals, n=5)
+    top_expenses = get_top_subcategories(expense_totals, n=5)
+    total_income = report.total('incomes')
+    total_expense = report.total('expenses')
     net_income = total_income - total_expense
     # Daily averages over the period
     if type(from_) is str:
@@ -82,122 +61,111 @@ def get_summary_stats(username, profile, from_=None, to=None):
     }
 
 
-def fig_to_base64(fig: plt.Figure, format='svg') -> str:
-    f"""
-    Encode a matplotlib Figure object to base64.
-
-    :param fig: the Figure instance to be encoded
-    :param format: the format of the encoded output. Options: 'svg', 'png'
-    :return: an utf-8 encoded string representation of {fig}
-    """
-    buffer = BytesIO()
-    fig.savefig(buffer, format=format)
-    buffer.seek(0)
-    encoded = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    buffer.close()
-    return encoded
-
-
-def pie_chart(x: list[int | float], labels: list[str], title: str = '') -> str:
+def cached_charts(chart_type: str):
     """
-    Plot pie chart with the given data.
+    Cache the charts returned by the decorated function.
 
-    :param x: a list of numerical data to be plotted
-    :param labels: a list of labels associated with the x values
-    :param title: title to use for the chart
-    :return: a base64-encoded pie chart of the data
+    The decorated function must accept the arguments 'username', 'profile',
+    'from_' and 'to'. Results are keyed on those arguments, @chart_type
+    and the data version of the profile, so they are re-rendered as soon
+    as the profile changes.
     """
-    if not x:
-        return ''
-    assert len(x) == len(labels), "'x' and 'labels' must have equal length"
-    fig, ax = plt.subplots()
-    ax.pie(x, labels=labels, autopct='%1.1f%%', startangle=90)
-    ax.set_title(title)
-    return fig_to_base64(fig)
-
-
+    def decorator(func):
+        sig = signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            username = bound.arguments['username']
+            profile = bound.arguments['profile']
+            key = (username, profile, chart_type,
+                   str(bound.arguments['from_']), str(bound.arguments['to']),
+                   db.get_data_version(username, profile))
+            charts = chart_cache.get(key)
+            if charts is None:
+                charts = func(*args, **kwargs)
+                chart_cache.set(key, charts)
+            return charts
+        return wrapper
+    return decorator
+
+
+@cached_charts('summary')
 def get_summary_graphs(username, profile, top_incomes: list[tuple[str, int]],
                        top_expenses: list[tuple[str, int]],
                        from_=None, to=None) -> dict:
-    """TODO: add docstring"""
-    # Get all transactions for the period
-    transactions = db.get_transactions(username, profile, from_=from_, to=to)
-    if not transactions:
-        return {}
-    # Convert the transactions to a DataFrame
-    df = pd.DataFrame(transactions)
-    # Convert the 'time' column to a datetime column
-    df['time'] = pd.to_datetime(df['time'])
-    # Group transactions by month and aggregate by summing the amounts
-    incomes = df[df['category'] == 'incomes']
-    expenses = df[df['category'] == 'expenses']
+    """
+    Return a dict containing plots to be embedded into the 'home' page.
 
+    Format: { 'chart_name': ('title', 'base64-encoded chart'), ... }
+    """
     # Key Series objects for use in plotting
-    incomes_monthly = aggregate_monthly(incomes)
-    expenses_monthly = aggregate_monthly(expenses)
-    if not incomes_monthly.empty:
-        incomes_monthly = incomes_monthly.squeeze(axis=1)
-    if not expenses_monthly.empty:
-        expenses_monthly = expenses_monthly.squeeze(axis=1)
-    # print("---------------before reindexing---------------")
-    # print("---------------incomes_monthly-\n", incomes_monthly)
-    # print("-------------expenses-monthly\n", expenses_monthly)
+    report = get_report(username, profile, from_, to)
+    incomes_monthly = monthly_series(report.monthly_totals('incomes'))
+    expenses_monthly = monthly_series(report.monthly_totals('expenses'))
+    if incomes_monthly.empty and expenses_monthly.empty:
+        return {}
     incomes_monthly, expenses_monthly = reindex_series(incomes_monthly, expenses_monthly)
     net_monthly = incomes_monthly - expenses_monthly
-    # print("---------------After reindexing---------------")
-    # print("---------------incomes_monthly\n", incomes_monthly)
-    # print("---------------expenses_monthly\n", expenses_monthly)
-    # print("-----------------net\n", net_monthly)
-
-    # Plot of monthly incomes and expenses
-    monthly_income_expenses = monthly_cash_flows(
-        incomes_monthly, expenses_monthly,
-    )
-    # Plot of monthly net income
-    monthly_net_income = line_plot(net_monthly)
-    # Plots of top incomes and expenses
-    graph_pie_incomes = donut_chart(
-        x=[i[1] for i in top_incomes],
-        labels=[i[0] for i in top_incomes],
-        # title='Top Income Sources'
-    )
-    graph_pie_expenses = donut_chart(
-        x=[i[1] for i in top_expenses],
-        labels=[i[0] for i in top_expenses],
-        # title='Top Expenses'
-    )
+
+    # The charts are rendered concurrently by the chart renderer
+    charts = chart_renderer.render({
+        # Plot of monthly incomes and expenses
+        'monthly_income_expenses': (
+            monthly_cash_flows, (incomes_monthly, expenses_monthly), {}
+        ),
+        # Plot of monthly net income
+        'monthly_net_income': (line_plot, (net_monthly,), {}),
+        # Plots of top incomes and expenses
+        'graph_pie_incomes': (donut_chart, (), {
+            'x': [i[1] for i in top_incomes],
+            'labels': [i[0] for i in top_incomes],
+            # 'title': 'Top Income Sources'
+        }),
+        'graph_pie_expenses': (donut_chart, (), {
+            'x': [i[1] for i in top_expenses],
+            'labels': [i[0] for i in top_expenses],
+            # 'title': 'Top Expenses'
+        }),
+    })
 
     return {
         'graph_pie_incomes': (
             f"Top Income Sources ({from_} to {to})",
-            graph_pie_incomes
+            charts['graph_pie_incomes']
         ),
         'graph_pie_expenses': (
             f"Top Expenses ({from_} to {to})",
-            graph_pie_expenses
+            charts['graph_pie_expenses']
         ),
         'graph_line_monthly_cash_flows': (
             'Trend: Total Monthly Incomes and Expenses',
-            monthly_income_expenses
+            charts['monthly_income_expenses']
         ),
         'graph_line_monthly_net_income': (
             'Trend: Monthly Net Income',
-            monthly_net_income
+            charts['monthly_net_income']
         ),
     }
 
 
-def aggregate_monthly(transactions: pd.DataFrame):
-    """Group transactions by month and aggregate by summing the amounts."""
-    df = pd.DataFrame(transactions)
-    # Convert to datetime if not already datetime.
-    df['time'] = pd.to_datetime(df['time'])
-    df_monthly = (
-        df[['time', 'amount']]
-        .groupby(pd.Grouper(key='time', freq='ME'))
-        .sum()
+def monthly_series(totals: dict[str, int | float]) -> pd.Series:
+    """
+    Convert monthly totals to a timeseries indexed by month end.
+
+    :param totals: a dict mapping months in the format 'YYYY-MM' to totals,
+        as returned by `Report.monthly_totals()`
+    :return: a Series covering every month from the first to the last one
+        in @totals. Months missing from @totals are set to 0
+    """
+    if not totals:
+        return pd.Series([], dtype='float64')
+    months = pd.to_datetime(list(totals.keys())) + pd.offsets.MonthEnd(0)
+    series = pd.Series(list(totals.values()), index=months)
+    return series.reindex(
+        pd.date_range(months.min(), months.max(), freq='ME'), fill_value=0
     )
-    return df_monthly
 
 
 def reindex_series(s1: pd.Series, s2: pd.Series) -> tuple[pd.Series, pd.Series]:
@@ -229,88 +197,6 @@ def reindex_series(s1: pd.Series, s2: pd.Series) -> tuple[pd.Series, pd.Series]:
     return s1_new, s2_new
 
 
-# TODO: use multiline_plot() for this function
-def monthly_cash_flows(incomes: pd.Series, expenses: pd.Series,
-                       title: str = '') -> str:
-    """
-    Plot line graphs of monthly incomes and expenses on the same chart.
-
-    :param incomes: timeseries of total monthly incomes
-    :param expenses: timeseries of total monthly expenses
-    :param title: the title to give to the graph
-    :return: :return: a base64-encoded line chart of the data
-    """
-    if incomes.shape[0] < 2 or expenses.shape[0] < 2:
-        # Do not plot if either Series does not have enough data.
-        return ''
-    fig, ax = plt.subplots()
-    ax.plot(incomes, label='Total Monthly Income')
-    ax.plot(expenses, label='Total Monthly Expenses')
-    ax.set_title(title)
-    plt.xticks(rotation=60)
-    ax.legend()
-    return fig_to_base64(fig)
-
-
-def line_plot(data: pd.Series, title: str = '') -> str:
-    """
-    Create a single line plot using the data.
-    """
-    if data.empty or data is None:
-        return ''
-    # Cannot draw line graph with only one point
-    if data.shape[0] < 2:
-        return ''
-    fig, ax = plt.subplots()
-
-    ax.plot(data)
-    ax.set_title(title)
-    plt.xticks(rotation=60)
-    return fig_to_base64(fig)
-
-
-def bar_plot(x: list[int | float], labels: list[str], title: str = '') -> str:
-    """
-    Plot a bar plot with the given data.
-
-    :param x: a list of numerical data to be plotted
-    :param labels: a list of labels associated with the x values
-    :param title: title to use for the chart
-    :return: a base64-encoded bar chart of the data
-    """
-    if not x or len(x) < 2:
-        return ''
-    fig, ax = plt.subplots()
-    ax.set_xlabel('Amount')
-    ax.set_title(title)
-    sns.barplot(x=x, y=labels, orient='h', ax=ax)
-    return fig_to_base64(fig)
-
-
-def donut_chart(x, labels, title='') -> str:
-    if not x or len(x) < 2:
-        return ''
-    # Sample data
-    fig, ax = plt.subplots(figsize=(7, 7))
-    plt.rcParams.update({'font.size': 12})
-    ax.pie(x, labels=None, autopct='%1.0f%%', startangle=90)
-
-    # Draw circle in the center
-    centre_circle = plt.Circle((0, 0), 0.7, color='black', fc='white', linewidth=0)
-    ax.add_artist(centre_circle)
-    # Equal aspect ratio ensures that pie is drawn as a circle
-    plt.axis('equal')
-    # Use bbox_to_anchor=(1.3, 0.7) to place the legend to the right.
-    # Use y=0.3 to place it bottom right if font is increased
-    plt.legend(labels, loc='upper right',
-               bbox_to_anchor=(1.3, 0.3)
-    )
-    # Adjust the position of `ax` within `fig` to leave room for the legend
-    plt.subplots_adjust(left=0, right=0.7, top=1, bottom=0)
-    ax.set_title(title)
-    return fig_to_base64(fig)
-
-
 def count_charts(charts: dict) -> int:
     """
     Return the number of charts.
@@ -325,30 +211,27 @@ def count_charts(charts: dict) -> int:
     return n
 
 
-def multiline_plot(data: list[pd.Series], labels: list[str], title='') -> str:
+def subcategory_frame(username, profile, category, subcategories: list[str],
+                      from_=None, to=None) -> pd.DataFrame:
     """
-    Create a multi-line plot.
+    Return the total monthly values of several subcategories.
+
+    The totals of all the subcategories are computed in a single pass.
 
-    :param data: a list of Series objects containing the data for each line
-    :param labels: a list of labels to be associated with each Series
-    :param title: title to place above the plot
-    :return: a base64-encoded plot of the data
+    :return: a DataFrame indexed by month end, with a column for each
+        subcategory. A column is NaN outside the months from its first to
+        its last transaction, and 0 for the months in between that have
+        no transactions. Subcategories with no transactions in the period
+        are left out
     """
-    assert len(data) == len(labels), 'Data and labels must be of equal length'
-    n_empty = 0  # For counting series' with less than 3 data points
-    fig, ax = plt.subplots()
-    for i, series in enumerate(data, start=0):
-        if series.shape[0] < 2:
-            n_empty += 1
-        else:
-            ax.plot(series.sort_index(), label=labels[i], marker='')
-
-    if n_empty == len(data):
-        return ''  # No lines were plotted
-    ax.set_title(title)
-    plt.xticks(rotation=60)
-    plt.legend()
-    return fig_to_base64(fig)
+    report = get_report(username, profile, from_, to)
+    months, matrix = report.monthly_matrix(category, subcategories)
+    index = pd.to_datetime(months, format='%Y-%m') + pd.offsets.MonthEnd(0)
+    frame = pd.DataFrame(matrix, index=index, columns=subcategories)
+    # Amounts are positive, so a total of 0 means there were no transactions
+    active = frame != 0
+    frame = frame.where(active.cummax() & active[::-1].cummax()[::-1])
+    return frame.dropna(axis='columns', how='all')
 
 
 def plot_by_subcategory(username, profile, category, subcategories: list[str],
@@ -356,77 +239,207 @@ def plot_by_subcategory(username, profile, category, subcategories: list[str],
     """
     Create a multi-line plot of the total monthly value of each subcategory.
     """
-    data = []
-    labels = []
-    for subcategory in subcategories:
-        transactions = db.get_transactions(username, profile, category=category,
-                                           subcategory=subcategory, from_=from_, to=to)
-        if not transactions:
-            continue
-        df = pd.DataFrame(transactions)
-        series = aggregate_monthly(df)
-        data.append(series)
-        labels.append(subcategory)
-
-    if not data:
+    data = subcategory_frame(username, profile, category, subcategories,
+                             from_, to)
+    if data.empty:
         return ''
-    plot = multiline_plot(data, labels)
+    plot = multiline_plot(data)
     return plot
 
 
+@cached_charts('incomes')
 def get_income_plots(username, profile, from_=None, to=None) -> dict:
     """
     Return a dict containing plots to be embedded into the 'incomes' page
     """
-    # Donut chart of top incomes for the period
-    top_incomes = get_summary_stats(username, profile,
-                                    from_=from_, to=to)['top_incomes']
-    subcategories = [i[0] for i in top_incomes][:3]
-    values = [i[1] for i in top_incomes][:3]
-    graph_pie_incomes = donut_chart(
-        x=values,
-        labels=subcategories,
-    )
-    # Line chart of all total monthly incomes transactions for the top incomes
-    multiline_chart = plot_by_subcategory(username, profile, 'incomes',
-                                          subcategories, from_, to)
+    n = app.config['CHART_TOP_SUBCATEGORIES']
+    report = get_report(username, profile, from_, to)
+    top_incomes = get_top_subcategories(report.subcategory_totals('incomes'), n=n)
+    subcategories = [i[0] for i in top_incomes]
+    values = [i[1] for i in top_incomes]
+    data = subcategory_frame(username, profile, 'incomes', subcategories,
+                             from_, to)
+    charts = chart_renderer.render({
+        # Donut chart of top incomes for the period
+        'graph_pie_incomes': (
+            donut_chart, (), {'x': values, 'labels': subcategories}
+        ),
+        # Line chart of all total monthly incomes transactions for the
+        # top incomes
+        'multiline_chart': (multiline_plot, (data,), {}),
+    })
 
     return {
         'graph_pie_incomes': (
             f"Top Income Sources ({from_} to {to})",
-            graph_pie_incomes
+            charts['graph_pie_incomes']
         ),
         'graph_line_top_incomes': (
-            'Trend of Total Monthly Income (Top 3 Incomes)',
-            multiline_chart
+            f'Trend of Total Monthly Income (Top {n} Incomes)',
+            charts['multiline_chart']
         )
     }
 
 
+@cached_charts('expenses')
 def get_expense_plots(username, profile, from_=None, to=None) -> dict:
     """
     Return a dict containing plots to be embedded into the 'expenses' page
     """
-    # Donut chart of top expenses for the period
-    top_expenses = get_summary_stats(username, profile,
-                                     from_=from_, to=to)['top_expenses']
-    subcategories = [i[0] for i in top_expenses][:3]
-    values = [i[1] for i in top_expenses][:3]
-    graph_pie_expenses = donut_chart(
-        x=values,
-        labels=subcategories,
-    )
-    # Line chart of all total monthly expense transactions for the top incomes
-    multiline_chart = plot_by_subcategory(username, profile, 'expenses',
-                                          subcategories, from_, to)
+    n = app.config['CHART_TOP_SUBCATEGORIES']
+    report = get_report(username, profile, from_, to)
+    top_expenses = get_top_subcategories(report.subcategory_totals('expenses'), n=n)
+    subcategories = [i[0] for i in top_expenses]
+    values = [i[1] for i in top_expenses]
+    data = subcategory_frame(username, profile, 'expenses', subcategories,
+                             from_, to)
+    charts = chart_renderer.render({
+        # Donut chart of top expenses for the period
+        'graph_pie_expenses': (
+            donut_chart, (), {'x': values, 'labels': subcategories}
+        ),
+        # Line chart of all total monthly expense transactions for the
+        # top expenses
+        'multiline_chart': (multiline_plot, (data,), {}),
+    })
 
     return {
         'graph_pie_expenses': (
             f"Top Expenses ({from_} to {to})",
-            graph_pie_expenses
+            charts['graph_pie_expenses']
         ),
         'graph_line_top_expenses': (
-            'Trend of Total Monthly Expenses (Top 3 expenses)',
-            multiline_chart
+            f'Trend of Total Monthly Expenses (Top {n} expenses)',
+            charts['multiline_chart']
         )
     }
+
+
+def donut_data(top: list[tuple[str, int]], title: str) -> dict:
+    """
+    Return the data of a donut chart of subcategory totals.
+
+    Format: {'type': 'donut', 'title': str, 'labels': [...], 'values': [...]}
+    """
+    return {
+        'type': 'donut',
+        'title': title,
+        'labels': [i[0] for i in top],
+        'values': [i[1] for i in top],
+    }
+
+
+def line_data(data: pd.DataFrame, title: str) -> dict:
+    """
+    Return the data of a line chart of monthly timeseries.
+
+    :param data: a DataFrame indexed by month, with a column for each line.
+        NaN values are sent as None
+
+    Format: {'type': 'line', 'title': str, 'labels': ['YYYY-MM', ...],
+             'series': [{'label': str, 'values': [...]}, ...]}
+    """
+    series = []
+    for label in data.columns:
+        series.append({
+            'label': label,
+            'values': [None if pd.isna(v) else v for v in data[label].tolist()],
+        })
+    return {
+        'type': 'line',
+        'title': title,
+        'labels': [m.strftime('%Y-%m') for m in data.index],
+        'series': series,
+    }
+
+
+def has_chart_data(chart: dict) -> bool:
+    """
+    Check whether there is enough data to draw a chart.
+
+    Uses the same rules as the server-side chart functions: a donut chart
+    needs at least 2 slices, and a line chart needs a line of at least 2
+    points.
+    """
+    if chart['type'] == 'donut':
+        return len(chart['values']) >= 2
+    return any(
+        sum(v is not None for v in s['values']) >= 2 for s in chart['series']
+    )
+
+
+@cached_charts('summary_data')
+def get_summary_chart_data(username, profile,
+                           top_incomes: list[tuple[str, int]],
+                           top_expenses: list[tuple[str, int]],
+                           from_=None, to=None) -> list[dict]:
+    """
+    Return the data behind the charts of the 'home' page.
+
+    Only charts with enough data to be drawn are included, in the order
+    in which they are displayed. The 'name' of each chart is the name
+    used by get_summary_graphs().
+    """
+    report = get_report(username, profile, from_, to)
+    incomes_monthly = monthly_series(report.monthly_totals('incomes'))
+    expenses_monthly = monthly_series(report.monthly_totals('expenses'))
+    incomes_monthly, expenses_monthly = reindex_series(incomes_monthly, expenses_monthly)
+    net_monthly = incomes_monthly - expenses_monthly
+    charts = {
+        'graph_pie_incomes': donut_data(
+            top_incomes, f"Top Income Sources ({from_} to {to})"
+        ),
+        'graph_pie_expenses': donut_data(
+            top_expenses, f"Top Expenses ({from_} to {to})"
+        ),
+        'graph_line_monthly_cash_flows': line_data(
+            pd.DataFrame({'Total Monthly Income': incomes_monthly,
+                          'Total Monthly Expenses': expenses_monthly}),
+            'Trend: Total Monthly Incomes and Expenses'
+        ),
+        'graph_line_monthly_net_income': line_data(
+            net_monthly.to_frame('Net Income'), 'Trend: Monthly Net Income'
+        ),
+    }
+    return [dict(c, name=name) for name, c in charts.items()
+            if has_chart_data(c)]
+
+
+@cached_charts('incomes_data')
+def get_income_chart_data(username, profile, from_=None, to=None) -> list[dict]:
+    """Return the data behind the charts of the 'incomes' page."""
+    n = app.config['CHART_TOP_SUBCATEGORIES']
+    report = get_report(username, profile, from_, to)
+    top_incomes = get_top_subcategories(report.subcategory_totals('incomes'), n=n)
+    data = subcategory_frame(username, profile, 'incomes',
+                             [i[0] for i in top_incomes], from_, to)
+    charts = {
+        'graph_pie_incomes': donut_data(
+            top_incomes, f"Top Income Sources ({from_} to {to})"
+        ),
+        'graph_line_top_incomes': line_data(
+            data, f'Trend of Total Monthly Income (Top {n} Incomes)'
+        ),
+    }
+    return [dict(c, name=name) for name, c in charts.items()
+            if has_chart_data(c)]
+
+
+@cached_charts('expenses_data')
+def get_expense_chart_data(username, profile, from_=None, to=None) -> list[dict]:
+    """Return the data behind the charts of the 'expenses' page."""
+    n = app.config['CHART_TOP_SUBCATEGORIES']
+    report = get_report(username, profile, from_, to)
+    top_expenses = get_top_subcategories(report.subcategory_totals('expenses'), n=n)
+    data = subcategory_frame(username, profile, 'expenses',
+                             [i[0] for i in top_expenses], from_, to)
+    charts = {
+        'graph_pie_expenses': donut_data(
+            top_expenses, f"Top Expenses ({from_} to {to})"
+        ),
+        'graph_line_top_expenses': line_data(
+            data, f'Trend of Total Monthly Expenses (Top {n} expenses)'
+        ),
+    }
+    return [dict(c, name=name) for name, c in charts.items()
+            if has_chart_data(c)]
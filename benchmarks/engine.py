@@ -0,0 +1,231 @@
+"""
+Measure the storage engine and the stats built on it at several data sizes.
+
+For each size, a fresh interpreter generates that many demo transactions
+in a temporary database with app.demo, then times:
+
+- get_transactions, with and without date, subcategory and limit filters
+- save, reload and a reload with nothing to reload
+- get_summary_stats and get_summary_graphs, with the chart cache emptied
+  before every call
+- each chart function, on the data of the summary page
+
+Each operation is repeated and its median and minimum times are reported.
+
+Usage: python benchmarks/engine.py [--sizes 1000,100000,1000000]
+       [--layout single] [--repeat 5] [--json out.json]
+       [--compare baseline.json [--threshold 1.25]]
+
+With --compare, the results are compared to those saved by an earlier
+run with --json, and the exit status is 1 if any operation is slower
+than its baseline by more than the --threshold factor.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FROM, TO = '2023-01-01', '2023-12-31'
+# Operations that run in less than this are too noisy to compare
+MIN_COMPARABLE_MS = 1.0
+
+
+def timed(func, repeat: int) -> dict:
+    """Call @func @repeat times and return its median and minimum times."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': statistics.median(times), 'min_ms': min(times)}
+
+
+def run_size(size: int, repeat: int) -> dict:
+    """
+    Generate @size transactions and time every operation on them.
+
+    Runs in the child interpreter, whose environment points the app at an
+    empty database.
+    """
+    from app import app, chart_cache, db
+    from app.demo import USERNAME, generate
+    from charting import charts
+    from app.utils import stats
+
+    user, profile = USERNAME, 'personal'
+    start = time.perf_counter()
+    generate(db, transactions=size)
+    generate_ms = (time.perf_counter() - start) * 1000
+
+    results = {}
+    results['save'] = timed(db.save, repeat)
+    results['reload'] = timed(lambda: db.reload(force=True), repeat)
+    results['reload (unchanged)'] = timed(db.reload, repeat)
+
+    queries = {
+        'all': {},
+        'date range': {'from_': FROM, 'to': TO},
+        'subcategory': {'category': 'expenses', 'subcategory': 'food'},
+        'limit': {'limit': 10},
+        'combined': {'category': 'expenses', 'subcategory': 'food',
+                     'from_': FROM, 'to': TO, 'limit': 10},
+    }
+    for name, query in queries.items():
+        results[f'get_transactions ({name})'] = timed(
+            lambda: db.get_transactions(user, profile, **query), repeat
+        )
+
+    summary = stats.get_summary_stats(user, profile, FROM, TO)
+    results['get_summary_stats'] = timed(
+        lambda: stats.get_summary_stats(user, profile, FROM, TO), repeat
+    )
+
+    def summary_graphs():
+        chart_cache.clear()
+        stats.get_summary_graphs(user, profile, summary['top_incomes'],
+                                 summary['top_expenses'], FROM, TO)
+    results['get_summary_graphs'] = timed(summary_graphs, repeat)
+
+    report = stats.get_report(user, profile, FROM, TO)
+    incomes, expenses = stats.reindex_series(
+        stats.monthly_series(report.monthly_totals('incomes')),
+        stats.monthly_series(report.monthly_totals('expenses'))
+    )
+    top = summary['top_expenses']
+    x, labels = [t[1] for t in top], [t[0] for t in top]
+    subcategories = [t[0] for t in summary['top_incomes']]
+    frame = stats.subcategory_frame(user, profile, 'incomes', subcategories,
+                                    FROM, TO)
+    chart_calls = {
+        'pie_chart': lambda: charts.pie_chart(x, labels),
+        'donut_chart': lambda: charts.donut_chart(x, labels),
+        'bar_plot': lambda: charts.bar_plot(x, labels),
+        'line_plot': lambda: charts.line_plot(incomes - expenses),
+        'monthly_cash_flows': lambda: charts.monthly_cash_flows(incomes,
+                                                                expenses),
+        'multiline_plot': lambda: charts.multiline_plot(frame),
+    }
+    # Draw every chart once first, so that the cost of importing
+    # matplotlib is not counted
+    for draw in chart_calls.values():
+        draw()
+    for name, draw in chart_calls.items():
+        results[name] = timed(draw, repeat)
+
+    return {
+        'size': size,
+        'transactions': len(db.get_transactions(user, profile)),
+        'generate_ms': generate_ms,
+        'results': results,
+    }
+
+
+def run_child(size: int, layout: str, repeat: int) -> dict:
+    """Run the benchmarks of one size in a new interpreter."""
+    with tempfile.TemporaryDirectory() as cwd:
+        path = os.path.join(cwd, 'bench.db')
+        env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='1',
+                   DB_LAYOUT=layout, DB_FILE=path, DB_SHARD_DIR=path,
+                   DATABASE_URL='sqlite:///' + path, CHART_WORKERS='0')
+        for name in ('DB_JOURNAL', 'CHART_CACHE_DIR'):
+            env.pop(name, None)
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', str(size),
+             '--layout', layout, '--repeat', str(repeat)],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare two sets of results.
+
+    :return: a description of each operation that is slower in @current
+        than in @baseline by more than @threshold times
+    """
+    old = {
+        (run['size'], name): result['median_ms']
+        for run in baseline['runs'] for name, result in run['results'].items()
+    }
+    regressions = []
+    for run in current['runs']:
+        for name, result in run['results'].items():
+            before = old.get((run['size'], name))
+            after = result['median_ms']
+            if before is None or max(before, after) < MIN_COMPARABLE_MS:
+                continue
+            if after > before * threshold:
+                regressions.append(f'{name} @ {run["size"]}: {before:.2f} ms'
+                                   f' -> {after:.2f} ms ({after / before:.2f}x)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma-separated numbers of transactions')
+    parser.add_argument('--layout', default='single',
+                        choices=['single', 'sharded', 'sqlite'])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='the number of times to run each operation')
+    parser.add_argument('--json', metavar='PATH',
+                        help='also save the results as JSON to PATH')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare the results to a saved baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='the slowdown factor that counts as a regression')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_size(args.child, args.repeat)))
+        return
+
+    result = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'commit': git_commit(),
+        'layout': args.layout,
+        'repeat': args.repeat,
+        'runs': [],
+    }
+    for size in (int(s) for s in args.sizes.split(',')):
+        run = run_child(size, args.layout, args.repeat)
+        result['runs'].append(run)
+        print(f"{run['transactions']} transactions ({args.layout}, "
+              f"generated in {run['generate_ms'] / 1000:.1f} s)")
+        for name, times in run['results'].items():
+            print(f"  {name:<34} {times['median_ms']:>10.2f} ms median "
+                  f"{times['min_ms']:>10.2f} ms min")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Load test the pages of the application with many concurrent users.
+
+The app runs in this process on a temporary database filled with
+app.demo. Each simulated user logs in through the login form, with
+CSRF protection enabled, and then sends a mix of requests from its own
+thread through a Flask test client:
+
+- reads of /home, /income, /expense and /balances
+- writes through the /add_transaction form
+
+The latency percentiles and the throughput of each route are reported.
+
+Usage: python benchmarks/load.py [--users 20] [--requests 50]
+       [--transactions 1000] [--write-ratio 0.1] [--layout single]
+       [--json out.json] [--compare baseline.json [--threshold 1.25]]
+
+With --compare, the results are compared to those saved by an earlier
+run with --json, and the exit status is 1 if the p95 latency of any route
+grew, or its throughput fell, by more than the --threshold factor. The
+exit status is also 1 if any request failed.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READ_ROUTES = {'/home': 3, '/income': 2, '/expense': 2, '/balances': 2}
+WRITE_ROUTE = '/add_transaction'
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+# Operations that run in less than this are too noisy to compare
+MIN_COMPARABLE_MS = 1.0
+
+
+def csrf_token(html: bytes) -> str:
+    """Return the CSRF token of the form in a page."""
+    match = CSRF_TOKEN.search(html.decode('utf-8'))
+    if not match:
+        raise ValueError('The page has no CSRF token')
+    return match.group(1)
+
+
+class SimulatedUser:
+    """A logged-in user sending requests through its own test client."""
+    def __init__(self, app, username, password, start_date, end_date, seed):
+        self.client = app.test_client()
+        self.rng = random.Random(seed)
+        self.start_date = start_date
+        self.end_date = end_date
+        # route -> latencies in ms
+        self.latencies = {}
+        self.errors = {}
+        token = csrf_token(self.client.get('/login').data)
+        response = self.client.post('/login', data={
+            'username': username, 'password': password, 'csrf_token': token
+        })
+        if response.status_code != 302:
+            raise ValueError(f"Could not log in as '{username}'")
+        # Show the whole period of the demo data
+        self.client.get(f'/home?startDate={start_date:%Y-%m-%d}'
+                        f'&endDate={end_date:%Y-%m-%d}')
+        self.token = csrf_token(self.client.get(WRITE_ROUTE).data)
+
+    def request(self, write_ratio: float):
+        """Send one request, chosen at random from the workload."""
+        if self.rng.random() < write_ratio:
+            route = WRITE_ROUTE
+            send = self._add_transaction
+        else:
+            route = self.rng.choices(list(READ_ROUTES),
+                                     weights=list(READ_ROUTES.values()))[0]
+            send = lambda: self.client.get(route)
+        start = time.perf_counter()
+        response = send()
+        elapsed = (time.perf_counter() - start) * 1000
+        self.latencies.setdefault(route, []).append(elapsed)
+        # The transaction form is shown again if it is rejected
+        expected = 302 if route == WRITE_ROUTE else 200
+        if response.status_code != expected:
+            self.errors[route] = self.errors.get(route, 0) + 1
+
+    def _add_transaction(self):
+        from app.demo import ACCOUNTS, random_transaction
+        category = self.rng.choice(['incomes', 'expenses'])
+        transaction = random_transaction(
+            category, self.start_date, self.end_date, self.rng
+        )
+        return self.client.post(WRITE_ROUTE, data={
+            'category': category,
+            'amount': transaction['amount'],
+            'account_debited': transaction.get('account_debited', ACCOUNTS[0]),
+            'account_credited': transaction.get('account_credited',
+                                                ACCOUNTS[0]),
+            'subcategory': transaction['subcategory'],
+            'date': transaction['time'],
+            'csrf_token': self.token,
+        })
+
+
+def percentile(latencies: list[float], p: int) -> float:
+    if len(latencies) < 2:
+        return latencies[0]
+    return statistics.quantiles(latencies, n=100, method='inclusive')[p - 1]
+
+
+def run(args) -> dict:
+    """
+    Run the load test in a temporary directory.
+
+    The environment is set up before the app is imported, so that the app
+    opens an empty database there instead of the one in the project.
+    """
+    cwd = tempfile.mkdtemp()
+    path = os.path.join(cwd, 'load.db')
+    os.environ.update(DB_LAYOUT=args.layout, DB_FILE=path, DB_SHARD_DIR=path,
+                      DATABASE_URL='sqlite:///' + path)
+    os.chdir(cwd)
+    sys.path.insert(0, ROOT)
+    from flask import got_request_exception
+    from app import app, db
+    from app.demo import D1, D2, PASSWORD, USERNAME, generate
+
+    # Count the exceptions raised by the views, by type, instead of
+    # logging them
+    exceptions = {}
+
+    def record(sender, exception, **extra):
+        name = type(exception).__name__
+        exceptions[name] = exceptions.get(name, 0) + 1
+    got_request_exception.connect(record, app)
+    app.logger.disabled = True
+
+    generate(db, users=args.users, transactions=args.transactions)
+    db.save()
+    usernames = [USERNAME] + [f'{USERNAME}{i}' for i in range(2, args.users + 1)]
+    users = [
+        SimulatedUser(app, username, PASSWORD, D1, D2, seed=i)
+        for i, username in enumerate(usernames)
+    ]
+
+    # Start every user at the same time
+    barrier = threading.Barrier(len(users) + 1)
+    failures = []
+
+    def drive(user: SimulatedUser):
+        barrier.wait()
+        try:
+            for _ in range(args.requests):
+                user.request(args.write_ratio)
+        except Exception as e:
+            failures.append(repr(e))
+
+    threads = [threading.Thread(target=drive, args=(u,)) for u in users]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route in [*READ_ROUTES, WRITE_ROUTE]:
+        latencies = [ms for u in users for ms in u.latencies.get(route, [])]
+        if not latencies:
+            continue
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': sum(u.errors.get(route, 0) for u in users),
+            'requests_per_sec': len(latencies) / elapsed,
+            **{f'p{p}_ms': percentile(latencies, p) for p in (50, 95, 99)},
+        }
+    return {
+        'python': sys.version.split()[0],
+        'layout': args.layout,
+        'users': args.users,
+        'requests_per_user': args.requests,
+        'transactions_per_user': args.transactions,
+        'write_ratio': args.write_ratio,
+        'elapsed_s': elapsed,
+        'requests_per_sec': sum(r['requests'] for r in routes.values()) / elapsed,
+        'failures': failures,
+        'exceptions': exceptions,
+        'routes': routes,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare two sets of results.
+
+    :return: a description of each route whose p95 latency grew, or whose
+        throughput fell, by more than @threshold times
+    """
+    regressions = []
+    for route, result in current['routes'].items():
+        old = baseline['routes'].get(route)
+        if old is None:
+            continue
+        before, after = old['p95_ms'], result['p95_ms']
+        if max(before, after) >= MIN_COMPARABLE_MS and after > before * threshold:
+            regressions.append(f'{route} p95: {before:.1f} ms -> {after:.1f} ms')
+        before, after = old['requests_per_sec'], result['requests_per_sec']
+        if after * threshold < before:
+            regressions.append(f'{route} throughput: {before:.1f}/s'
+                               f' -> {after:.1f}/s')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=20,
+                        help='the number of concurrent users')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='the number of requests sent by each user')
+    parser.add_argument('--transactions', type=int, default=1000,
+                        help='the number of transactions of each user')
+    parser.add_argument('--write-ratio', type=float, default=0.1,
+                        help='the share of requests that add a transaction')
+    parser.add_argument('--layout', default='single',
+                        choices=['single', 'sharded', 'sqlite'])
+    parser.add_argument('--json', metavar='PATH',
+                        help='also save the results as JSON to PATH')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare the results to a saved baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='the slowdown factor that counts as a regression')
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    result = run(args)
+    print(f"{args.users} users x {args.requests} requests ({args.layout}): "
+          f"{result['requests_per_sec']:.1f} requests/s")
+    print(f"  {'route':<18}{'requests':>9}{'errors':>8}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for route, r in result['routes'].items():
+        print(f"  {route:<18}{r['requests']:>9}{r['errors']:>8}"
+              f"{r['requests_per_sec']:>9.1f}{r['p50_ms']:>9.1f}"
+              f"{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+    for failure in result['failures']:
+        print(f'FAILED: {failure}')
+    for exception, count in result['exceptions'].items():
+        print(f'EXCEPTION ({count}x): {exception}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    failed = bool(result['failures']) or any(
+        r['errors'] for r in result['routes'].values()
+    )
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Measure the cost of starting the application.
+
+Each run imports the app in a fresh interpreter, in an empty working
+directory so that no existing database is loaded, and records:
+
+- the time taken by `import app`
+- the resident set size of the process after the import
+- which heavy libraries were imported as a side effect
+
+Usage: python benchmarks/startup.py [--runs N] [--module app] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'seaborn')
+
+# Runs in the child interpreter and prints its measurements as JSON
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(json.dumps({{
+    'import_ms': elapsed * 1000,
+    'rss_mb': rss / 1024,
+    'loaded': [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_once(module: str) -> dict:
+    """Import @module in a new interpreter and return its measurements."""
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='1')
+    with tempfile.TemporaryDirectory() as cwd:
+        out = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='the number of interpreters to start')
+    parser.add_argument('--module', default='app',
+                        help='the module to import')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    # The first run warms the OS file cache and is not counted
+    run_once(args.module)
+    runs = [run_once(args.module) for _ in range(args.runs)]
+    import_ms = [r['import_ms'] for r in runs]
+    rss_mb = [r['rss_mb'] for r in runs]
+    result = {
+        'module': args.module,
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'import_ms': {'median': statistics.median(import_ms),
+                      'min': min(import_ms), 'max': max(import_ms)},
+        'rss_mb': {'median': statistics.median(rss_mb),
+                   'min': min(rss_mb), 'max': max(rss_mb)},
+        'heavy_modules_loaded': runs[-1]['loaded'],
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"import {result['module']} ({args.runs} runs, Python {result['python']})")
+    print(f"  import time: {result['import_ms']['median']:.1f} ms median "
+          f"({result['import_ms']['min']:.1f}-{result['import_ms']['max']:.1f})")
+    print(f"  RSS:         {result['rss_mb']['median']:.1f} MB median")
+    print(f"  loaded:      {', '.join(result['heavy_modules_loaded']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+"""
+Chart rendering, kept apart from the app package.
+
+The worker processes of a ChartRenderer are started with 'spawn', and
+import the module of each chart function they are sent. Importing a
+module under app would first run app/__init__.py, which creates the
+Flask app and loads every library it uses. The modules of this package
+must not import the app, so that the workers only load the plotting
+libraries.
+"""
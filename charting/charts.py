@@ -0,0 +1,185 @@
+"""
+Chart rendering functions.
+
+Charts are drawn with the object-oriented matplotlib API instead of pyplot,
+so no global figure state is involved: each function creates its own
+Figure, encodes it and clears it. This makes the functions safe to call
+from several threads or from the worker processes of a ChartRenderer.
+
+Like the rest of the charting package, this module must not import the
+app package. See charting/__init__.py.
+"""
+from __future__ import annotations
+from io import BytesIO
+from typing import TYPE_CHECKING
+import base64
+from .lazy import LazyModule
+
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+    import pandas as pd
+else:
+    pd = LazyModule('pandas')
+
+# matplotlib and seaborn are only imported when the first chart is drawn
+mpl_figure = LazyModule('matplotlib.figure')
+mpl_patches = LazyModule('matplotlib.patches')
+sns = LazyModule('seaborn')
+
+# Style applied to every chart. Kept here instead of in matplotlib's global
+# rcParams, which are shared by all threads.
+# Increase the bottom axis padding to prevent rotated tick marks from
+# being truncated.
+SUBPLOT_BOTTOM = 0.25
+TITLE_SIZE = 14
+LABEL_SIZE = 14
+MARKER = 'o'
+TICK_ROTATION = 60
+
+
+def fig_to_base64(fig: Figure, format='svg') -> str:
+    f"""
+    Encode a matplotlib Figure object to base64.
+
+    The figure is cleared afterwards to release its artists.
+
+    :param fig: the Figure instance to be encoded
+    :param format: the format of the encoded output. Options: 'svg', 'png'
+    :return: an utf-8 encoded string representation of {fig}
+    """
+    buffer = BytesIO()
+    try:
+        fig.savefig(buffer, format=format)
+        encoded = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    finally:
+        buffer.close()
+        fig.clear()
+    return encoded
+
+
+def _new_figure(**kwargs) -> tuple[Figure, Axes]:
+    """Create a figure with a single set of axes."""
+    fig = mpl_figure.Figure(**kwargs)
+    fig.subplots_adjust(bottom=SUBPLOT_BOTTOM)
+    return fig, fig.subplots()
+
+
+def pie_chart(x: list[int | float], labels: list[str], title: str = '') -> str:
+    """
+    Plot pie chart with the given data.
+
+    :param x: a list of numerical data to be plotted
+    :param labels: a list of labels associated with the x values
+    :param title: title to use for the chart
+    :return: a base64-encoded pie chart of the data
+    """
+    if not x:
+        return ''
+    assert len(x) == len(labels), "'x' and 'labels' must have equal length"
+    fig, ax = _new_figure()
+    ax.pie(x, labels=labels, autopct='%1.1f%%', startangle=90)
+    ax.set_title(title, fontsize=TITLE_SIZE)
+    return fig_to_base64(fig)
+
+
+def monthly_cash_flows(incomes: pd.Series, expenses: pd.Series,
+                       title: str = '') -> str:
+    """
+    Plot line graphs of monthly incomes and expenses on the same chart.
+
+    :param incomes: timeseries of total monthly incomes
+    :param expenses: timeseries of total monthly expenses
+    :param title: the title to give to the graph
+    :return: a base64-encoded line chart of the data
+    """
+    if incomes.shape[0] < 2 or expenses.shape[0] < 2:
+        # Do not plot if either Series does not have enough data.
+        return ''
+    data = pd.concat({'Total Monthly Income': incomes,
+                      'Total Monthly Expenses': expenses}, axis=1)
+    return multiline_plot(data, title, marker=MARKER)
+
+
+def line_plot(data: pd.Series, title: str = '') -> str:
+    """
+    Create a single line plot using the data.
+    """
+    if data.empty or data is None:
+        return ''
+    # Cannot draw line graph with only one point
+    if data.shape[0] < 2:
+        return ''
+    fig, ax = _new_figure()
+
+    ax.plot(data, marker=MARKER)
+    ax.set_title(title, fontsize=TITLE_SIZE)
+    ax.tick_params(axis='x', labelrotation=TICK_ROTATION)
+    return fig_to_base64(fig)
+
+
+def bar_plot(x: list[int | float], labels: list[str], title: str = '') -> str:
+    """
+    Plot a bar plot with the given data.
+
+    :param x: a list of numerical data to be plotted
+    :param labels: a list of labels associated with the x values
+    :param title: title to use for the chart
+    :return: a base64-encoded bar chart of the data
+    """
+    if not x or len(x) < 2:
+        return ''
+    fig, ax = _new_figure()
+    ax.set_xlabel('Amount', fontsize=LABEL_SIZE)
+    ax.set_title(title, fontsize=TITLE_SIZE)
+    sns.barplot(x=x, y=labels, orient='h', ax=ax)
+    return fig_to_base64(fig)
+
+
+def donut_chart(x, labels, title='') -> str:
+    if not x or len(x) < 2:
+        return ''
+    fig = mpl_figure.Figure(figsize=(7, 7))
+    ax = fig.subplots()
+    ax.pie(x, labels=None, autopct='%1.0f%%', startangle=90,
+           textprops={'fontsize': 12})
+
+    # Draw circle in the center
+    centre_circle = mpl_patches.Circle((0, 0), 0.7, color='black', fc='white', linewidth=0)
+    ax.add_artist(centre_circle)
+    # Equal aspect ratio ensures that pie is drawn as a circle
+    ax.axis('equal')
+    # Use bbox_to_anchor=(1.3, 0.7) to place the legend to the right.
+    # Use y=0.3 to place it bottom right if font is increased
+    ax.legend(labels, loc='upper right',
+              bbox_to_anchor=(1.3, 0.3), fontsize=12
+    )
+    # Adjust the position of `ax` within `fig` to leave room for the legend
+    fig.subplots_adjust(left=0, right=0.7, top=1, bottom=0)
+    ax.set_title(title, fontsize=TITLE_SIZE)
+    return fig_to_base64(fig)
+
+
+def multiline_plot(data: pd.DataFrame, title='', marker='') -> str:
+    """
+    Create a multi-line plot.
+
+    :param data: a DataFrame with a column for each line. The column names
+        are used as labels, and each line is drawn over the rows in which
+        its column is not NaN
+    :param title: title to place above the plot
+    :param marker: the matplotlib marker drawn at each data point
+    :return: a base64-encoded plot of the data
+    """
+    # Series with less than 2 data points cannot be drawn as a line
+    lines = [(data[label].dropna(), label) for label in data.columns]
+    lines = [(series, label) for series, label in lines if series.shape[0] >= 2]
+    if not lines:
+        return ''  # No lines were plotted
+    fig, ax = _new_figure()
+    for series, label in lines:
+        ax.plot(series.sort_index(), label=label, marker=marker)
+    ax.set_title(title, fontsize=TITLE_SIZE)
+    ax.tick_params(axis='x', labelrotation=TICK_ROTATION)
+    ax.legend()
+    return fig_to_base64(fig)
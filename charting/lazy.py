@@ -0,0 +1,55 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    A stand-in for a module that is only imported on first use.
+
+    Heavy libraries such as pandas add hundreds of milliseconds to the
+    start-up time of every process that imports the app, including CLI
+    commands that never draw a chart. Binding them with
+    `pd = LazyModule('pandas')` defers that cost to the first attribute
+    access.
+    """
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        # Only called for attributes not found on the instance, so
+        # _name and _module never get here
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<LazyModule '{self._name}' ({state})>"
+
+
+class LazyObject:
+    """
+    A stand-in for an object that is only created on first use.
+
+    `db = LazyObject(lambda: create_engine(app.config))` lets modules
+    import the app without opening, or creating, the database files in
+    the current directory. The object is created by @factory the first
+    time one of its attributes is accessed.
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._object = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._object is None:
+            with self._lock:
+                if self._object is None:
+                    self._object = self._factory()
+        return getattr(self._object, attr)
+
+    def __repr__(self):
+        if self._object is None:
+            return '<LazyObject (not created)>'
+        return f'<LazyObject {self._object!r}>'
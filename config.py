@@ -13,6 +13,58 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
 
+    # 'single' keeps all users in DB_FILE. 'sharded' keeps one file per
+    # user in DB_SHARD_DIR and caches up to DB_SHARD_CACHE_BYTES of them.
+    # 'sqlite' stores everything in the database at SQLALCHEMY_DATABASE_URI.
+    DB_LAYOUT = os.environ.get('DB_LAYOUT') or 'single'
+    DB_FILE = os.environ.get('DB_FILE') or 'db.json'
+    DB_SHARD_DIR = os.environ.get('DB_SHARD_DIR') or 'db_shards'
+    DB_SHARD_CACHE_BYTES = int(
+        os.environ.get('DB_SHARD_CACHE_BYTES') or 64 * 1024 * 1024
+    )
+    # Append changes to a write-ahead log instead of rewriting db.json on
+    # every save (single layout only). The log is compacted into db.json
+    # once it reaches DB_JOURNAL_COMPACT_BYTES.
+    DB_JOURNAL = bool(os.environ.get('DB_JOURNAL'))
+    DB_JOURNAL_COMPACT_BYTES = int(
+        os.environ.get('DB_JOURNAL_COMPACT_BYTES') or 1024 * 1024
+    )
+    # Save changes in the background, in batches, at most every
+    # DB_GROUP_COMMIT_MS milliseconds, or as soon as DB_GROUP_COMMIT_SIZE
+    # changes are waiting (single layout only). 0 saves them right away.
+    DB_GROUP_COMMIT_MS = int(os.environ.get('DB_GROUP_COMMIT_MS') or 0)
+    DB_GROUP_COMMIT_SIZE = int(os.environ.get('DB_GROUP_COMMIT_SIZE') or 100)
+
+    # Rendered charts are cached in memory up to CHART_CACHE_BYTES. Set
+    # CHART_CACHE_DIR to also share them between worker processes through
+    # a directory that is kept under CHART_CACHE_DISK_BYTES.
+    CHART_CACHE_BYTES = int(
+        os.environ.get('CHART_CACHE_BYTES') or 32 * 1024 * 1024
+    )
+    CHART_CACHE_DIR = os.environ.get('CHART_CACHE_DIR')
+    CHART_CACHE_DISK_BYTES = int(
+        os.environ.get('CHART_CACHE_DISK_BYTES') or 256 * 1024 * 1024
+    )
+
+    # Charts are rendered in CHART_WORKERS worker processes, each replaced
+    # after CHART_WORKER_MAX_TASKS charts. The pool is started by the first
+    # page with charts, so CLI commands never start it. With 0 workers,
+    # charts are rendered in the request thread. A chart taking longer
+    # than CHART_TIMEOUT seconds is left empty.
+    CHART_WORKERS = int(os.environ.get('CHART_WORKERS') or 2)
+    CHART_TIMEOUT = float(os.environ.get('CHART_TIMEOUT') or 10)
+    CHART_WORKER_MAX_TASKS = int(
+        os.environ.get('CHART_WORKER_MAX_TASKS') or 200
+    )
+
+    # 'server' embeds charts rendered by matplotlib in the pages. 'client'
+    # serves the data behind the charts from /api/charts/<page> and draws
+    # them in the browser.
+    CHART_MODE = os.environ.get('CHART_MODE') or 'server'
+
+    # The number of top subcategories shown on the incomes and expenses pages
+    CHART_TOP_SUBCATEGORIES = int(os.environ.get('CHART_TOP_SUBCATEGORIES') or 3)
+
     # Flask_Session config options
     SESSION_USE_SIGNER = True
     SESSION_TYPE = 'filesystem'
@@ -0,0 +1,32 @@
+import os
+import pytest
+
+# Render charts in the test process. Set before the app reads its config.
+os.environ.setdefault('CHART_WORKERS', '0')
+
+from app.models.engine import DBEngine, ShardedDBEngine, SQLiteEngine
+from app.models.user import User
+
+LAYOUTS = ('single', 'sharded', 'sqlite')
+
+
+def create_engine(layout, directory):
+    """Create an engine of @layout with its files in @directory."""
+    if layout == 'single':
+        return DBEngine(os.path.join(directory, 'db.json'))
+    if layout == 'sharded':
+        return ShardedDBEngine(os.path.join(directory, 'shards'))
+    return SQLiteEngine(os.path.join(directory, 'db.sqlite'))
+
+
+def add_user(engine, username, **balances):
+    """Add a user with a 'personal' profile holding accounts @balances."""
+    engine.add_user(User(username, f'{username}@example.com', 'hash'))
+    for account, balance in balances.items():
+        engine.add_account(username, 'personal', account, balance)
+
+
+@pytest.fixture(params=LAYOUTS)
+def engine(request, tmp_path):
+    """An empty engine of each layout."""
+    return create_engine(request.param, str(tmp_path))
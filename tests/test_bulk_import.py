@@ -0,0 +1,123 @@
+import io
+import pytest
+from werkzeug.security import generate_password_hash
+from app import app
+from app.models.engine import DBEngine
+from app.models.user import User
+from app.utils import bulk_import
+from app.utils.bulk_import import import_transactions
+from .conftest import add_user
+
+OFX = ('OFXHEADER:100\nDATA:OFXSGML\n<OFX><BANKTRANLIST>{}</BANKTRANLIST></OFX>\n')
+OFX_TRANSACTION = '<STMTTRN><TRNAMT>{}<DTPOSTED>{}<NAME>{}</STMTTRN>'
+# Longer than the largest field the csv module accepts
+HUGE_FIELD = 'x' * 200_000
+
+
+@pytest.fixture
+def account(engine, monkeypatch):
+    """A 'cash' account in the profile imported into."""
+    monkeypatch.setattr(bulk_import, 'db', engine)
+    add_user(engine, 'u', cash=100)
+    engine.save()
+    return 'cash'
+
+
+def run(text, format='csv', account='cash'):
+    return import_transactions('u', 'personal', io.StringIO(text), format, account)
+
+
+def test_csv_bad_rows_are_reported(engine, account):
+    report = run('Date,Amount,Category,Subcategory\n'
+                 '2024-01-02,-50,,food\n'
+                 '2024-02-30,1,,\n'
+                 '2024-01-01,100,income,pay\n'
+                 '2024-01-03,abc,,\n'
+                 '2024-01-04,5,gift,\n'
+                 '2024-01-05,500,expense,\n')
+
+    assert report.imported == 2
+    assert [line for line, _ in report.errors] == [3, 5, 6, 7]
+    assert 'Invalid date' in report.errors[0][1]
+    assert 'Invalid amount' in report.errors[1][1]
+    assert "category 'gift'" in report.errors[2][1]
+    assert engine.get_account_balance('u', 'personal', account) == 150
+
+
+@pytest.mark.parametrize('text', [
+    f'date,amount\n2024-01-01,5\n"{HUGE_FIELD}",1\n',
+    f'date,"{HUGE_FIELD}"\n2024-01-01,5\n',
+])
+def test_malformed_csv_raises_value_error(engine, account, text):
+    with pytest.raises(ValueError, match='Malformed CSV file at line'):
+        run(text)
+    assert engine.get_transactions('u', 'personal') == []
+
+
+def test_ofx_is_imported(engine, account):
+    report = run(OFX.format(
+        OFX_TRANSACTION.format('-20.50', '20240102120000', 'Food')
+        + OFX_TRANSACTION.format('40', '20240101', 'Salary')
+        + OFX_TRANSACTION.format('1', 'garbage', 'x')
+    ), format='ofx')
+
+    assert report.imported == 2
+    assert [line for line, _ in report.errors] == [3]
+    assert engine.get_account_balance('u', 'personal', account) == 119.5
+
+
+@pytest.mark.parametrize('text, message', [
+    ('date,amount\n2024-01-01,5\n', 'not an OFX file'),
+    (OFX.format('<STMTTRN><TRNAMT>5'), 'transaction 1 has no closing'),
+    (OFX.format(OFX_TRANSACTION.format('5', '20240101', 'a')
+                + '<STMTTRN><TRNAMT>3'), 'transaction 2 has no closing'),
+])
+def test_malformed_ofx_raises_value_error(engine, account, text, message):
+    with pytest.raises(ValueError, match=message):
+        run(text, format='ofx')
+    assert engine.get_transactions('u', 'personal') == []
+
+
+def test_unknown_format_or_account_raises_value_error(engine, account):
+    with pytest.raises(ValueError, match='Unknown import format'):
+        run('date,amount\n', format='qif')
+    with pytest.raises(ValueError, match="account 'savings' does not exist"):
+        run('date,amount\n', account='savings')
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A test client logged in as 'u', whose data is in a fresh engine."""
+    # Imported here: collecting the tests would otherwise create the app's
+    # engine, in the working directory, by looking up attributes on it
+    from app import db
+    engine = DBEngine(str(tmp_path / 'db.json'))
+    engine.add_user(User('u', 'u@example.com', generate_password_hash('pw')))
+    engine.add_account('u', 'personal', 'cash', 100)
+    engine.save()
+    monkeypatch.setattr(db, '_object', engine)
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    client = app.test_client()
+    client.post('/login', data={'username': 'u', 'password': 'pw'})
+    return client
+
+
+@pytest.mark.parametrize('filename, data, message', [
+    ('bank.csv', f'date,amount\n"{HUGE_FIELD}",1\n', 'Malformed CSV file'),
+    ('bank.ofx', 'date,amount\n2024-01-01,5\n', 'not an OFX file'),
+])
+def test_import_page_reports_malformed_file(client, filename, data, message):
+    response = client.post('/import_transactions', data={
+        'file': (io.BytesIO(data.encode()), filename), 'account': 'cash',
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert message in response.get_data(as_text=True)
+
+
+def test_import_command_reports_malformed_file(client, tmp_path):
+    path = tmp_path / 'bank.csv'
+    path.write_text(f'date,amount\n"{HUGE_FIELD}",1\n')
+    result = app.test_cli_runner().invoke(
+        args=['import-transactions', 'u', str(path), '--account', 'cash'])
+    assert result.exit_code == 1
+    assert 'Malformed CSV file at line 2' in result.output
@@ -0,0 +1,149 @@
+import threading
+import pytest
+from app.models.engine import DBEngine, ShardedDBEngine
+from app.models.engine.db_engine import IntegrityError
+from .conftest import add_user
+
+
+def spend(engine, amount, account='cash', **details):
+    engine.add_transaction('u', 'personal', 'expenses', amount=amount,
+                           account_credited=account, **details)
+
+
+def earn(engine, amount, account='bank', **details):
+    engine.add_transaction('u', 'personal', 'incomes', amount=amount,
+                           account_debited=account, **details)
+
+
+@pytest.fixture(params=['plain', 'journal', 'sharded'])
+def open_engine(request, tmp_path):
+    """Open an engine on a database shared by every engine it opens."""
+    def open_engine(**kwargs):
+        if request.param == 'sharded':
+            return ShardedDBEngine(str(tmp_path / 'shards'))
+        return DBEngine(str(tmp_path / 'db.json'),
+                        journal=request.param == 'journal', **kwargs)
+    return open_engine
+
+
+def test_conflicting_save_is_rebased(open_engine):
+    a = open_engine()
+    add_user(a, 'u', cash=100, bank=0)
+    spend(a, 10, time='2023-01-01')
+    spend(a, 20, time='2023-01-02')
+    a.save().result()
+    b = open_engine()
+    first, second = b.get_transactions('u', 'personal')
+    b.rollback_transaction('u', 'personal', first['id'])
+    b.edit_transaction('u', 'personal', second['id'], amount=5)
+    earn(a, 1, account='cash', time='2023-01-03')
+    a.save().result()
+
+    b.save().result()
+
+    assert b.lock_stats['conflicts'] == 1
+    engine = open_engine()
+    assert engine.get_account_balance('u', 'personal', 'cash') == 96
+    assert [(t['id'], t['amount']) for t in engine.get_transactions('u', 'personal')] \
+        == [(second['id'], 5), (a.get_transactions('u', 'personal')[-1]['id'], 1)]
+
+
+def test_failed_replay_discards_only_the_failed_changes(open_engine):
+    a = open_engine()
+    add_user(a, 'u', cash=10, bank=0)
+    a.save().result()
+    b = open_engine()
+    b.get_user_by_username('u')
+    spend(a, 8)
+    a.save().result()
+    # Valid when made, but the balance would be negative on top of a's
+    spend(b, 5)
+
+    with pytest.raises(IntegrityError):
+        b.save()
+
+    for engine in (b, open_engine()):
+        assert engine.get_all_account_balances('u', 'personal') == {'cash': 2, 'bank': 0}
+
+
+def test_replayed_transaction_keeps_its_id(open_engine):
+    a = open_engine()
+    add_user(a, 'u', cash=0, bank=0)
+    a.save().result()
+    b = open_engine()
+    b.get_user_by_username('u')
+    earn(b, 3)
+    trans_id = b.get_transactions('u', 'personal')[0]['id']
+    earn(a, 1)
+    a.save().result()
+
+    b.save().result()
+
+    assert b.lock_stats['conflicts'] == 1
+    other_id = a.get_transactions('u', 'personal')[0]['id']
+    for engine in (b, open_engine()):
+        ids = {t['id'] for t in engine.get_transactions('u', 'personal')}
+        assert ids == {trans_id, other_id}
+
+
+@pytest.mark.parametrize('group_commit_ms', [0, 60000])
+def test_failed_replay_only_fails_its_own_thread(tmp_path, group_commit_ms):
+    path = str(tmp_path / 'db.json')
+    a = DBEngine(path, group_commit_ms=group_commit_ms)
+    add_user(a, 'u', cash=10, bank=0)
+    a.flush() if group_commit_ms else a.save()
+    other = DBEngine(path)
+    spend(other, 8)
+    other.save().result()
+
+    results = {}
+
+    def run(name, change, amount):
+        try:
+            change(a, amount)
+            results[name] = a.save()
+        except IntegrityError as e:
+            results[name] = e
+
+    for name, change, amount in [('t1', earn, 1), ('t2', spend, 5), ('t3', earn, 2)]:
+        thread = threading.Thread(target=run, args=(name, change, amount))
+        thread.start()
+        thread.join()
+    if group_commit_ms:
+        # Nothing was saved yet, so the three calls are replayed together
+        a.flush()
+
+    # With group commit, t2 fails when its call is replayed by the flush.
+    # Without, t1 rebases its call on save(), and t2 then finds the cash
+    # already spent.
+    errors = {name: result if isinstance(result, Exception) else result.exception()
+              for name, result in results.items()}
+    assert errors['t1'] is None and errors['t3'] is None
+    assert isinstance(errors['t2'], IntegrityError)
+    assert DBEngine(path).get_all_account_balances('u', 'personal') \
+        == {'cash': 2, 'bank': 3}
+
+
+def test_group_commit_saves_the_changes_of_all_threads_at_once(tmp_path):
+    path = str(tmp_path / 'db.json')
+    engine = DBEngine(path, group_commit_ms=60000)
+    add_user(engine, 'u', cash=0, bank=0)
+    futures = []
+
+    def run(amount):
+        earn(engine, amount)
+        futures.append(engine.save())
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Nothing is on disk until the flush
+    assert not any(future.done() for future in futures)
+    assert DBEngine(path).get_all_usernames() == []
+
+    engine.flush()
+
+    assert all(future.result() is None for future in futures)
+    assert DBEngine(path).get_account_balance('u', 'personal', 'bank') == 36
@@ -0,0 +1,86 @@
+import json
+import os
+from app.models.engine import DBEngine
+from .conftest import add_user
+
+
+def balance(engine):
+    return engine.get_account_balance('u', 'personal', 'cash')
+
+
+def deposit(engine, amount=5, day=1):
+    engine.add_transaction('u', 'personal', 'incomes', amount=amount,
+                           account_debited='cash', time=f'2024-01-{day:02d}')
+    engine.save().result()
+
+
+def test_reload_replays_journal_of_other_engine(tmp_path):
+    path = str(tmp_path / 'db.json')
+    a = DBEngine(path, journal=True)
+    add_user(a, 'u', cash=100)
+    a.save().result()
+    b = DBEngine(path, journal=True)
+    for day in range(1, 4):
+        deposit(a, day=day)
+
+    # Only the new records are read, not db.json
+    assert not b.reload()
+    assert b.reload_stats['replayed'] == 1
+    assert balance(b) == 115
+    assert len(b.get_transactions('u', 'personal')) == 3
+    assert 'u' not in json.load(open(path))
+
+
+def test_engines_see_each_others_journaled_changes(tmp_path):
+    path = str(tmp_path / 'db.json')
+    a = DBEngine(path, journal=True)
+    add_user(a, 'u', cash=100)
+    a.save().result()
+    b = DBEngine(path, journal=True)
+    for day in range(1, 11):
+        deposit(a if day % 2 else b, day=day)
+
+    for engine in (a, b, DBEngine(path, journal=True)):
+        engine.reload()
+        assert balance(engine) == 150
+        ids = [t['id'] for t in engine.get_transactions('u', 'personal')]
+        assert len(set(ids)) == 10
+
+
+def test_compaction_folds_journal_into_snapshot(tmp_path):
+    path = str(tmp_path / 'db.json')
+    a = DBEngine(path, journal=True, compact_threshold=2000)
+    add_user(a, 'u', cash=100)
+    a.save().result()
+    b = DBEngine(path, journal=True)
+    for day in range(1, 21):
+        deposit(a, day=day)
+
+    # The journal was compacted at least once along the way
+    assert os.path.getsize(path + '.log') < 2000
+    assert json.load(open(path))['u']
+    b.reload()
+    assert balance(b) == 200
+    assert balance(DBEngine(path, journal=True)) == 200
+    assert balance(DBEngine(path)) == balance(DBEngine(path, journal=True))
+
+    a.compact()
+    assert os.path.getsize(path + '.log') == 0
+    assert balance(DBEngine(path)) == 200
+
+
+def test_replay_skips_records_in_snapshot_and_torn_record(tmp_path):
+    path = str(tmp_path / 'db.json')
+    a = DBEngine(path, journal=True)
+    add_user(a, 'u', cash=100)
+    deposit(a)
+    a.compact()
+    # As if a crash had left records of the snapshot in the journal,
+    # followed by a record that was only partly written
+    with open(path + '.log', 'a') as f:
+        f.write(json.dumps({'seq': 1, 'op': 'delete', 'path': ['u']}) + '\n')
+        f.write('{"seq": 999, "op"')
+
+    engine = DBEngine(path, journal=True)
+    assert engine.get_all_usernames() == ['u']
+    assert balance(engine) == 105
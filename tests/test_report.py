@@ -0,0 +1,86 @@
+import random
+from collections import defaultdict
+from datetime import datetime
+import pytest
+from app.models.engine.db_engine import parse_date_range
+from app.utils import report as report_module
+from app.utils.report import Report
+from .conftest import add_user
+
+RANGES = [(None, None), ('2023-03-04', '2023-05-06T12:00:00'),
+          ('2022-01-01', '2023-12-31'), ('2030-01-01', '2030-02-01')]
+
+
+@pytest.fixture
+def transactions(engine, monkeypatch):
+    """Add random transactions to @engine and make it the app's engine."""
+    monkeypatch.setattr(report_module, 'db', engine)
+    add_user(engine, 'u', cash=10 ** 7, bank=10 ** 7)
+    rng = random.Random(3)
+    added = []
+    for _ in range(400):
+        category = rng.choice(['incomes', 'expenses', 'transfers'])
+        details = {
+            'amount': rng.choice([rng.randint(1, 500),
+                                  round(rng.uniform(0.01, 90), 2)]),
+            'account_debited': 'cash', 'account_credited': 'bank',
+            'subcategory': rng.choice(['food', 'rent', '', None]),
+            'time': f'{rng.randint(2022, 2024)}-{rng.randint(1, 12):02d}-'
+                    f'{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:30:00',
+        }
+        engine.add_transaction('u', 'personal', category, **details)
+        added.append((category, details))
+    engine.save()
+    return added
+
+
+def in_range(transactions, category, from_, to):
+    """Return the added transactions of @category within [from_, to]."""
+    lo, hi = parse_date_range(from_, to) if from_ or to else (None, None)
+    return [t for c, t in transactions if c == category
+            and (lo is None or datetime.fromisoformat(t['time']) >= lo)
+            and (hi is None or datetime.fromisoformat(t['time']) <= hi)]
+
+
+def units(amount) -> int:
+    """Truncate an amount to whole units, as reports do."""
+    return round(amount * 100) // 100
+
+
+@pytest.mark.parametrize('from_, to', RANGES)
+def test_totals_match_brute_force(transactions, from_, to):
+    report = Report('u', 'personal', from_, to)
+    for category in ('incomes', 'expenses'):
+        expected = in_range(transactions, category, from_, to)
+        assert report.total(category) == sum(units(t['amount']) for t in expected)
+
+        subcategories = defaultdict(int)
+        for t in expected:
+            subcategories[t['subcategory'] or 'Uncategorized'] += units(t['amount'])
+        assert report.subcategory_totals(category) == dict(subcategories)
+
+
+@pytest.mark.parametrize('from_, to', RANGES)
+def test_monthly_matrix_matches_brute_force(transactions, from_, to):
+    report = Report('u', 'personal', from_, to)
+    expected = defaultdict(float)
+    for t in in_range(transactions, 'expenses', from_, to):
+        if t['subcategory']:
+            expected[(t['time'][:7], t['subcategory'])] += t['amount']
+
+    months, matrix = report.monthly_matrix('expenses', ['food', 'rent'])
+
+    # The months run from the first to the last with transactions
+    with_transactions = sorted({month for month, _ in expected})
+    assert months[:1] + months[-1:] == with_transactions[:1] + with_transactions[-1:]
+    for i, month in enumerate(months):
+        for j, subcategory in enumerate(['food', 'rent']):
+            assert matrix[i, j] == pytest.approx(expected[(month, subcategory)])
+
+
+def test_totals_see_new_transactions(transactions, engine):
+    before = Report('u', 'personal').total('incomes')
+    engine.add_transaction('u', 'personal', 'incomes', amount=12.75,
+                           account_debited='cash', time='2023-06-01')
+    engine.save()
+    assert Report('u', 'personal').total('incomes') == before + 12
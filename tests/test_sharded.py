@@ -0,0 +1,89 @@
+import random
+import sys
+import threading
+import time
+import pytest
+from app.models.engine import ShardedDBEngine
+from .conftest import add_user
+
+USERS = 20
+ACCOUNTS = ('a', 'b', 'c')
+
+
+@pytest.fixture
+def fast_switching():
+    """Switch threads as often as possible, to bring out races."""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_reads_from_several_threads(tmp_path, fast_switching):
+    path = str(tmp_path / 'shards')
+    # A cache too small for every user, so shards are evicted and read
+    # again while other threads use them
+    engine = ShardedDBEngine(path, cache_bytes=4096)
+    for u in range(USERS):
+        add_user(engine, f'u{u}', **dict.fromkeys(ACCOUNTS, 1000))
+    engine.save()
+    stop = threading.Event()
+    errors, violations = [], []
+
+    def write():
+        rng = random.Random(0)
+        i = 0
+        while not stop.is_set():
+            credited, debited = rng.sample(ACCOUNTS, 2)
+            try:
+                engine.add_transaction(f'u{rng.randrange(USERS)}', 'personal',
+                                       'transfers', amount=1,
+                                       account_credited=credited,
+                                       account_debited=debited,
+                                       time=f'2024-01-{i % 28 + 1:02d}')
+                if i % 20 == 0:
+                    engine.save()
+            except Exception as e:
+                errors.append(e)
+            i += 1
+
+    def read(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            username = f'u{rng.randrange(USERS)}'
+            try:
+                engine.reload()
+                # Transfers move money between the accounts of a user, and
+                # are listed once under each account
+                balances = engine.get_all_account_balances(username, 'personal')
+                if sum(balances.values()) != 3000:
+                    violations.append((username, balances))
+                if len(engine.get_transactions(username, 'personal')) % 2:
+                    violations.append((username, 'transactions'))
+                if len(engine.get_columns(username, 'personal')) % 2:
+                    violations.append((username, 'columns'))
+                user = engine.get_user_by_username(username)
+                if engine.get_user_by_id(user.id).username != username:
+                    violations.append((username, 'id'))
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=write)]
+    threads += [threading.Thread(target=read, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    time.sleep(2)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.save()
+
+    assert errors == []
+    assert violations == []
+    fresh = ShardedDBEngine(path)
+    for u in range(USERS):
+        username = f'u{u}'
+        assert fresh.get_all_account_balances(username, 'personal') \
+            == engine.get_all_account_balances(username, 'personal')
+        assert len(fresh.get_transactions(username, 'personal')) \
+            == len(engine.get_transactions(username, 'personal'))